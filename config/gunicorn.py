@@ -0,0 +1,10 @@
+"""
+Gunicorn settings used in production (see entrypoint.prod.sh)
+"""
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Clean up the metric files of a stopped worker (its counters and histograms stay in the totals,
+    # see market/metrics.py)
+    multiprocess.mark_process_dead(worker.pid)
@@ -28,6 +28,19 @@ DEBUG = int(os.environ.get("DEBUG", default=0))
 
 ALLOWED_HOSTS = os.getenv("DJANGO_ALLOWED_HOSTS", "").split(" ")
 
+# What to do when a view makes more queries than its budget (see market/querybudget.py): 'off', 'log' or 'raise'
+QUERY_BUDGET_MODE = os.environ.get("QUERY_BUDGET_MODE", "raise" if DEBUG else "off")
+
+# Prometheus can read /metrics with the header "Authorization: Bearer <METRICS_TOKEN>" (see market/metrics.py)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Is the round scheduler running (manage.py run_scheduler, see market/scheduler.py)? Then the monitor
+# page leaves auto-pilot to the scheduler instead of finishing rounds from the browser.
+ROUND_SCHEDULER = int(os.environ.get("ROUND_SCHEDULER", default=0))
+
+# Where profiles of requests made with ?profile=1 by staff users are stored (see market/profiling.py)
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", BASE_DIR / "profiles"))
+
 # Where to find translation files
 # LOCALE_PATHS = (os.path.join(os.path.dirname(
 #     os.path.realpath(__name__)), 'locale'), )
@@ -62,11 +75,15 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'market.metrics.MetricsMiddleware',
+    'market.querybudget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'market.dbrouter.ReplicaMiddleware',
+    'market.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -107,6 +124,22 @@ DATABASES = {
     }
 }
 
+# A read replica of the database, used by the polled views and the GET of the play and monitor pages
+# (see market/dbrouter.py). In the tests the replica is the test database of 'default'.
+REPLICA_HOST = os.environ.get("POSTGRES_REPLICA_HOST")
+if REPLICA_HOST:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': REPLICA_HOST,
+        'TEST': {'MIRROR': 'default'},
+    }
+REPLICA_DATABASE = 'replica' if REPLICA_HOST else None
+
+# How long a browser reads from the primary after a POST, so it sees its own writes (longer than the replica lag)
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", default=5))
+
+DATABASE_ROUTERS = ['market.dbrouter.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -17,6 +17,9 @@ from django.contrib import admin
 from django.urls import include, path
 from django.conf import settings
 
+from market.metrics import metrics
+from market.profiling import profile_file, profiles
+
 urlpatterns = [
     # Django admin
     #path('admin/', admin.site.urls),
@@ -24,6 +27,13 @@ urlpatterns = [
     # User management
     path('accounts/', include('allauth.urls')),
 
+    # Prometheus metrics
+    path('metrics', metrics, name='metrics'),
+
+    # Profiles of single requests (staff only)
+    path('profiles/', profiles, name='profiles'),
+    path('profiles/<name>.<extension>', profile_file, name='profile_file'),
+
     # Local apps
     path('', include('market.urls')),
 ]
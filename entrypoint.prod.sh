@@ -5,10 +5,20 @@ set -e
 echo "${0}: running migrations."
 python manage.py migrate
 
+echo "${0}: creating the partitions of the coming months."
+python manage.py partitions
+
 echo "${0}: collecting static files."
 python manage.py collectstatic --noinput --clear
 
 echo "${0}: running production server."
 mkdir -p /var/log/gunicorn
-pipenv run gunicorn config.wsgi:application --bind 0.0.0.0:8000 --access-logfile /var/log/gunicorn/access.log --error-log /var/log/gunicorn/error.log --capture-output
+# The gunicorn workers share their metrics through files in this directory (see market/metrics.py)
+export PROMETHEUS_MULTIPROC_DIR=/tmp/prometheus
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+# The polling and push views (trader_table, current_round, wait_for_round and wait_for_dashboard) are
+# async views served by uvicorn workers on port 8001 (nginx sends them there, see
+# nginx_config/nginx.conf). All other views are served by the sync workers on port 8000.
+pipenv run gunicorn config.asgi:application --config config/gunicorn.py --worker-class uvicorn.workers.UvicornWorker --workers 2 --bind 0.0.0.0:8001 --access-logfile /var/log/gunicorn/access-async.log --error-log /var/log/gunicorn/error-async.log --capture-output &
+pipenv run gunicorn config.wsgi:application --config config/gunicorn.py --bind 0.0.0.0:8000 --access-logfile /var/log/gunicorn/access.log --error-log /var/log/gunicorn/error.log --capture-output
 
@@ -0,0 +1,180 @@
+"""
+Cold archive of finished and deleted markets.
+
+The traders, trades, round stats and cost pools of a market stay in the tables forever, and every
+index and vacuum pays for them. archive_market moves the history of a finished (game over) or deleted
+market into a single MarketArchive row: the export of history.export_market_history as zlib
+compressed json. The rows are then deleted in batches of batch_size rows, with a pause between the
+batches, so a running class does not notice. The market row itself stays (with archived=True).
+
+The monitor page of an archived market is rendered from the archive: rehydrate builds unsaved
+traders, trades and round stats from it, which are passed to the helpers making the trader table
+and the graphs. An archive never changes, so the rehydrated objects are cached.
+
+Run it with the archive_markets command (e.g. every night).
+"""
+import json
+import time
+import zlib
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .helpers import add_context_for_trader_table, add_graph_context_for_monitor_page
+from .history import EXTENDED_STAT_FIELDS, _decimal, export_market_history
+from .metrics import record_cache
+from .models import Market, MarketArchive, RoundStat, Trade, Trader, UnusedCosts, UsedCosts
+
+# Seconds a rehydrated archive is kept in the cache
+REHYDRATED_TIMEOUT = 60 * 60
+
+
+def compress(history):
+    return zlib.compress(json.dumps(history, separators=(',', ':')).encode(), 9)
+
+
+def decompress(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def archivable_markets(days, now=None):
+    """ Returns the finished or deleted markets which have not been played for days days """
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return Market.objects.filter(
+        Q(game_over=True) | Q(deleted=True),
+        Q(round_started_at__lt=cutoff) | Q(round_started_at__isnull=True, created_at__lt=cutoff),
+        archived=False,
+    )
+
+
+def archive_market(market_id, batch_size=1000, pause=0.0):
+    """
+    Archives the history of the market and deletes its rows. Returns a dict with the number of
+    deleted rows pr. table, or None if the market is gone or has been archived by another process.
+    """
+    with transaction.atomic():
+        market = Market.objects.select_for_update().filter(market_id=market_id, archived=False).first()
+        if market is None:
+            return None
+        history = export_market_history(market)
+        MarketArchive.objects.create(
+            market=market,
+            data=compress(history),
+            num_traders=sum(trader['round_removed'] is None for trader in history['traders']),
+            num_trades=len(history['trades']),
+        )
+        Market.objects.filter(market_id=market_id).update(archived=True)
+        market.forget_dashboard()
+    return delete_hot_rows(market, batch_size, pause)
+
+
+def delete_hot_rows(market, batch_size=1000, pause=0.0):
+    """
+    Deletes the rows of an archived market in batches (each in its own transaction) and returns the
+    number of deleted rows pr. table. Can be run again if it was interrupted.
+    """
+    deleted = {}
+    for model in [Trade, RoundStat, UnusedCosts, UsedCosts, Trader]:
+        rows = model.objects.filter(market=market)
+        deleted[model.__name__] = 0
+        while True:
+            ids = list(rows.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                deleted[model.__name__] += model.objects.filter(pk__in=ids).delete()[1].get(model._meta.label, 0)
+            if pause:
+                time.sleep(pause)
+    return deleted
+
+
+def load_history(market):
+    """ Returns the history of the market (see history.export_market_history), archived or not """
+    if market.archived:
+        return decompress(MarketArchive.objects.get(market=market).data)
+    return export_market_history(market)
+
+
+def rehydrate(market):
+    """
+    Returns (traders, trades, round_stats) of the archived market as unsaved objects, as they would be
+    loaded for the monitor page: all traders ordered by -balance, the trades and the round stats
+    ordered by round.
+    """
+    key = f"archive:{market.market_id}"
+    rehydrated = cache.get(key)
+    record_cache('archive', rehydrated is not None)
+    if rehydrated is None:
+        rehydrated = _rehydrate(market, decompress(MarketArchive.objects.get(market=market).data))
+        cache.set(key, rehydrated, REHYDRATED_TIMEOUT)
+    traders, trades, round_stats = rehydrated
+    for trader in traders:
+        trader.market = market
+    return traders, trades, round_stats
+
+
+def add_archived_monitor_context(context):
+    """
+    Adds the context of the trader table and the graphs of the monitor page for an archived market.
+    The page is shown as for a finished game, since an archived market can't be played.
+    """
+    market = context['market']
+    market.game_over = True
+    traders, trades, round_stats = rehydrate(market)
+    context = add_graph_context_for_monitor_page(context, traders, trades, round_stats)
+    table_traders = [trader for trader in traders if not trader.removed_from_market]
+    for trader in table_traders:
+        trader.ready = False
+    return add_context_for_trader_table(context, table_traders)
+
+
+def _rehydrate(market, history):
+    traders = [Trader(
+        id=data['id'],
+        market_id=market.market_id,
+        name=data['name'],
+        prod_cost=_decimal(data['final_prod_cost']),
+        balance=_decimal(data['balance']),
+        round_joined=data['round_joined'],
+        auto_play=data['auto_play'],
+        removed_from_market=data['round_removed'] is not None,
+        bankrupt=data['round_bankrupt'] is not None,
+        round_removed=data['round_removed'],
+        round_bankrupt=data['round_bankrupt'],
+    ) for data in history['traders']]
+    # Ordered like Market.all_traders (PostgreSQL puts the null balances of removed traders first)
+    traders.sort(key=lambda trader: (trader.balance is not None, -(trader.balance or 0)))
+
+    trades = [Trade(
+        trader_id=data['trader'],
+        market_id=market.market_id,
+        round=data['round'],
+        unit_price=_decimal(data['unit_price']),
+        unit_amount=data['unit_amount'],
+        prod_cost=_decimal(data['prod_cost']),
+        was_forced=data['was_forced'],
+        demand=data['demand'],
+        units_sold=data['units_sold'],
+        profit=_decimal(data['profit']),
+        balance_before=_decimal(data['balance_before']),
+        balance_after=_decimal(data['balance_after']),
+    ) for data in sorted(history['trades'], key=lambda data: data['round'])]
+
+    round_stats = [RoundStat(
+        market_id=market.market_id,
+        round=data['round'],
+        avg_price=_decimal(data['avg_price']),
+        avg_balance_after=_decimal(data['avg_balance_after']),
+        avg_amount=_decimal(data['avg_amount']),
+        alpha=_decimal(data['alpha']),
+        theta=_decimal(data['theta']),
+        gamma=_decimal(data['gamma']),
+        eq_price=_decimal(data.get('eq_price')),
+        eq_amount=_decimal(data.get('eq_amount')),
+        **{field: data.get(field) if field.startswith('units_') else _decimal(data.get(field))
+           for field in EXTENDED_STAT_FIELDS},
+    ) for data in sorted(history['settlements'], key=lambda data: data['round'])]
+    return traders, trades, round_stats
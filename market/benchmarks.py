@@ -0,0 +1,187 @@
+"""
+Benchmarks of the hot views across market sizes.
+
+run_benchmarks builds a market for each combination of number of traders and rounds (see
+synthetic.py), requests each view a number of times with the test client and records the wall
+time, the number of SQL queries and the time spent in SQL. Each request runs in a savepoint
+that is rolled back, so all requests of a case see the same market, and nothing is kept in
+the database. compare_results flags cases that got slower (or use more queries) than in a
+baseline run. See the run_benchmarks and compare_benchmarks commands.
+"""
+import platform
+import random
+import statistics
+import time
+
+import django
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import playertoken
+from .models import Market, Trade
+from .querybudget import QueryLog
+from .synthetic import create_users, generate_markets
+
+
+# Bump when the cases or the format of the results change
+BENCHMARK_VERSION = 1
+
+VIEWS = ['finish_round', 'monitor', 'play_get', 'play_post', 'current_round', 'trader_table', 'join_market']
+TRADERS = [10, 50, 150]
+ROUNDS = [1, 20, 100, 1000]
+
+
+def build_market(num_traders, num_rounds, seed=0):
+    """
+    Returns an endless market with num_traders traders (played by the mixed robot population),
+    which has been played for num_rounds rounds
+    """
+    host = create_users(1, 'benchmark')[0]
+    generate_markets([host], 1, random.Random(f"{seed}:{num_traders}:{num_rounds}"),
+                     min_traders=num_traders, max_traders=num_traders, num_rounds=num_rounds,
+                     endless_share=1, skip_share=0)
+    return Market.objects.filter(created_by=host).latest('created_at')
+
+
+def add_trades_for_current_round(market):
+    """ Lets all active traders trade in the current round, so the round can be finished """
+    Trade.objects.bulk_create([
+        Trade(trader=trader, market=market, round=market.round, unit_price=2 * trader.prod_cost, unit_amount=10,
+              balance_before=trader.balance, prod_cost=trader.prod_cost)
+        for trader in market.active_traders()])
+
+
+def player_client(trader):
+    """ Returns a test client with the player token of a player who has joined the market as trader """
+    client = Client()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
+    return client
+
+
+def view_requests(market):
+    """
+    Returns a dict with a (setup, request) pair for each view. setup prepares the database
+    (not timed) and request makes the request.
+    """
+    host = Client()
+    host.force_login(market.created_by)
+    # The player has not traded in the current round
+    trader = market.active_traders().first()
+    player = player_client(trader)
+    market_id = market.market_id
+
+    def nothing():
+        pass
+
+    return {
+        'finish_round': (lambda: add_trades_for_current_round(market),
+                         lambda: host.post(reverse('market:finish_round', args=(market_id,)))),
+        'monitor': (nothing, lambda: host.get(reverse('market:monitor', args=(market_id,)))),
+        'play_get': (nothing, lambda: player.get(reverse('market:play', args=(market_id,)))),
+        'play_post': (nothing, lambda: player.post(reverse('market:play', args=(market_id,)), {
+            'unit_price': str(2 * trader.prod_cost), 'unit_amount': '1'})),
+        'current_round': (nothing, lambda: player.get(reverse('market:current_round', args=(market_id,)))),
+        'trader_table': (nothing, lambda: host.get(reverse('market:trader_table', args=(market_id,)))),
+        'join_market': (nothing, lambda: Client().post(reverse('market:join_market'), {
+            'name': 'benchmark', 'market_id': market_id})),
+    }
+
+
+def measure(setup, request, repeat):
+    """
+    Runs the request repeat times (each time in a savepoint that is rolled back afterwards) and
+    returns the wall times, the numbers of queries and the SQL times.
+    """
+    wall_times, query_counts, sql_times = [], [], []
+    for _ in range(repeat):
+        with transaction.atomic():
+            setup()
+            timer = QueryLog()
+            with connection.execute_wrapper(timer):
+                start = time.perf_counter()
+                response = request()
+                wall_times.append(time.perf_counter() - start)
+            assert response.status_code in (200, 302), f"status code {response.status_code}"
+            query_counts.append(timer.count)
+            sql_times.append(timer.seconds)
+            transaction.set_rollback(True)
+    return wall_times, query_counts, sql_times
+
+
+def run_benchmarks(traders=TRADERS, rounds=ROUNDS, views=VIEWS, repeat=5, seed=0, progress=None):
+    """
+    Runs all combinations of traders, rounds and views and returns the results as a json-serializable dict.
+    Times are in milliseconds. progress is called with each result.
+    """
+    results = []
+    # The query budgets are turned off, so they don't add to the timings
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], QUERY_BUDGET_MODE='off'), \
+            transaction.atomic():
+        for num_traders in traders:
+            for num_rounds in rounds:
+                market = build_market(num_traders, num_rounds, seed)
+                requests = view_requests(market)
+                for view in views:
+                    setup, request = requests[view]
+                    # The first request warms up caches (templates, url resolvers etc.) and is not counted
+                    measure(setup, request, 1)
+                    wall_times, query_counts, sql_times = measure(setup, request, repeat)
+                    result = {
+                        'view': view,
+                        'traders': num_traders,
+                        'rounds': num_rounds,
+                        'repeat': repeat,
+                        'wall_ms': _summary(wall_times),
+                        'sql_ms': _summary(sql_times),
+                        'queries': max(query_counts),
+                    }
+                    results.append(result)
+                    if progress:
+                        progress(result)
+        # Nothing is kept in the database
+        transaction.set_rollback(True)
+
+    return {
+        'version': BENCHMARK_VERSION,
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'results': results,
+    }
+
+
+def _summary(seconds):
+    milliseconds = [1000 * value for value in seconds]
+    return {
+        'median': round(statistics.median(milliseconds), 3),
+        'min': round(min(milliseconds), 3),
+        'max': round(max(milliseconds), 3),
+    }
+
+
+def compare_results(baseline, current, threshold=0.25, min_ms=1.0):
+    """
+    Compares two benchmark runs. Returns a list of (key, message) with a message for each case where
+    the median wall time grew more than threshold (a fraction) and more than min_ms milliseconds, or
+    where more queries were made. key is (view, traders, rounds).
+    """
+    baseline_results = {_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        key = _key(result)
+        if key not in baseline_results:
+            continue
+        before, after = baseline_results[key]['wall_ms']['median'], result['wall_ms']['median']
+        if after > before * (1 + threshold) and after - before > min_ms:
+            regressions.append((key, f"wall time {before:.1f} ms -> {after:.1f} ms (+{(after / before - 1) * 100:.0f}%)"))
+        if result['queries'] > baseline_results[key]['queries']:
+            regressions.append((key, f"queries {baseline_results[key]['queries']} -> {result['queries']}"))
+    return regressions
+
+
+def _key(result):
+    return (result['view'], result['traders'], result['rounds'])
@@ -0,0 +1,103 @@
+"""
+Garbage collection of rows nobody will read again.
+
+ - Expired sessions: the sessions of the hosts, and of the players who joined before the players got
+   tokens (see playertoken.py). Sessions which expired more than session_days days ago are deleted.
+ - Abandoned markets: markets still in round 0 without any traders, created more than market_days
+   days ago (e.g. a host who tried the form). Their cost pools are deleted with them.
+ - Orphaned cost pools: the UnusedCosts and UsedCosts rows of archived markets (see archive.py),
+   which are left behind if archive_markets was interrupted. (The foreign keys make sure there are
+   no cost rows without a market.)
+
+The rows are deleted in batches of batch_size rows, each batch in its own short transaction and with
+a pause between the batches. A batch locks its rows with SKIP LOCKED, so rows which are in use (e.g.
+a market a trader is joining right now) are left for the next run. The run holds an advisory lock,
+so the cleanup command can be run every few minutes (e.g. from cron) without overlapping runs.
+"""
+import time
+from datetime import timedelta
+
+from django.contrib.sessions.models import Session
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Market, Trader, UnusedCosts, UsedCosts
+
+# Key of the PostgreSQL advisory lock held while cleaning up (see scheduler.SCHEDULER_LOCK_ID)
+CLEANUP_LOCK_ID = 7_433_002
+
+
+def expired_sessions(days, now=None):
+    return Session.objects.filter(expire_date__lt=(now or timezone.now()) - timedelta(days=days))
+
+
+def abandoned_markets(days, now=None):
+    """ Returns the markets in round 0 without traders, created more than days days ago """
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return Market.objects.filter(
+        Q(created_at__lt=cutoff) | Q(created_at__isnull=True),
+        ~Exists(Trader.objects.filter(market=OuterRef('pk'))),
+        round=0, archived=False,
+    )
+
+
+def orphaned_costs(model):
+    """ Returns the rows of the cost pool model (UnusedCosts or UsedCosts) of archived markets """
+    return model.objects.filter(market__archived=True)
+
+
+def delete_in_batches(queryset, batch_size=1000, pause=0.0, max_batches=None):
+    """
+    Deletes the rows of queryset in batches (each in its own transaction) and returns the number of
+    deleted rows. Rows locked by other transactions are skipped.
+    """
+    model = queryset.model
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            # The rows are locked before they are deleted, and the conditions of queryset are checked
+            # again, so e.g. a market which got a trader since the last batch is not deleted
+            pks = list(queryset.select_for_update(skip_locked=True, of=('self',))
+                       .order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            deleted += model.objects.filter(pk__in=pks).delete()[1].get(model._meta.label, 0)
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def collect_garbage(session_days=0, market_days=7, batch_size=1000, pause=0.0, max_batches=None, now=None):
+    """
+    Deletes expired sessions, abandoned markets and orphaned cost pools (see the module docstring).
+    Returns a dict with the number of deleted rows of each kind, or None if another cleanup is running.
+    max_batches limits the number of batches of each kind, so a run can be kept short.
+    """
+    if not _try_lock():
+        return None
+    try:
+        return {
+            'sessions': delete_in_batches(expired_sessions(session_days, now), batch_size, pause, max_batches),
+            'markets': delete_in_batches(abandoned_markets(market_days, now), batch_size, pause, max_batches),
+            'unused costs': delete_in_batches(orphaned_costs(UnusedCosts), batch_size, pause, max_batches),
+            'used costs': delete_in_batches(orphaned_costs(UsedCosts), batch_size, pause, max_batches),
+        }
+    finally:
+        _unlock()
+
+
+def _try_lock():
+    if connection.vendor != 'postgresql':
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [CLEANUP_LOCK_ID])
+        return cursor.fetchone()[0]
+
+
+def _unlock():
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [CLEANUP_LOCK_ID])
@@ -0,0 +1,107 @@
+"""
+Reads from a read replica.
+
+The polled views (trader_table, current_round, wait_for_round) and the GET of the play and monitor
+pages (with the history charts) only read, and they make most of the queries during a class.
+Decorate such a view with @replica_reads and ReplicaMiddleware lets ReplicaRouter send its reads to
+the database alias settings.REPLICA_DATABASE (the replica is configured with the environment variable
+POSTGRES_REPLICA_HOST, see config/settings.py). All other reads, all writes and locking reads
+(select_for_update) go to the primary ('default'), as do all reads in management commands and the
+round scheduler.
+
+The replica lags a little behind the primary. So that a player sees the trade just made, and the host
+sees the round just finished, ReplicaMiddleware sets the cookie STICKY_COOKIE for
+settings.REPLICA_STICKY_SECONDS after each POST, and the requests of a browser with that cookie read
+from the primary.
+"""
+import asyncio
+import contextlib
+import contextvars
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+STICKY_COOKIE = 'read_primary'
+
+# Is the current request (or task) allowed to read from the replica?
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+def replica_reads(view_func):
+    """ Lets the GET and HEAD requests of the decorated view read from the replica """
+    view_func.replica_reads = True
+    return view_func
+
+
+@contextlib.contextmanager
+def reading_from_replica(enabled=True):
+    """ Lets the reads in the block (and in sync_to_async calls made from it) go to the replica """
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_alias():
+    """ Returns the alias reads should go to now: the replica, or None for the primary """
+    alias = getattr(settings, 'REPLICA_DATABASE', None)
+    if not alias or not _replica_reads.get():
+        return None
+    # Inside a transaction we read from the primary, to see our own writes
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return None
+    return alias
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return replica_alias() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, so objects from both can be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django that we are in async mode (like MiddlewareMixin)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with reading_from_replica(False):
+            response = self.get_response(request)
+        return self.stick_to_primary(request, response)
+
+    async def __acall__(self, request):
+        with reading_from_replica(False):
+            response = await self.get_response(request)
+        return self.stick_to_primary(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # The value is reset when the request is done (in __call__). The sessions and the user are
+        # read by the middleware before this, so they always come from the primary.
+        if getattr(view_func, 'replica_reads', False) and request.method in ('GET', 'HEAD') \
+                and STICKY_COOKIE not in request.COOKIES:
+            _replica_reads.set(True)
+
+    def stick_to_primary(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and getattr(settings, 'REPLICA_DATABASE', None):
+            response.set_cookie(STICKY_COOKIE, '1', max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 5),
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,307 @@
+"""
+The economic model of the market game, independent of the database.
+
+The functions in this module work on plain floats and lists (one entry pr. trader),
+so that whole populations of traders can be evaluated at once. They are used when
+calibrating scenarios (see the sweep_scenarios command) and for benchmarks shown to the host.
+
+Recall,
+alpha is the basic demand
+theta is the level of competition
+gamma is the price sensitivity
+"""
+import hashlib
+import json
+import math
+import random
+from pathlib import Path
+
+
+# Bump this when the model or the bots change, so that cached sweep results are recomputed
+MODEL_VERSION = 1
+
+
+def demands(prices, alpha, theta, gamma):
+    """
+    Returns the demand for each price in prices, given that all prices are part of the same market.
+    Uses the same formula and rounding as helpers.process_trade.
+    """
+    if not prices:
+        return []
+    avg_price = sum(prices) / len(prices)
+    return [max(0, round(alpha - (gamma + theta) * price + theta * avg_price))
+            for price in prices]
+
+
+def equilibrium(alpha, theta, gamma, min_cost, max_cost=None, num_traders=None):
+    """
+    Returns the Nash equilibrium of the market as a dict, or None if the market has no finite equilibrium.
+
+    A trader with unit cost c who expects to sell everything he produces maximizes (p - c) * demand(p).
+    When all other prices are fixed, demand(p) has the slope -b where b = gamma + theta * (1 - 1/N),
+    (the trader's own price also moves the market average). Solving the first order conditions
+    for all traders gives
+
+        avg. price   = (alpha + b * avg_cost) / (gamma + b)
+        price(c)     = (alpha + theta * avg_price + b * c) / (gamma + theta + b)
+        amount(c)    = b * (price(c) - c)
+
+    If num_traders is None we use the limit of many traders (b = gamma + theta).
+    Costs are assumed to be spread evenly between min_cost and max_cost (as done by
+    Trader.prod_cost_algorithm), so avg_cost is the midpoint. If max_cost is None, all traders
+    have the cost min_cost (the symmetric equilibrium).
+    """
+    alpha, theta, gamma = float(alpha), float(theta), float(gamma)
+    min_cost = float(min_cost)
+    max_cost = min_cost if max_cost is None else float(max_cost)
+
+    if num_traders:
+        b = gamma + theta * (1 - 1 / num_traders)
+    else:
+        b = gamma + theta
+
+    if gamma + b <= 0:
+        return None
+
+    avg_cost = (min_cost + max_cost) / 2
+    avg_price = (alpha + b * avg_cost) / (gamma + b)
+
+    def price(cost):
+        return (alpha + theta * avg_price + b * cost) / (gamma + theta + b)
+
+    def amount(cost):
+        return max(0.0, b * (price(cost) - cost))
+
+    avg_amount = max(0.0, alpha - gamma * avg_price)
+
+    return {
+        'b': b,
+        'price_slope': b / (gamma + theta + b),
+        'price': avg_price,
+        'amount': avg_amount,
+        'profit': (avg_price - avg_cost) * avg_amount,
+        'profit_margin': (avg_price - avg_cost) / avg_price if avg_price > 0 else None,
+        'min_cost_price': price(min_cost),
+        'min_cost_amount': amount(min_cost),
+        'max_cost_price': price(max_cost),
+        'max_cost_amount': amount(max_cost),
+    }
+
+
+def equilibrium_trade(eq, min_cost, cost):
+    """
+    Returns the equilibrium (price, amount) of a trader with production cost cost,
+    where eq is the result of equilibrium() for a market with the given min_cost.
+    """
+    price = eq['min_cost_price'] + eq['price_slope'] * (float(cost) - float(min_cost))
+    return price, max(0.0, eq['b'] * (price - float(cost)))
+
+
+def spread_costs(min_cost, max_cost, num_traders):
+    """
+    Returns num_traders production costs covering the whole spectrum from min_cost to max_cost.
+    """
+    min_cost, max_cost = float(min_cost), float(max_cost)
+    if num_traders == 1 or min_cost == max_cost:
+        return [min_cost] * num_traders
+    step = (max_cost - min_cost) / (num_traders - 1)
+    return [min_cost + i * step for i in range(num_traders)]
+
+
+### Reference bots ###
+# Each bot gets a dict describing its own state and the market, and returns (price, amount).
+# The first three bots mirror the example algorithms shown to players in robot mode
+# (see templates/market/play/code_body_*.py).
+
+def random_bot(state, rng):
+    """ Algoritme 1: a random price and a random amount """
+    return rng.uniform(state['prod_cost'], state['max_price']), rng.randint(0, state['max_amount'])
+
+
+def cautious_bot(state, rng):
+    """ Algoritme 2: repeat the last trade if it gave a profit, else try something random """
+    if state['round'] == 0:
+        return 2 * state['prod_cost'], state['max_amount'] / 5
+    if state['profit_last_round'] > 0:
+        return state['price_last_round'], state['amount_last_round']
+    return (rng.uniform(state['prod_cost'], 1.5 * state['prod_cost']),
+            rng.randint(0, math.floor(state['max_amount'] / 5)))
+
+
+def follower_bot(state, rng):
+    """ Algoritme 3: price a bit above the market average and produce what was demanded """
+    if state['round'] == 0:
+        return state['prod_cost'] + 2, state['max_amount'] / 2
+    return state['avg_price_last_round'] + 3, state['demand_last_round']
+
+
+def equilibrium_bot(state, rng):
+    """ Plays the equilibrium price and amount for its own production cost """
+    if state['equilibrium'] is None:
+        return state['prod_cost'], 0
+    return equilibrium_trade(state['equilibrium'], state['min_cost'], state['prod_cost'])
+
+
+BOTS = {
+    'random': random_bot,
+    'cautious': cautious_bot,
+    'follower': follower_bot,
+    'equilibrium': equilibrium_bot,
+}
+
+# Reference populations used to estimate the bankruptcy rate of a scenario.
+# The weights give the share of traders using each bot.
+REFERENCE_POPULATIONS = {
+    'random': {'random': 1},
+    'cautious': {'cautious': 1},
+    'follower': {'follower': 1},
+    'mixed': {'random': 1, 'cautious': 1, 'follower': 1, 'equilibrium': 1},
+}
+
+
+def assign_bots(population, num_traders):
+    """
+    Returns a list of bot names of length num_traders with shares given by the population weights.
+    The bots are interleaved, so that each bot gets costs from the whole spectrum.
+    """
+    total = sum(population.values())
+    counts = {name: math.floor(num_traders * weight / total) for name, weight in population.items()}
+    # Hand out the remaining traders to the bots with the largest remainders
+    remainders = sorted(population, key=lambda name: num_traders * population[name] / total - counts[name],
+                        reverse=True)
+    for name in remainders[:num_traders - sum(counts.values())]:
+        counts[name] += 1
+    slots = [((k + 0.5) / count, name) for name, count in counts.items() for k in range(count)]
+    return [name for _, name in sorted(slots, key=lambda slot: slot[0])]
+
+
+def simulate(params, population, num_traders, num_rounds, rng):
+    """
+    Plays num_rounds rounds of a market with the given parameters and bot population.
+    Returns the list of final states (one dict pr. trader).
+
+    Traders who can't afford to produce a single unit go bankrupt and stop trading,
+    like human traders are asked to do on the play page.
+    """
+    alpha, theta, gamma = float(params['alpha']), float(params['theta']), float(params['gamma'])
+    min_cost, max_cost = float(params['min_cost']), float(params['max_cost'])
+    max_price = 4 * max_cost
+    eq = equilibrium(alpha, theta, gamma, min_cost, max_cost, num_traders)
+
+    states = [{
+        'bot': BOTS[name],
+        'prod_cost': cost,
+        'balance': float(params['initial_balance']),
+        'bankrupt': False,
+        'min_cost': min_cost,
+        'max_price': max_price,
+        'equilibrium': eq,
+    } for name, cost in zip(assign_bots(population, num_traders),
+                            spread_costs(min_cost, max_cost, num_traders))]
+
+    avg_price_last_round = None
+    for round_num in range(num_rounds):
+        trading = []
+        for state in states:
+            if state['bankrupt']:
+                continue
+            if state['balance'] < state['prod_cost']:
+                state['bankrupt'] = True
+                continue
+            state['round'] = round_num
+            state['max_amount'] = math.floor(state['balance'] / state['prod_cost'])
+            state['avg_price_last_round'] = avg_price_last_round
+            price, amount = state['bot'](state, rng)
+            # Clamp the choices to the values allowed by the trade form
+            price = min(max(0.0, float(price)), max_price)
+            amount = min(max(0, int(amount)), state['max_amount'])
+            trading.append((state, price, amount))
+
+        if not trading:
+            break
+
+        prices = [price for _, price, _ in trading]
+        for (state, price, amount), demand in zip(trading, demands(prices, alpha, theta, gamma)):
+            units_sold = min(demand, amount)
+            profit = price * units_sold - state['prod_cost'] * amount
+            state['balance'] += profit
+            state['price_last_round'] = price
+            state['amount_last_round'] = amount
+            state['demand_last_round'] = demand
+            state['profit_last_round'] = profit
+        avg_price_last_round = sum(prices) / len(prices)
+
+    for state in states:
+        if not state['bankrupt'] and state['balance'] < state['prod_cost']:
+            state['bankrupt'] = True
+    return states
+
+
+def bankruptcy_rate(params, population, num_traders, num_rounds, runs=5, seed=0):
+    """
+    Returns the expected share of traders that go bankrupt, averaged over a number of simulated games.
+    """
+    bankrupt = 0
+    for run in range(runs):
+        rng = random.Random(f"{seed}:{run}")
+        states = simulate(params, population, num_traders, num_rounds, rng)
+        bankrupt += sum(state['bankrupt'] for state in states)
+    return bankrupt / (runs * num_traders)
+
+
+def evaluate_point(params, num_traders, num_rounds, runs=5, seed=0, populations=REFERENCE_POPULATIONS):
+    """
+    Returns the key figures of a single parameter point of a sweep.
+    """
+    eq = equilibrium(params['alpha'], params['theta'], params['gamma'],
+                     params['min_cost'], params['max_cost'], num_traders)
+    result = {
+        'eq_price': eq and eq['price'],
+        'eq_amount': eq and eq['amount'],
+        'eq_profit': eq and eq['profit'],
+        'profit_margin': eq and eq['profit_margin'],
+    }
+    for name, population in populations.items():
+        result[f'bankruptcy_rate_{name}'] = bankruptcy_rate(
+            params, population, num_traders, num_rounds, runs, seed)
+    return result
+
+
+def sweep(points, num_traders, num_rounds, runs=5, seed=0, cache_dir=None):
+    """
+    Evaluates each parameter point (a dict with alpha, theta, gamma, min_cost, max_cost
+    and initial_balance) and returns a list of (params, result) pairs.
+
+    If cache_dir is given, each result is stored there as a small json file keyed by the
+    parameters and settings, so re-running a sweep over an overlapping grid only
+    evaluates the new points. Returns the results and the number of points that were computed.
+    """
+    cache_dir = Path(cache_dir) if cache_dir else None
+    if cache_dir:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    num_computed = 0
+    for params in points:
+        key = {
+            'params': {name: float(value) for name, value in sorted(params.items())},
+            'num_traders': num_traders,
+            'num_rounds': num_rounds,
+            'runs': runs,
+            'seed': seed,
+            'model_version': MODEL_VERSION,
+        }
+        path = None
+        if cache_dir:
+            digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+            path = cache_dir / f"{digest}.json"
+            if path.exists():
+                results.append((params, json.loads(path.read_text())))
+                continue
+
+        result = evaluate_point(params, num_traders, num_rounds, runs, seed)
+        num_computed += 1
+        if path:
+            path.write_text(json.dumps(result))
+        results.append((params, result))
+    return results, num_computed
@@ -0,0 +1,304 @@
+"""
+The engine that finishes rounds.
+
+finish_round settles a single round for the finish_round view. fast_forward lets
+traders in robot mode decide on the server and settles a number of rounds in one go
+(used by the fast_forward view and management command).
+Both load the traders and trades of a round once and write them back in bulk.
+"""
+import time
+from decimal import Decimal
+from math import floor
+
+from django.db import transaction
+from django.db.models import Aggregate, Avg, Count, F, FloatField, Max, Min, Q, StdDev, Sum
+from django.utils import timezone
+
+from .economics import BOTS, equilibrium
+from .helpers import process_trade
+from .metrics import record_settlement
+from .models import Market, Trader, Trade, RoundStat, ranks
+
+
+# The maximal number of rounds a host can fast-forward in one request
+MAX_FAST_FORWARD_ROUNDS = 100
+
+CENT = Decimal('0.01')
+
+
+class Median(Aggregate):
+    """ The median of the values (PostgreSQL) """
+    function = 'percentile_cont'
+    name = 'Median'
+    template = '%(function)s(0.5) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+
+def round_statistics(market, round_num):
+    """
+    Returns the statistics of a settled round (the fields of RoundStat) computed by one aggregate
+    query over the trades of the round. The prices and amounts are those of the valid trades
+    (the trades made by traders who have not been removed, see Market.valid_trades_this_round);
+    the average balance is that of all traders who have not been removed.
+    """
+    not_removed = Q(trader__removed_from_market=False)
+    valid = not_removed & Q(was_forced=False)
+    stats = market.trades().filter(round=round_num).aggregate(
+        avg_price=Avg('unit_price', filter=valid),
+        median_price=Median('unit_price', filter=valid),
+        min_price=Min('unit_price', filter=valid),
+        max_price=Max('unit_price', filter=valid),
+        price_stddev=StdDev('unit_price', filter=valid),
+        avg_amount=Avg('unit_amount', filter=valid),
+        units_produced=Sum('unit_amount', filter=valid),
+        units_sold=Sum('units_sold', filter=valid),
+        units_sold_squared=Sum(F('units_sold') * F('units_sold'), filter=valid),
+        total_profit=Sum('profit', filter=valid),
+        avg_balance_after=Avg('balance_after', filter=not_removed),
+        num_trades=Count('pk', filter=valid),
+        num_forced_trades=Count('pk', filter=Q(was_forced=True)),
+    )
+    units_sold_squared = stats.pop('units_sold_squared')
+    stats['hhi'] = 10000 * Decimal(units_sold_squared) / stats['units_sold'] ** 2 if stats['units_sold'] else None
+    for field in ['median_price', 'price_stddev', 'hhi']:
+        if stats[field] is not None:
+            stats[field] = Decimal(stats[field]).quantize(CENT)
+    return stats
+
+
+def settled_ranking(balances_before, balances_after, profits):
+    """
+    Returns the ranking stored on the RoundStat of a settled round (see RoundStat.ranking).
+    balances_before and balances_after map the ids of the traders who have not been removed to their
+    balances before and after the round (traders who joined in the round are not in balances_before),
+    and profits maps the ids of the traders with a valid trade to their profit.
+    rank_change is the number of places the trader moved up in the round.
+    """
+    ranks_before = ranks(balances_before)
+    return [{
+        'id': trader_id,
+        'rank': rank,
+        'balance': balances_after[trader_id],
+        'rank_change': ranks_before[trader_id] - rank if trader_id in ranks_before else None,
+        'profit': profits.get(trader_id),
+    } for trader_id, rank in ranks(balances_after).items()]
+
+
+def finish_round(market):
+    """
+    Settles the current round of the market: processes all valid trades, creates forced trades
+    for traders who did not trade in time, saves statistics for the round and moves the market to the next round.
+
+    The time spent loading the round, computing the results and writing them to the database is saved
+    on the RoundStat of the round (writing the RoundStat itself is not included; computing its
+    statistics, which is done by the database when the round has been written, is part of writing).
+    Returns a dict with the number of trades and forced trades in the round.
+
+    The market row is locked while the round is settled, and the market is loaded again from the
+    locked row, so a round is never settled twice (e.g. by the host and the scheduler at the same
+    time). Returns None without settling if the round of the market was settled meanwhile or has
+    no valid trades.
+    """
+    start = time.perf_counter()
+    with transaction.atomic():
+        locked = Market.objects.select_for_update().get(pk=market.pk)
+        if locked.round != market.round:
+            return None
+        for field in Market._meta.concrete_fields:
+            setattr(market, field.attname, getattr(locked, field.attname))
+
+        traders = list(market.all_traders())
+        traders_by_id = {trader.id: trader for trader in traders}
+
+        # Query the trades made in the current round. The valid trade decisions are those of
+        # Market.valid_trades_this_round, picked out here so the trades are loaded in one query.
+        all_trades = list(market.all_trades_this_round())
+        valid_trades = [trade for trade in all_trades
+                        if not trade.was_forced and not traders_by_id[trade.trader_id].removed_from_market]
+        traders_with_trade = {trade.trader_id for trade in all_trades}
+        loaded = time.perf_counter()
+
+        # A round without valid trades can't be settled (the avg. price below would be a zero division)
+        if not valid_trades:
+            return None
+
+        # Calculate the average price (will be used to calculate the demand for each traders good)
+        avg_price = sum(
+            [trade.unit_price for trade in valid_trades]) / len(valid_trades)
+
+        # The ranking before the round is that of the traders who were on the market in the previous round
+        balances_before = {trader.id: trader.balance for trader in traders
+                           if trader.balance is not None and trader.round_joined < market.round}
+
+        # Process each of the valid trades. We use the trader objects loaded above,
+        # so that all traders can be written back in one query below.
+        for trade in valid_trades:
+            trade.trader = traders_by_id[trade.trader_id]
+            process_trade(market, trade, avg_price, save=False)
+
+        # Create 'forced trades' for all traders who did not make a trade in time
+        forced_trades = [
+            Trade(
+                round=market.round,
+                trader=trader,
+                market=market,
+                balance_after=trader.balance,
+                balance_before=trader.balance,
+                was_forced=True,
+                prod_cost=trader.prod_cost
+            )
+            for trader in traders if trader.id not in traders_with_trade
+        ]
+
+        # Let's assert that at this point, there is exactly one trade pr trader in the current round
+        assert(len(traders_with_trade) + len(forced_trades) == len(traders)
+               ), "Number of trades in this round does not equal num traders."
+
+        # Save data for charts. The statistics are computed in the database when the round has been written (below).
+        round_stat = RoundStat(
+            market=market,
+            round=market.round,
+            alpha=market.alpha,
+            theta=market.theta,
+            gamma=market.gamma,
+            eq_price=market.eq_price,
+            eq_amount=market.eq_amount,
+            started_at=market.round_started_at,
+            ranking=settled_ranking(
+                balances_before,
+                {trader.id: trader.balance for trader in traders if trader.balance is not None},
+                {trade.trader_id: trade.profit for trade in valid_trades}))
+
+        # SHOULD only be per round ...
+        for trader in traders:
+            new_cost = trader.prod_cost + market.cost_slope
+            if new_cost > 0:
+                trader.prod_cost = new_cost
+
+        # Update total production cost change
+        market.accum_cost_change += market.cost_slope
+
+        # Update market round
+        market.round += 1
+        market.round_started_at = timezone.now()
+
+        # Check game over
+        if market.check_game_over():
+            market.game_over = True
+
+        # we should probably reset cost_slope to prevent it from accumulating, no?
+        market.cost_slope = 0
+        computed = time.perf_counter()
+
+        Trade.objects.bulk_update(
+            valid_trades, ['demand', 'units_sold', 'profit', 'balance_after'])
+        Trade.objects.bulk_create(forced_trades)
+        Trader.objects.bulk_update(traders, ['balance', 'prod_cost'])
+        market.save(update_fields=Market.SETTLEMENT_FIELDS)
+        market.refresh_balance_totals()
+        for field, value in round_statistics(market, round_stat.round).items():
+            setattr(round_stat, field, value)
+        written = time.perf_counter()
+
+        round_stat.load_seconds = loaded - start
+        round_stat.compute_seconds = computed - loaded
+        round_stat.write_seconds = written - computed
+        round_stat.save()
+
+    record_settlement(market.market_id, time.perf_counter() - start)
+    return {'num_trades': len(valid_trades), 'num_forced_trades': len(forced_trades)}
+
+
+def add_bot_trades(market, bot, rng, all_traders_are_bots=False):
+    """
+    Lets traders in robot mode (auto_play) who have not traded in the current round decide on a trade
+    using one of the reference bots in economics.py. If all_traders_are_bots is True, all active traders
+    without a trade are treated as robots. Traders who can't afford to produce do not trade.
+    Returns the number of trades created.
+    """
+    traders = market.active_traders().exclude(
+        trade__round=market.round)
+    if not all_traders_are_bots:
+        traders = traders.filter(auto_play=True)
+
+    last_trades = {
+        trade.trader_id: trade for trade in market.trades().filter(
+            round=market.round - 1, was_forced=False)
+    }
+    last_round_stat = market.round_stats().filter(round=market.round - 1).first()
+    max_price = market.max_allowed_price()
+    eq = equilibrium(market.alpha, market.theta, market.gamma,
+                     market.min_cost + market.accum_cost_change,
+                     market.max_cost + market.accum_cost_change)
+
+    new_trades = []
+    for trader in traders:
+        if trader.balance < trader.prod_cost:
+            continue
+        max_amount = floor(trader.balance / trader.prod_cost)
+        state = {
+            'round': 0,
+            'prod_cost': float(trader.prod_cost),
+            'min_cost': float(market.min_cost + market.accum_cost_change),
+            'max_price': float(max_price),
+            'max_amount': max_amount,
+            'equilibrium': eq,
+        }
+        last_trade = last_trades.get(trader.id)
+        if last_trade is not None and last_round_stat is not None:
+            # The bots treat the first round they trade in as round 0
+            state.update({
+                'round': market.round,
+                'price_last_round': float(last_trade.unit_price),
+                'amount_last_round': last_trade.unit_amount,
+                'demand_last_round': last_trade.demand,
+                'profit_last_round': float(last_trade.profit),
+                'avg_price_last_round': float(last_round_stat.avg_price),
+            })
+        price, amount = BOTS[bot](state, rng)
+
+        # Clamp the choices to the values allowed by the trade form
+        price = min(max(Decimal('0.00'), Decimal(price).quantize(Decimal('0.01'))), max_price)
+        amount = min(max(0, int(amount)), max_amount)
+        new_trades.append(Trade(
+            trader=trader,
+            market=market,
+            round=market.round,
+            unit_price=price,
+            unit_amount=amount,
+            balance_before=trader.balance,
+            prod_cost=trader.prod_cost
+        ))
+    Trade.objects.bulk_create(new_trades)
+    return len(new_trades)
+
+
+def fast_forward(market, num_rounds, bot='cautious', all_traders_are_bots=False, rng=None):
+    """
+    Plays up to num_rounds rounds of the market in one transaction. In each round, traders in
+    robot mode decide automatically (see add_bot_trades) and the round is finished; traders without
+    a decision get forced trades. Stops early if the game is over or if no trader has traded in a round.
+
+    The robots use the random stream of the market for each round (see Market.random_stream),
+    unless another random generator rng is given.
+
+    Returns a list with a dict pr. finished round with the round number, the number of (forced) trades
+    and the time it took to play the round in seconds.
+    """
+    report = []
+    with transaction.atomic():
+        # Lock the market, so the host can't finish a round at the same time
+        market = Market.objects.select_for_update().get(pk=market.pk)
+        for _ in range(num_rounds):
+            if market.game_over:
+                break
+            start = time.perf_counter()
+            add_bot_trades(market, bot, rng or market.random_stream('bots', market.round), all_traders_are_bots)
+            round_num = market.round
+            result = finish_round(market)
+            if result is None:
+                break
+            result['round'] = round_num
+            result['seconds'] = time.perf_counter() - start
+            report.append(result)
+    return report
@@ -9,7 +9,8 @@ class MarketForm(forms.ModelForm):
         model = Market
 
         fields = ['initial_balance', 'min_cost', 'max_cost', 'cost_slope', 'max_rounds', 'endless',
-                  'alpha', 'theta', 'gamma', 'product_name_singular', 'product_name_plural', 'allow_robots']
+                  'alpha', 'theta', 'gamma', 'product_name_singular', 'product_name_plural', 'allow_robots',
+                  'round_deadline']
         help_texts = {
             'product_name_singular': "Navnet på produktet i ental (f.eks. 'baguette')",
             'product_name_plural': "Navnet på produktet i flertal (f.eks. 'baguetter')",
@@ -25,7 +26,8 @@ class MarketForm(forms.ModelForm):
             'cost_slope': "Undervejs i spillet kan du ændre værdien i dette felt for at justere alle producenters omkostninger pr. enhed.",
             'max_rounds': f"Hvor mange runder skal der spilles? Vælg et tal mellem 1 og {Market.UPPER_LIMIT_ON_MAX_ROUNDS}",
             'endless': "Der skal ikke være et loft over antal runder (spillet skal bare fortætte, så længe du ønsker det)",
-            'allow_robots': "Producenterne skal kunne agere via algoritmer skrevet i Python"
+            'allow_robots': "Producenterne skal kunne agere via algoritmer skrevet i Python",
+            'round_deadline': "Afslut hver runde automatisk efter så mange sekunder (hvis mindst én producent har handlet). Lad feltet stå tomt, hvis runderne ikke skal have en tidsgrænse."
         }
         labels = {
             'product_name_singular': 'Produktnavn i ental',
@@ -39,7 +41,8 @@ class MarketForm(forms.ModelForm):
             'cost_slope': 'Ændring i omkostning pr. enhed',
             'endless': 'Uendeligt spil',
             'max_rounds': 'Antal runder',
-            'allow_robots': 'Tillad robotspil'
+            'allow_robots': 'Tillad robotspil',
+            'round_deadline': 'Tidsgrænse pr. runde (sekunder)'
         }
         widgets = {
             'initial_balance': forms.NumberInput(attrs={'step': 0.01, 'onchange': "setTwoNumberDecimal(this)"}),
@@ -137,7 +140,7 @@ class TraderForm(forms.ModelForm):
         cleaned_market_id = cleaned_data.get('market_id')
         if cleaned_name and cleaned_market_id:
             market = Market.objects.get(market_id=cleaned_market_id)
-            if market.game_over:
+            if market.game_over or market.archived:
                 raise forms.ValidationError(
                     'Dette marked er afsluttet. Ingen nye handlende kan deltage.')
 
@@ -2,14 +2,18 @@
 Helper functions used by the views
 """
 
-from .models import Trader, Trade, RoundStat
+from collections import defaultdict
+from types import SimpleNamespace
+from django.conf import settings
+from .models import Trader, Trade
 import json
 
 
-def process_trade(market, trade, avg_price):
+def process_trade(market, trade, avg_price, save=True):
     """
     Calculates key values for a single trade and updates trade and trader accordingly.
-    Used by monitor-view on post-requests, when host finishes a round
+    Used by monitor-view on post-requests, when host finishes a round.
+    If save is False, the caller is responsible for saving trade and trader (see engine.finish_round).
     """
     alpha, theta, gamma = market.alpha, market.theta, market.gamma
 
@@ -32,8 +36,9 @@ def process_trade(market, trade, avg_price):
     trade.balance_after = trader.balance
 
     # save to database
-    trader.save()
-    trade.save()
+    if save:
+        trader.save()
+        trade.save()
 
     return expenses, raw_demand, demand, units_sold, income, trade_profit
 
@@ -71,18 +76,21 @@ def create_forced_trade(trader, round_num, is_new_trader):
     return forced_trade
 
 
-def generate_prod_cost_list(market, trades, trader):
+def generate_prod_cost_list(market, trades, trader, wait=None):
+    """ wait is the result of trader.should_be_waiting() (if the caller already knows it) """
 
     prod_costs = [float(trade.prod_cost) if (
         trade.prod_cost != None) else None for trade in trades]
 
-    if not trader.should_be_waiting():
+    if wait is None:
+        wait = trader.should_be_waiting()
+    if not wait:
         prod_costs += [float(trader.prod_cost)]
 
     return prod_costs
 
 
-def generate_balance_list(trader):
+def generate_balance_list(trader, trades=None):
     """
     Generates a list of floats consisting of the balances of a single trader.
     The i'th entry of the list is the balance before/during each round, not the
@@ -98,9 +106,13 @@ def generate_balance_list(trader):
 
     The length of the list should equal market.round + 1, as there should be one
     balance for each round, including the current round. 
+
+    If the caller has already loaded the trades of the trader in the previous rounds
+    (ordered by round), they can be passed as trades to save a query.
     """
-    trades = Trade.objects.filter(
-        trader=trader, round__lte=trader.market.round - 1)
+    if trades is None:
+        trades = trader.market.trades().filter(
+            trader=trader, round__lte=trader.market.round - 1)
     initial_balance = float(trader.market.initial_balance)
 
     balance_list = [initial_balance] + \
@@ -114,9 +126,32 @@ def generate_balance_list(trader):
     return balance_list
 
 
-def add_graph_context_for_monitor_page(context):
+def add_context_for_trader_table(context, traders=None):
+    """
+    Adds the traders shown in the trader table (with the attribute 'ready') and the numbers used
+    by the table to the context. Used by the monitor and trader_table views.
+    Unless the traders are given (as for archived markets, see archive.py), they are the entries of the
+    cached ranking of the market (see Market.ranking) with the ready flags of the current round overlaid,
+    so a poll of the table only queries the trades of the round.
+    """
+    market = context['market']
+    if traders is None:
+        ready = set(market.all_trades_this_round().filter(was_forced=False).values_list('trader_id', flat=True))
+        traders = [SimpleNamespace(**entry, ready=entry['id'] in ready) for entry in market.ranking()]
+    context['traders'] = traders
+    context['num_ready_traders'] = sum(trader.ready for trader in traders)
+    context['num_active_traders'] = sum(not trader.bankrupt for trader in traders)
+    context['all_are_bankrupt'] = len(traders) > 0 and context['num_active_traders'] == 0
+    # With the round scheduler running, rounds are finished on the server (see scheduler.py)
+    context['round_scheduler'] = settings.ROUND_SCHEDULER
+    return context
+
+
+def add_graph_context_for_monitor_page(context, all_traders=None, trades=None, round_stats=None):
     """ 
-    This function produces all the data for the graphs on the monitor pages
+    This function produces all the data for the graphs on the monitor pages.
+    The traders (ordered by -balance), the trades and the round stats (ordered by round) are loaded
+    from the database unless given (as for archived markets, see archive.py).
     """
     market = context['market']
 
@@ -131,18 +166,23 @@ def add_graph_context_for_monitor_page(context):
     # If the app gets slow, we should refactor and optimize
 
     color_for_averages = 'blue'
+    color_for_equilibrium = 'grey'
+
+    # On the monitor page graphs, we only want to show data for previous rounds.
+    # We load the trades of all traders in one query (instead of one query pr. trader and graph)
+    if trades is None:
+        trades = market.trades().filter(round__lte=market.round - 1).order_by('round')
+    trades_by_trader = defaultdict(list)
+    for trade in trades:
+        if trade.round <= market.round - 1:
+            trades_by_trader[trade.trader_id].append(trade)
 
     def generate_price_list(trader):
-        # On the monitor page price graph, we only want to show data for previous rounds.
-        trades = Trade.objects.filter(
-            trader=trader, round__lte=market.round - 1)
+        trades = trades_by_trader[trader.id]
         return [float(trade.unit_price) if (trade.unit_price != None) else None for trade in trades]
 
     def generate_amount_list(trader):
-        # On the monitor page amount graph, we only want to show data for previous rounds.
-        trades = Trade.objects.filter(
-            trader=trader, round__lte=market.round - 1)
-
+        trades = trades_by_trader[trader.id]
         return [float(trade.unit_amount) if (trade.unit_amount != None) else None for trade in trades]
 
     def trader_color(i):
@@ -157,13 +197,14 @@ def add_graph_context_for_monitor_page(context):
         return f"rgb({red},{green},{blue}, 0.3)"
 
     # We want graphs to show data for all (including possibly removed) traders
-    all_traders = market.all_traders()
+    if all_traders is None:
+        all_traders = list(market.all_traders().select_related('market'))
 
     balanceDataSet = [{
         'label': trader.name,
         'backgroundColor': trader_color(i),
         'borderColor': trader_color(i),
-        'data': generate_balance_list(trader)
+        'data': generate_balance_list(trader, trades_by_trader[trader.id])
     }
         for i, trader in enumerate(all_traders)
     ]
@@ -186,21 +227,28 @@ def add_graph_context_for_monitor_page(context):
         for i, trader in enumerate(all_traders)
     ]
 
-    active_or_bankrupt_traders = market.active_or_bankrupt_traders()
+    active_or_bankrupt_traders = [trader for trader in all_traders if not trader.removed_from_market]
+    spreadDataSet = []
+    concentrationDataSet = []
 
     # If at least one trader is participating in the market (bankrupt or non-bankrupt):
     if active_or_bankrupt_traders:
         # We add average data to graph datasets
 
-        round_stats = RoundStat.objects.filter(market=market)
+        if round_stats is None:
+            round_stats = market.round_stats().order_by('round')
 
         # Average balances
         avg_balances = [float(market.initial_balance)] + [float(round_stat.avg_balance_after)
                                                           for round_stat in round_stats]
         # the average balance in the current round might change during the round (due to new traders joining the market),
-        # so we update this value on each page reload:
-        avg_balance_this_round_so_far = sum(
-            [trader.balance for trader in active_or_bankrupt_traders])/len(active_or_bankrupt_traders)
+        # so we update this value on each page reload from the running totals of the market. The totals
+        # of an archived market are gone with its traders, and the totals may not have caught up with a
+        # trader who has just joined, so then the balances of the traders are summed.
+        avg_balance_this_round_so_far = None if market.archived else market.avg_balance()
+        if avg_balance_this_round_so_far is None:
+            avg_balance_this_round_so_far = sum(
+                [trader.balance for trader in active_or_bankrupt_traders])/len(active_or_bankrupt_traders)
         avg_balances[-1] = float(avg_balance_this_round_so_far)
 
         balanceDataSet.append({
@@ -235,7 +283,61 @@ def add_graph_context_for_monitor_page(context):
             'borderWidth': 2
         })
 
+        # Equilibrium benchmarks. These are calculated when the market parameters change
+        # and stored with each round, so no calculations are needed here.
+        eq_prices = [round_stat.eq_price for round_stat in round_stats]
+        eq_amounts = [round_stat.eq_amount for round_stat in round_stats]
+        if not market.game_over:
+            eq_prices.append(market.eq_price)
+            eq_amounts.append(market.eq_amount)
+
+        priceDataSet.append({
+            'label': 'Equilibrium',
+            'backgroundColor': color_for_equilibrium,
+            'borderColor': color_for_equilibrium,
+            'data': [float(eq_price) if eq_price is not None else None for eq_price in eq_prices],
+            'borderWidth': 2,
+            'borderDash': [6, 6],
+            'pointRadius': 0
+        })
+
+        amountDataSet.append({
+            'label': 'Equilibrium',
+            'backgroundColor': color_for_equilibrium,
+            'borderColor': color_for_equilibrium,
+            'data': [float(eq_amount) if eq_amount is not None else None for eq_amount in eq_amounts],
+            'borderWidth': 2,
+            'borderDash': [6, 6],
+            'pointRadius': 0
+        })
+
+        # The spread of the prices and the concentration of the sales (see RoundStat). Rounds settled
+        # before these statistics were saved have no data.
+        def stat_list(field):
+            return [float(getattr(round_stat, field)) if getattr(round_stat, field) is not None else None
+                    for round_stat in round_stats]
+
+        for label, field, color in [('Min.', 'min_price', 'lightblue'), ('Median', 'median_price', color_for_averages),
+                                    ('Maks.', 'max_price', 'lightblue'), ('Std.afv.', 'price_stddev', 'orange')]:
+            spreadDataSet.append({
+                'label': label,
+                'backgroundColor': color,
+                'borderColor': color,
+                'data': stat_list(field),
+                'borderWidth': 2
+            })
+
+        concentrationDataSet.append({
+            'label': 'HHI',
+            'backgroundColor': color_for_averages,
+            'borderColor': color_for_averages,
+            'data': stat_list('hhi'),
+            'borderWidth': 2
+        })
+
     context['balanceDataSet'] = json.dumps(balanceDataSet)
     context['priceDataSet'] = json.dumps(priceDataSet)
     context['amountDataSet'] = json.dumps(amountDataSet)
+    context['spreadDataSet'] = json.dumps(spreadDataSet)
+    context['concentrationDataSet'] = json.dumps(concentrationDataSet)
     return context
@@ -0,0 +1,360 @@
+"""
+Export and deterministic replay of the history of a market.
+
+export_market_history turns a market and all its traders, trades and round statistics into a
+json-serializable dict. replay_market_history plays such a history again on a new market using
+the same engine as the finish_round view, and compares the result with the recorded history.
+This makes it possible to reproduce bugs seen in production and to run batches of recorded
+markets as regression tests (see the export_market_history and replay_market_history commands).
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.utils.dateparse import parse_datetime
+
+from . import engine
+from .models import Market, Trader, Trade, RoundStat, UnusedCosts, UsedCosts, new_unique_market_id
+
+
+# Bump when the format changes
+HISTORY_VERSION = 4
+
+MARKET_FIELDS = [
+    'market_id', 'product_name_singular', 'product_name_plural', 'alpha', 'theta', 'gamma',
+    'initial_balance', 'min_cost', 'max_cost', 'cost_slope', 'accum_cost_change', 'round',
+    'max_rounds', 'endless', 'allow_robots', 'monitor_auto_pilot', 'game_over', 'created_at', 'seed',
+    'round_deadline',
+]
+
+TRADE_RESULT_FIELDS = ['was_forced', 'demand', 'units_sold', 'profit', 'balance_before', 'balance_after']
+
+ROUND_STAT_FIELDS = ['avg_price', 'avg_balance_after', 'avg_amount']
+
+# The statistics of the rounds added in version 4 (shown on the monitor page; not compared by the replay)
+EXTENDED_STAT_FIELDS = ['median_price', 'min_price', 'max_price', 'price_stddev', 'units_produced', 'units_sold',
+                        'total_profit', 'hhi']
+
+
+def _dump(value):
+    """ Decimals and datetimes are stored as strings to keep them exact """
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _decimal(value):
+    return None if value is None else Decimal(value)
+
+
+def export_market_history(market):
+    """
+    Returns the full history of the market as a dict: parameters, joins (with the production
+    cost each trader was assigned), trades, removals, bankruptcies and settled rounds.
+    """
+    traders = list(Trader.objects.filter(market=market).order_by('id'))
+    trades = list(Trade.objects.filter(market=market).order_by('round', 'id'))
+    round_stats = list(RoundStat.objects.filter(market=market).order_by('round'))
+
+    # The production cost a trader was assigned when joining is the cost on his trade in the round
+    # he joined (costs change during the game). If that round is not finished yet, it is his current cost.
+    round_joined = {trader.id: trader.round_joined for trader in traders}
+    join_costs = {trade.trader_id: trade.prod_cost for trade in trades
+                  if trade.prod_cost is not None and trade.round == round_joined[trade.trader_id]}
+
+    trades_by_trader = defaultdict(list)
+    for trade in trades:
+        trades_by_trader[trade.trader_id].append(trade)
+
+    exported_traders = []
+    for trader in traders:
+        exported_traders.append({
+            'id': trader.id,
+            'name': trader.name,
+            'prod_cost': _dump(join_costs.get(trader.id, trader.prod_cost)),
+            'final_prod_cost': _dump(trader.prod_cost),
+            'balance': _dump(trader.balance),
+            'round_joined': trader.round_joined,
+            'created_at': _dump(trader.created_at),
+            'auto_play': trader.auto_play,
+            'round_removed': (trader.round_removed if trader.round_removed is not None
+                              else guess_round_removed(trader, trades_by_trader[trader.id], market)),
+            'round_bankrupt': (trader.round_bankrupt if trader.round_bankrupt is not None
+                               else guess_round_bankrupt(trader, trades_by_trader[trader.id])),
+        })
+
+    return {
+        'version': HISTORY_VERSION,
+        'market': {field: _dump(getattr(market, field)) for field in MARKET_FIELDS},
+        'traders': exported_traders,
+        'trades': [{
+            'trader': trade.trader_id,
+            'round': trade.round,
+            'unit_price': _dump(trade.unit_price),
+            'unit_amount': trade.unit_amount,
+            'prod_cost': _dump(trade.prod_cost),
+            'created_at': _dump(trade.created_at),
+            **{field: _dump(getattr(trade, field)) for field in TRADE_RESULT_FIELDS},
+        } for trade in trades],
+        'settlements': [{
+            'round': round_stat.round,
+            'alpha': _dump(round_stat.alpha),
+            'theta': _dump(round_stat.theta),
+            'gamma': _dump(round_stat.gamma),
+            'created_at': _dump(round_stat.created_at),
+            # The benchmarks shown on the monitor page (from version 3; not used by the replay)
+            'eq_price': _dump(round_stat.eq_price),
+            'eq_amount': _dump(round_stat.eq_amount),
+            **{field: _dump(getattr(round_stat, field)) for field in ROUND_STAT_FIELDS + EXTENDED_STAT_FIELDS},
+        } for round_stat in round_stats],
+        'unused_costs': [_dump(cost) for cost in UnusedCosts.objects.filter(
+            market=market).order_by('id').values_list('cost', flat=True)],
+        'used_costs': [_dump(cost) for cost in UsedCosts.objects.filter(
+            market=market).order_by('id').values_list('cost', flat=True)],
+    }
+
+
+def guess_round_removed(trader, trades, market):
+    """
+    Traders removed before round_removed was recorded: the first forced trade without a balance
+    after the trader joined marks the round of removal.
+    """
+    if not trader.removed_from_market:
+        return None
+    for trade in trades:
+        if trade.round >= trader.round_joined and trade.was_forced and trade.balance_before is None:
+            return trade.round
+    return market.round
+
+
+def guess_round_bankrupt(trader, trades):
+    """
+    Traders who declared bankruptcy before round_bankrupt was recorded: the round after their last valid trade.
+    """
+    if not trader.bankrupt:
+        return None
+    valid_rounds = [trade.round for trade in trades if not trade.was_forced]
+    return max(valid_rounds) + 1 if valid_rounds else trader.round_joined
+
+
+def replay_market_history(history):
+    """
+    Replays the history on a new market and returns (market, mismatches), where mismatches is a
+    list of human readable differences between the replay and the recorded history.
+
+    Each round is replayed in this order: traders join, the recorded trade decisions are made,
+    traders are removed or go bankrupt, and the round is finished by engine.finish_round with the
+    market parameters recorded for the round. Production costs are taken from the recorded trades,
+    so cost changes made during the game are reproduced exactly.
+    """
+    data = history['market']
+    market_id = data['market_id']
+    if Market.objects.filter(market_id=market_id).exists():
+        market_id = new_unique_market_id()
+
+    market = Market(
+        market_id=market_id,
+        product_name_singular=data['product_name_singular'],
+        product_name_plural=data['product_name_plural'],
+        initial_balance=_decimal(data['initial_balance']),
+        alpha=_decimal(data['alpha']),
+        theta=_decimal(data['theta']),
+        gamma=_decimal(data['gamma']),
+        min_cost=_decimal(data['min_cost']),
+        max_cost=_decimal(data['max_cost']),
+        max_rounds=data['max_rounds'],
+        endless=data['endless'],
+        allow_robots=data['allow_robots'],
+    )
+    # Histories exported before markets had seeds (version 1) get a new seed
+    if data.get('seed') is not None:
+        market.seed = data['seed']
+    market.save()
+    # The trades get their recorded timestamps (see below), and the market must not be younger than
+    # its trades (see Market.trades)
+    recorded_times = [parse_datetime(trade['created_at']) for trade in history['trades'] if trade['created_at']]
+    if recorded_times and min(recorded_times) < market.created_at:
+        market.created_at = min(recorded_times)
+        market.save(update_fields=['created_at'])
+
+    # Traders get their recorded production costs, and the pools of used and unused costs
+    # used by Trader.prod_cost_algorithm are restored as recorded
+    UnusedCosts.objects.bulk_create(
+        [UnusedCosts(market=market, cost=_decimal(cost)) for cost in history['unused_costs']])
+    UsedCosts.objects.bulk_create(
+        [UsedCosts(market=market, cost=_decimal(cost)) for cost in history['used_costs']])
+
+    joins = defaultdict(list)
+    removals = defaultdict(list)
+    bankruptcies = defaultdict(list)
+    for trader_data in history['traders']:
+        joins[trader_data['round_joined']].append(trader_data)
+        if trader_data['round_removed'] is not None:
+            removals[trader_data['round_removed']].append(trader_data['id'])
+        if trader_data['round_bankrupt'] is not None:
+            bankruptcies[trader_data['round_bankrupt']].append(trader_data['id'])
+
+    decisions = defaultdict(list)
+    prod_costs = defaultdict(dict)
+    for trade_data in history['trades']:
+        if not trade_data['was_forced']:
+            decisions[trade_data['round']].append(trade_data)
+        if trade_data['prod_cost'] is not None:
+            prod_costs[trade_data['round']][trade_data['trader']] = _decimal(trade_data['prod_cost'])
+    settlements = {settlement['round']: settlement for settlement in history['settlements']}
+
+    # Maps the trader ids in the history to the replayed traders (and back)
+    traders = {}
+    recorded_ids = {}
+
+    for round_num in range(data['round'] + 1):
+        # Traders join
+        new_traders = [Trader(
+            market=market,
+            name=trader_data['name'],
+            prod_cost=_decimal(trader_data['prod_cost']),
+            balance=market.initial_balance,
+            round_joined=round_num,
+            auto_play=trader_data['auto_play'],
+        ) for trader_data in joins[round_num]]
+        Trader.objects.bulk_create(new_traders)
+        for trader_data, trader in zip(joins[round_num], new_traders):
+            traders[trader_data['id']] = trader
+            recorded_ids[trader.id] = trader_data['id']
+        joined_now = {trader_data['id'] for trader_data in joins[round_num]}
+        # Traders joining late get forced trades in the previous rounds (see the join_market view)
+        Trade.objects.bulk_create([
+            Trade(trader=traders[trade_data['trader']], market=market, round=trade_data['round'], was_forced=True)
+            for trade_data in history['trades']
+            if trade_data['trader'] in joined_now and trade_data['round'] < round_num])
+
+        if round_num in settlements:
+            settlement = settlements[round_num]
+            for field in ['alpha', 'theta', 'gamma']:
+                if settlement[field] is not None:
+                    setattr(market, field, _decimal(settlement[field]))
+
+        # Production costs of this round
+        changed = []
+        for recorded_id, prod_cost in prod_costs[round_num].items():
+            trader = traders[recorded_id]
+            if trader.prod_cost != prod_cost:
+                trader.prod_cost = prod_cost
+                changed.append(trader)
+        Trader.objects.bulk_update(changed, ['prod_cost'])
+
+        # Trade decisions
+        new_trades = []
+        for trade_data in decisions[round_num]:
+            trader = traders[trade_data['trader']]
+            new_trades.append(Trade(
+                trader=trader,
+                market=market,
+                round=round_num,
+                unit_price=_decimal(trade_data['unit_price']),
+                unit_amount=trade_data['unit_amount'],
+                balance_before=trader.balance,
+                prod_cost=trader.prod_cost,
+            ))
+        Trade.objects.bulk_create(new_trades)
+        # created_at is set automatically on creation, so we restore the recorded timestamps afterwards
+        for trade, trade_data in zip(new_trades, decisions[round_num]):
+            if trade_data['created_at']:
+                trade.created_at = parse_datetime(trade_data['created_at'])
+        Trade.objects.bulk_update(new_trades, ['created_at'])
+
+        # Removals and bankruptcies
+        for recorded_id in removals[round_num]:
+            trader = traders[recorded_id]
+            trader.balance = None
+            trader.removed_from_market = True
+            trader.round_removed = round_num
+            trader.save()
+            Trade.objects.filter(trader=trader, round=round_num).delete()
+        for recorded_id in bankruptcies[round_num]:
+            trader = traders[recorded_id]
+            trader.bankrupt = True
+            trader.round_bankrupt = round_num
+            trader.save()
+
+        if round_num in settlements:
+            market.save(update_fields=['alpha', 'theta', 'gamma'] + Market.EQUILIBRIUM_FIELDS)
+            engine.finish_round(market)
+            # The engine has updated the traders in the database
+            for trader in Trader.objects.filter(market=market):
+                traders[recorded_ids[trader.id]] = trader
+
+    # Restore the final state of the market
+    for trader_data in history['traders']:
+        trader = traders[trader_data['id']]
+        trader.prod_cost = _decimal(trader_data['final_prod_cost'])
+    Trader.objects.bulk_update(list(traders.values()), ['prod_cost'])
+    market.accum_cost_change = _decimal(data['accum_cost_change'])
+    market.cost_slope = _decimal(data['cost_slope'])
+    market.monitor_auto_pilot = data['monitor_auto_pilot']
+    market.round_deadline = data.get('round_deadline')
+    market.game_over = data['game_over']
+    market.save(update_fields=['accum_cost_change', 'cost_slope', 'monitor_auto_pilot', 'round_deadline', 'game_over']
+                + Market.EQUILIBRIUM_FIELDS)
+    # The traders were created with bulk_create, so the balance totals are computed from them
+    market.refresh_balance_totals()
+
+    return market, compare_with_history(market, history, recorded_ids)
+
+
+def compare_with_history(market, history, recorded_ids):
+    """
+    Returns a list of differences between the replayed market and the recorded history.
+    """
+    mismatches = []
+
+    replayed_trades = {
+        (recorded_ids[trade.trader_id], trade.round): trade
+        for trade in Trade.objects.filter(market=market)
+    }
+    recorded_trades = {(trade_data['trader'], trade_data['round']): trade_data
+                       for trade_data in history['trades']}
+    for key in sorted(set(recorded_trades) | set(replayed_trades)):
+        if key not in replayed_trades:
+            mismatches.append(f"trade of trader {key[0]} in round {key[1]} is missing in replay")
+            continue
+        if key not in recorded_trades:
+            mismatches.append(f"trade of trader {key[0]} in round {key[1]} only exists in replay")
+            continue
+        for field in TRADE_RESULT_FIELDS:
+            recorded = recorded_trades[key][field]
+            replayed = _dump(getattr(replayed_trades[key], field))
+            if _normalize(recorded) != _normalize(replayed):
+                mismatches.append(
+                    f"trade of trader {key[0]} in round {key[1]}: {field} is {replayed}, recorded {recorded}")
+
+    replayed_stats = {round_stat.round: round_stat for round_stat in RoundStat.objects.filter(market=market)}
+    for settlement in history['settlements']:
+        round_stat = replayed_stats.get(settlement['round'])
+        if round_stat is None:
+            mismatches.append(f"round {settlement['round']} was not settled in replay")
+            continue
+        for field in ROUND_STAT_FIELDS:
+            if _normalize(settlement[field]) != _normalize(_dump(getattr(round_stat, field))):
+                mismatches.append(
+                    f"round {settlement['round']}: {field} is {getattr(round_stat, field)}, recorded {settlement[field]}")
+
+    recorded_traders = {trader_data['id']: trader_data for trader_data in history['traders']}
+    for trader in Trader.objects.filter(market=market):
+        trader_data = recorded_traders[recorded_ids[trader.id]]
+        if _normalize(trader_data['balance']) != _normalize(_dump(trader.balance)):
+            mismatches.append(
+                f"trader {trader_data['id']} ({trader.name}): balance is {trader.balance}, recorded {trader_data['balance']}")
+
+    return mismatches
+
+
+def _normalize(value):
+    """ Compare decimals by value (the database may return '10.2' or '10.20') """
+    if isinstance(value, str):
+        try:
+            return Decimal(value).quantize(Decimal('0.01'))
+        except ArithmeticError:
+            return value
+    return value
@@ -0,0 +1,141 @@
+"""
+The pages listing the markets of a host.
+
+my_markets shows the markets of the host page by page, newest first. The pages use keyset pagination
+on (created_at, market_id): a page is the markets after the last market of the previous page (the
+cursor), so a page is read from the index on the markets of the host, however many markets the host
+has. Each market is shown with the numbers annotated by market_summaries, so a page is one query.
+
+The dashboard shows the live markets of a host (not deleted, archived or over) on one page, so a host
+running several classes at the same time doesn't need a monitor page open for each of them. The
+dashboards are loaded by host_dashboards in one query, and kept up to date by the DashboardWatcher
+(see push.py) with one long polling request pr. open dashboard. Each loaded dashboard is cached for
+DASHBOARD_TIMEOUT seconds, so reloading the page (or opening it on the projector as well) doesn't load
+it again, and wait_for_dashboard renders the table of a host once pr. version. The cached dashboard
+is removed whenever one of the markets of the host changes (see Market.forget_dashboard); new trades
+are shown when the DashboardWatcher loads the dashboard again.
+"""
+import hashlib
+import json
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, F, OuterRef, Q, Subquery, When
+from django.db.models.functions import Greatest
+from django.utils.dateparse import parse_datetime
+
+from .metrics import record_cache
+from .models import Market, RoundStat, Trade, dashboard_key
+from .scheduler import with_trader_counts
+
+# The number of markets on a page of my_markets
+PAGE_SIZE = 25
+
+DASHBOARD_FIELDS = ['market_id', 'round', 'max_rounds', 'endless', 'num_ready', 'num_active', 'avg_price',
+                    'balance_sum', 'balance_count']
+# The number of seconds a loaded dashboard is cached (unless one of the markets changes). While a
+# dashboard is open, the DashboardWatcher loads it every second, so it is at most a second old.
+DASHBOARD_TIMEOUT = 5
+
+
+def market_summaries(user):
+    """
+    Returns the markets of the user which have not been deleted, each annotated with num_traders (the
+    traders who have not been removed) and last_activity (the last trade, settlement or creation).
+    """
+    last_trade = Trade.objects.filter(market=OuterRef('pk'), round=OuterRef('round')).order_by('-created_at')
+    return Market.objects.filter(created_by=user, deleted=False).annotate(
+        # The traders of an archived market are gone, so their number is kept by the archive
+        num_traders=Case(When(archived=True, then=F('marketarchive__num_traders')), default=F('balance_count')),
+        # GREATEST ignores nulls (PostgreSQL)
+        last_activity=Greatest(Subquery(last_trade.values('created_at')[:1]), 'round_started_at', 'created_at'),
+    )
+
+
+def page_of_markets(user, cursor=None, page_size=None):
+    """
+    Returns (markets, next_cursor): the page of market_summaries of the user following cursor (the first
+    page if cursor is None), and the cursor of the next page (None on the last page).
+    The markets are ordered by -created_at, then -market_id. Markets made before created_at was recorded
+    have no created_at and come first (as PostgreSQL orders nulls in descending order).
+    """
+    page_size = page_size or PAGE_SIZE
+    markets = market_summaries(user).order_by(F('created_at').desc(nulls_first=True), '-market_id')
+    if cursor is not None:
+        created_at, market_id = cursor
+        if created_at is None:
+            markets = markets.filter(Q(created_at__isnull=True, market_id__lt=market_id) | Q(created_at__isnull=False))
+        else:
+            markets = markets.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, market_id__lt=market_id))
+    markets = list(markets[:page_size + 1])
+    if len(markets) <= page_size:
+        return markets, None
+    markets = markets[:page_size]
+    return markets, (markets[-1].created_at, markets[-1].market_id)
+
+
+def format_cursor(cursor):
+    """ Returns the cursor as a string for the URL of the next page """
+    created_at, market_id = cursor
+    return f"{created_at.isoformat() if created_at else ''}~{market_id}"
+
+
+def parse_cursor(value):
+    """ Returns the cursor of a string made by format_cursor, or None if it is not valid """
+    created_at, separator, market_id = (value or '').rpartition('~')
+    if not separator or not market_id:
+        return None
+    if not created_at:
+        return None, market_id
+    try:
+        created_at = parse_datetime(created_at)
+    except ValueError:
+        return None
+    return (created_at, market_id) if created_at else None
+
+
+def host_dashboards(host_ids):
+    """
+    Returns a dict with the dashboard of each of the hosts (one query for all of them). A dashboard is a
+    dict with the live markets of the host (newest first) and a version, which changes whenever a number
+    shown on the dashboard changes. Each market is a dict with market_id, round, max_rounds, endless, the
+    numbers of ready, active and bankrupt traders, the average price of the last round and the average
+    balance (from the running totals of the market). The dashboards are cached (see dashboard).
+    """
+    last_round = RoundStat.objects.filter(market=OuterRef('pk'), round=OuterRef('round') - 1)
+    markets = with_trader_counts(Market.objects.filter(
+        created_by__in=host_ids, deleted=False, archived=False, game_over=False,
+    )).annotate(
+        avg_price=Subquery(last_round.values('avg_price')[:1]),
+    ).order_by(F('created_at').desc(nulls_first=True), '-market_id')
+
+    dashboards = {host_id: [] for host_id in host_ids}
+    for market in markets.values('created_by', *DASHBOARD_FIELDS):
+        balance_sum, balance_count = market.pop('balance_sum'), market.pop('balance_count')
+        market['avg_balance'] = (balance_sum / balance_count).quantize(Decimal('0.01')) if balance_count else None
+        # The running totals count the active and the bankrupt traders
+        market['num_bankrupt'] = balance_count - market['num_active']
+        dashboards[market.pop('created_by')].append(market)
+    dashboards = {host_id: {'markets': markets, 'version': _version(markets)}
+                  for host_id, markets in dashboards.items()}
+    cache.set_many({dashboard_key(host_id): dashboard for host_id, dashboard in dashboards.items()},
+                   DASHBOARD_TIMEOUT)
+    return dashboards
+
+
+def dashboard(user):
+    """
+    Returns the dashboard of the user (see host_dashboards). The dashboard is read from the cache if it
+    was loaded in the last DASHBOARD_TIMEOUT seconds and none of the markets of the user has changed since.
+    """
+    dashboard = cache.get(dashboard_key(user.id))
+    record_cache('dashboard', dashboard is not None)
+    if dashboard is None:
+        dashboard = host_dashboards([user.id])[user.id]
+    return dashboard
+
+
+def _version(markets):
+    data = json.dumps(markets, cls=DjangoJSONEncoder, sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()[:16]
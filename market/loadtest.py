@@ -0,0 +1,99 @@
+"""
+Load test of the push endpoint (wait_for_round).
+
+run_load_test opens a number of concurrent clients, which wait for the next round like idle
+players on the play page: each client asks wait_for_round with the current state of the market,
+so the request is held open by the server until the state changes or the request times out, and
+then asks again. Uses plain asyncio streams (HTTP/1.1 with keep-alive), so thousands of clients can
+run in one process. See the load_test_push command.
+"""
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlencode, urlsplit
+
+
+async def _get(reader, writer, host, path):
+    """ Makes a GET request on an open connection and returns (status, body) """
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def _client(url, state, deadline, stats):
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    stats['connected'] += 1
+    stats['max_open'] = max(stats['max_open'], stats['connected'] - stats['closed'])
+    try:
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            status, body = await _get(reader, writer, parts.netloc, f"{parts.path}?{urlencode(state)}")
+            stats['seconds'].append(time.monotonic() - start)
+            if status != 200:
+                stats['errors'] += 1
+                break
+            stats['responses'] += 1
+            state = _query_state(json.loads(body))
+    finally:
+        stats['closed'] += 1
+        writer.close()
+
+
+def _query_state(data):
+    return {
+        'round': data['round'],
+        'game_over': 'true' if data['game_over'] else 'false',
+        'num_ready_traders': data['num_ready_traders'],
+        'num_active_traders': data['num_active_traders'],
+    }
+
+
+async def _run(url, clients, duration, ramp_up):
+    # The first request answers right away with the current state, which the clients then wait on
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    status, body = await _get(reader, writer, parts.netloc, parts.path)
+    writer.close()
+    if status != 200:
+        raise ValueError(f"{url} answered with status {status}")
+    state = _query_state(json.loads(body))
+
+    stats = {'connected': 0, 'closed': 0, 'max_open': 0, 'responses': 0, 'errors': 0, 'failed': 0, 'seconds': []}
+    deadline = time.monotonic() + duration
+    tasks = []
+    for i in range(clients):
+        tasks.append(asyncio.ensure_future(_client(url, state, deadline, stats)))
+        if ramp_up:
+            await asyncio.sleep(ramp_up / clients)
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            stats['failed'] += 1
+    return stats
+
+
+def run_load_test(url, clients=1000, duration=30.0, ramp_up=5.0):
+    """
+    Runs clients concurrent clients against the wait_for_round url for duration seconds and returns
+    a dict with the number of clients that connected, the maximal number of open connections, the
+    number of responses, errors (status is not 200) and failed clients (e.g. connection refused),
+    and the median and maximal response time in seconds
+    """
+    stats = asyncio.run(_run(url, clients, duration, ramp_up))
+    seconds = stats.pop('seconds')
+    stats['median_seconds'] = statistics.median(seconds) if seconds else None
+    stats['max_seconds'] = max(seconds) if seconds else None
+    return stats
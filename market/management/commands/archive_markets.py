@@ -0,0 +1,54 @@
+# archive_markets.py
+from django.core.management.base import BaseCommand, CommandError
+
+from market.archive import archivable_markets, archive_market
+from market.models import Market
+
+
+class Command(BaseCommand):
+    help = ("Moves the history of finished and deleted markets into compressed archives and deletes their "
+            "traders, trades and round stats in batches (see market/archive.py). The monitor page of an "
+            "archived market is rendered from the archive.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('market_ids', nargs='*', help="Archive these markets (they must be finished or deleted)")
+        parser.add_argument('--days', type=int, default=30,
+                            help="Archive the finished and deleted markets which have not been played for this many days")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows deleted pr. transaction")
+        parser.add_argument('--pause', type=float, default=0.1, help="Seconds to sleep between the batches")
+        parser.add_argument('--max-markets', type=int, default=None, help="Archive at most this many markets")
+        parser.add_argument('--dry-run', action='store_true', help="Only show which markets would be archived")
+
+    def handle(self, *args, **options):
+        if options['market_ids']:
+            market_ids = [market_id.upper() for market_id in options['market_ids']]
+            markets = Market.objects.filter(market_id__in=market_ids)
+            missing = set(market_ids) - set(markets.values_list('market_id', flat=True))
+            if missing:
+                raise CommandError(f"There is no market with ID {', '.join(sorted(missing))}")
+            if markets.filter(game_over=False, deleted=False).exists():
+                raise CommandError("Only finished or deleted markets can be archived")
+            markets = markets.filter(archived=False)
+        else:
+            markets = archivable_markets(options['days'])
+        market_ids = list(markets.order_by('created_at').values_list('market_id', flat=True)[:options['max_markets']])
+
+        if options['dry_run']:
+            for market_id in market_ids:
+                self.stdout.write(f"Would archive {market_id}")
+            self.stdout.write(f"{len(market_ids)} markets would be archived")
+            return
+
+        totals = {}
+        num_archived = 0
+        for market_id in market_ids:
+            deleted = archive_market(market_id, options['batch_size'], options['pause'])
+            if deleted is None:
+                continue
+            num_archived += 1
+            for table, count in deleted.items():
+                totals[table] = totals.get(table, 0) + count
+            self.stdout.write(f"Archived {market_id}: " + ', '.join(
+                f"{count} {table}" for table, count in deleted.items()))
+        self.stdout.write(f"Archived {num_archived} markets, deleted " + ', '.join(
+            f"{count} {table}" for table, count in totals.items()))
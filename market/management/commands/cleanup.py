@@ -0,0 +1,29 @@
+# cleanup.py
+from django.core.management.base import BaseCommand, CommandError
+
+from market.cleanup import collect_garbage
+
+
+class Command(BaseCommand):
+    help = ("Deletes expired sessions, abandoned markets (round 0 without traders) and the cost pools left by "
+            "archived markets in small batches (see market/cleanup.py). Safe to run every few minutes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--session-days', type=int, default=0,
+                            help="Delete the sessions which expired more than this many days ago")
+        parser.add_argument('--market-days', type=int, default=7,
+                            help="Delete the abandoned markets created more than this many days ago")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows deleted pr. transaction")
+        parser.add_argument('--pause', type=float, default=0.1, help="Seconds to sleep between the batches")
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Delete at most this many batches of each kind (the rest is left for the next run)")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        deleted = collect_garbage(options['session_days'], options['market_days'], options['batch_size'],
+                                  options['pause'], options['max_batches'])
+        if deleted is None:
+            self.stdout.write("Another cleanup is running")
+            return
+        self.stdout.write("Deleted " + ', '.join(f"{count} {kind}" for kind, count in deleted.items()))
@@ -0,0 +1,33 @@
+# compare_benchmarks.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.benchmarks import compare_results
+
+
+class Command(BaseCommand):
+    help = ("Compares two result files of run_benchmarks and fails if a case got slower than the "
+            "threshold or makes more queries than in the baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('baseline')
+        parser.add_argument('current')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help="Allowed growth of the median wall time as a fraction (default: %(default)s)")
+        parser.add_argument('--min-ms', type=float, default=1.0,
+                            help="Differences below this number of milliseconds are ignored (default: %(default)s)")
+
+    def handle(self, *args, **options):
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        with open(options['current']) as f:
+            current = json.load(f)
+
+        regressions = compare_results(baseline, current, options['threshold'], options['min_ms'])
+        for (view, traders, rounds), message in regressions:
+            self.stdout.write(f"{view} ({traders} traders, {rounds} rounds): {message}")
+
+        if regressions:
+            raise CommandError(f"{len(regressions)} regressions")
+        self.stdout.write(f"No regressions in {len(current['results'])} cases")
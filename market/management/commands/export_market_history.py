@@ -0,0 +1,39 @@
+# export_market_history.py
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.archive import load_history
+from market.models import Market
+
+
+class Command(BaseCommand):
+    help = ("Exports the full history of markets (parameters, joins, trades, removals and settlements) "
+            "as json files, which can be replayed with the replay_market_history command.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('market_ids', nargs='*')
+        parser.add_argument('--all-finished', action='store_true', help="Export all markets where the game is over")
+        parser.add_argument('--output', default='.', help="Directory for the json files (one file pr. market)")
+
+    def handle(self, *args, **options):
+        markets = Market.objects.filter(market_id__in=[market_id.upper() for market_id in options['market_ids']])
+        if options['all_finished']:
+            markets = markets | Market.objects.filter(game_over=True)
+        markets = list(markets.order_by('market_id'))
+
+        missing = set(market_id.upper() for market_id in options['market_ids']) - \
+            set(market.market_id for market in markets)
+        if missing:
+            raise CommandError(f"There is no market with ID {', '.join(sorted(missing))}")
+        if not markets:
+            raise CommandError("Give one or more market IDs or use --all-finished")
+
+        output = Path(options['output'])
+        output.mkdir(parents=True, exist_ok=True)
+        for market in markets:
+            path = output / f"{market.market_id}.json"
+            with open(path, 'w') as f:
+                json.dump(load_history(market), f, indent=1)
+            self.stdout.write(f"Exported {market.market_id} to {path}")
@@ -0,0 +1,46 @@
+# fast_forward_market.py
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.economics import BOTS
+from market.engine import fast_forward
+from market.models import Market
+
+
+class Command(BaseCommand):
+    help = ("Plays a number of rounds of a market in one transaction. Traders in robot mode "
+            "decide automatically, all other traders get forced trades.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('market_id')
+        parser.add_argument('--rounds', type=int, default=10)
+        parser.add_argument('--bot', choices=sorted(BOTS), default='cautious',
+                            help="The algorithm used to make decisions for the robots")
+        parser.add_argument('--all-bots', action='store_true',
+                            help="Let all active traders decide automatically, not only traders in robot mode")
+        parser.add_argument('--seed', type=int,
+                            help="Seed for the random choices of the robots (default: the seed of the market)")
+
+    def handle(self, *args, **options):
+        try:
+            market = Market.objects.get(market_id=options['market_id'].upper())
+        except Market.DoesNotExist:
+            raise CommandError(f"There is no market with ID {options['market_id']}")
+
+        rng = random.Random(options['seed']) if options['seed'] is not None else None
+        report = fast_forward(market, options['rounds'], options['bot'], options['all_bots'], rng)
+
+        for result in report:
+            self.stdout.write(
+                f"round {result['round'] + 1}: {result['seconds'] * 1000:.1f} ms "
+                f"({result['num_trades']} trades, {result['num_forced_trades']} forced)")
+
+        if len(report) < options['rounds']:
+            market.refresh_from_db()
+            reason = "the game is over" if market.game_over else "no trader traded in the current round"
+            self.stdout.write(f"Stopped after {len(report)} rounds, as {reason}")
+        if report:
+            total_time = sum(result['seconds'] for result in report)
+            self.stdout.write(
+                f"Played {len(report)} rounds in {total_time:.3f} s ({total_time / len(report) * 1000:.1f} ms pr. round)")
@@ -0,0 +1,31 @@
+# load_test_push.py
+from django.core.management.base import BaseCommand, CommandError
+
+from market.loadtest import run_load_test
+
+
+class Command(BaseCommand):
+    help = ("Load test of the push endpoint: opens a number of concurrent clients waiting for the next "
+            "round of a market, e.g. http://localhost:8001/<market_id>/wait_for_round/")
+
+    def add_arguments(self, parser):
+        parser.add_argument('url')
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--duration', type=float, default=30.0,
+                            help="Seconds the clients keep waiting")
+        parser.add_argument('--ramp-up', type=float, default=5.0,
+                            help="Seconds over which the clients are started")
+
+    def handle(self, *args, **options):
+        try:
+            stats = run_load_test(options['url'], options['clients'], options['duration'], options['ramp_up'])
+        except (OSError, ValueError) as error:
+            raise CommandError(f"Could not reach {options['url']}: {error}")
+
+        self.stdout.write(
+            f"{stats['connected']} of {options['clients']} clients connected "
+            f"({stats['max_open']} connections open at the same time, {stats['failed']} failed)")
+        self.stdout.write(f"{stats['responses']} responses, {stats['errors']} errors")
+        if stats['median_seconds'] is not None:
+            self.stdout.write(
+                f"Response time: median {stats['median_seconds']:.2f} s, max {stats['max_seconds']:.2f} s")
@@ -0,0 +1,44 @@
+# partitions.py
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.partitions import PARTITIONED_TABLES, detach_partition, ensure_partitions, is_partitioned, partitions
+
+
+class Command(BaseCommand):
+    help = ("Maintains the monthly partitions of the trades and round stats (see market/partitions.py): creates "
+            "the partitions of the coming months and detaches the partitions of old months. Run it daily.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3, help="Create the partitions of this many coming months")
+        parser.add_argument('--detach-before', metavar='YYYY-MM', default=None,
+                            help="Detach the partitions of the months before this month. The detached partitions "
+                                 "become plain tables, which can be dumped and dropped")
+
+    def handle(self, *args, **options):
+        if not all(is_partitioned(table) for table in PARTITIONED_TABLES):
+            raise CommandError("The tables are not partitioned (partitioning requires PostgreSQL)")
+
+        for name in ensure_partitions(options['ahead']):
+            self.stdout.write(f"Created {name}")
+
+        if options['detach_before']:
+            try:
+                year, month = options['detach_before'].split('-')
+                before = date(int(year), int(month), 1)
+            except ValueError:
+                raise CommandError("--detach-before must be a month like 2024-01")
+            for table in PARTITIONED_TABLES:
+                for name, month, _ in partitions(table):
+                    if month >= before:
+                        continue
+                    try:
+                        detach_partition(table, month)
+                        self.stdout.write(f"Detached {name}")
+                    except ValueError as error:
+                        self.stderr.write(f"Not detached: {error}")
+
+        for table in PARTITIONED_TABLES:
+            for name, month, rows in partitions(table):
+                self.stdout.write(f"{name}: about {rows} rows")
@@ -0,0 +1,49 @@
+# replay_market_history.py
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from market.history import replay_market_history
+
+
+class Command(BaseCommand):
+    help = ("Replays market histories exported by export_market_history and checks that the replay "
+            "gives the recorded results. Use it to reproduce bugs and as a regression test of the engine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="json files or directories with json files")
+        parser.add_argument('--keep', action='store_true',
+                            help="Keep the replayed markets in the database (they are rolled back by default)")
+
+    def handle(self, *args, **options):
+        files = []
+        for path in map(Path, options['paths']):
+            files.extend(sorted(path.glob('*.json')) if path.is_dir() else [path])
+
+        num_failed = 0
+        for path in files:
+            with open(path) as f:
+                history = json.load(f)
+
+            start = time.perf_counter()
+            with transaction.atomic():
+                market, mismatches = replay_market_history(history)
+                if not options['keep']:
+                    transaction.set_rollback(True)
+            seconds = time.perf_counter() - start
+
+            recorded_id = history['market']['market_id']
+            if mismatches:
+                num_failed += 1
+                self.stdout.write(f"{path}: {recorded_id} FAILED ({seconds:.2f} s)")
+                for mismatch in mismatches:
+                    self.stdout.write(f"  {mismatch}")
+            else:
+                kept = f", kept as {market.market_id}" if options['keep'] else ""
+                self.stdout.write(f"{path}: {recorded_id} OK ({seconds:.2f} s{kept})")
+
+        if num_failed:
+            raise CommandError(f"{num_failed} of {len(files)} replays did not match the recorded history")
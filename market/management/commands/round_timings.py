@@ -0,0 +1,47 @@
+# round_timings.py
+import statistics
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.models import Market, RoundStat, Trade
+
+
+class Command(BaseCommand):
+    help = ("Shows how long each round of a market took: the time the traders took to decide (median and "
+            "slowest) and the time spent settling the round on the server.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('market_id')
+
+    def handle(self, *args, **options):
+        try:
+            market = Market.objects.get(market_id=options['market_id'].upper())
+        except Market.DoesNotExist:
+            raise CommandError(f"There is no market with ID {options['market_id']}")
+
+        decision_seconds = defaultdict(list)
+        for round_num, seconds in Trade.objects.filter(
+                market=market, decision_seconds__isnull=False).values_list('round', 'decision_seconds'):
+            decision_seconds[round_num].append(seconds)
+
+        self.stdout.write("round  length  trades  forced  decision median/max  settlement load/compute/write")
+        for round_stat in RoundStat.objects.filter(market=market).order_by('round'):
+            length = (round_stat.created_at - round_stat.started_at).total_seconds() \
+                if round_stat.started_at and round_stat.created_at else None
+            decisions = decision_seconds.get(round_stat.round)
+            settlement = [round_stat.load_seconds, round_stat.compute_seconds, round_stat.write_seconds]
+            self.stdout.write(
+                f"{round_stat.round + 1:5}  {_seconds(length):>6}  {_count(round_stat.num_trades):>6}  "
+                f"{_count(round_stat.num_forced_trades):>6}  "
+                f"{_seconds(statistics.median(decisions) if decisions else None):>8} / "
+                f"{_seconds(max(decisions) if decisions else None):<8}  "
+                + ' / '.join(f"{seconds * 1000:.1f} ms" if seconds is not None else '-' for seconds in settlement))
+
+
+def _seconds(seconds):
+    return '-' if seconds is None else f"{seconds:.1f} s"
+
+
+def _count(count):
+    return '-' if count is None else str(count)
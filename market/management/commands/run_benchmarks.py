@@ -0,0 +1,49 @@
+# run_benchmarks.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.benchmarks import ROUNDS, TRADERS, VIEWS, run_benchmarks
+
+
+def int_list(value):
+    return [int(part) for part in value.split(',')]
+
+
+class Command(BaseCommand):
+    help = ("Times the hot views (wall time, number of queries and SQL time) on markets of different sizes "
+            "and writes the results as json. Nothing is kept in the database. "
+            "Compare two runs with the compare_benchmarks command.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--traders', type=int_list, default=TRADERS,
+                            help="Comma separated numbers of traders (default: %(default)s)")
+        parser.add_argument('--rounds', type=int_list, default=ROUNDS,
+                            help="Comma separated numbers of played rounds (default: %(default)s)")
+        parser.add_argument('--views', default=','.join(VIEWS), help="Comma separated views (default: all)")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timed requests pr. case")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="File for the json results (default: stdout)")
+
+    def handle(self, *args, **options):
+        views = options['views'].split(',')
+        unknown = set(views) - set(VIEWS)
+        if unknown:
+            raise CommandError(f"Unknown views: {', '.join(sorted(unknown))}. Choose from {', '.join(VIEWS)}")
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        def progress(result):
+            self.stderr.write(
+                f"{result['view']:>14} {result['traders']:>4} traders {result['rounds']:>5} rounds: "
+                f"{result['wall_ms']['median']:8.1f} ms, {result['queries']:4} queries, "
+                f"{result['sql_ms']['median']:8.1f} ms SQL")
+
+        results = run_benchmarks(options['traders'], options['rounds'], views, options['repeat'],
+                                 options['seed'], progress)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=1)
+        else:
+            self.stdout.write(json.dumps(results, indent=1))
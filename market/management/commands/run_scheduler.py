@@ -0,0 +1,45 @@
+# run_scheduler.py
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.metrics import start_metrics_server
+from market.scheduler import Scheduler
+
+
+class Command(BaseCommand):
+    help = ("Finishes rounds on the server: when all traders are ready in markets with auto-pilot, and when "
+            "the deadline has passed in markets with a round deadline. Several schedulers can run at the "
+            "same time; only one of them (the leader) finishes rounds.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds between checking the markets")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Number of rounds finished at the same time")
+        parser.add_argument('--once', action='store_true',
+                            help="Finish the due rounds once and exit")
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help="Serve the metrics of the scheduler (the settlements) for Prometheus on this port")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+        scheduler = Scheduler(options['interval'], options['workers'])
+
+        if options['once']:
+            if not scheduler.try_to_become_leader():
+                raise CommandError("Another scheduler is running")
+            finished = scheduler.tick()
+            self.stdout.write(f"Finished {len(finished)} rounds")
+            return
+
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'])
+        stop = threading.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *args: stop.set())
+        self.stdout.write(f"Scheduler started (checking the markets every {options['interval']} s)")
+        scheduler.run(stop)
+        self.stdout.write("Scheduler stopped")
@@ -1,69 +1,70 @@
 # setup_test_data.py
 import random
+import time
 
 from django.db import transaction
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from market.tests.factories import UserFactory, MarketFactory
+from market.economics import REFERENCE_POPULATIONS
+from market.synthetic import MAX_ENDLESS_ROUNDS, create_users, generate_markets
 
 
-# from forum.models import User, Thread, Club, Comment
-# from forum.factories import (
-#     UserFactory,
-#     ThreadFactory,
-#     ClubFactory,
-#     CommentFactory
-# )
-
-# NUM_USERS = 50
-# NUM_CLUBS = 10
-# NUM_THREADS = 12
-# COMMENTS_PER_THREAD = 25
-# USERS_PER_CLUB = 8
-
 class Command(BaseCommand):
-    help = "Generates test data for development server"
+    help = ("Generates test data for development server and benchmarks: users and markets with all the "
+            "scenarios, played for a number of rounds by robots. The same seed gives the same data.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--markets', type=int, default=20)
+        parser.add_argument('--min-traders', type=int, default=10)
+        parser.add_argument('--max-traders', type=int, default=150)
+        parser.add_argument('--rounds', type=int,
+                            help="Rounds played in each market (default: a random number up to max_rounds)")
+        parser.add_argument('--endless-rounds', type=int, default=MAX_ENDLESS_ROUNDS,
+                            help="Maximal number of rounds played in endless markets")
+        parser.add_argument('--endless-share', type=float, default=0.1,
+                            help="The share of the markets that are endless")
+        parser.add_argument('--population', choices=sorted(REFERENCE_POPULATIONS), default='mixed',
+                            help="The robots playing the traders")
+        parser.add_argument('--skip-share', type=float, default=0.05,
+                            help="The probability that a trader does not trade in a round")
+        parser.add_argument('--user-prefix', default='test',
+                            help="Users are named <prefix>0, <prefix>1, ... and have the password 'test'")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
 
     @transaction.atomic
-    def handle(self, *args, **kwargs):
-        self.stdout.write("Adding test users")
+    def handle(self, *args, **options):
+        if not 1 <= options['min_traders'] <= options['max_traders']:
+            raise CommandError("--min-traders must be between 1 and --max-traders")
+        if options['users'] < 1:
+            raise CommandError("--users must be at least 1")
+
+        start = time.perf_counter()
+        rng = random.Random(options['seed'])
 
-        person = UserFactory(email="test@m.dk",
-                             password="test")
+        self.stdout.write("Adding test users")
+        users = create_users(options['users'], options['user_prefix'])
 
         self.stdout.write("Adding test markets")
-        market1 = MarketFactory(market_id="FOO", created_by=person)
-        market2 = MarketFactory(market_id="BAR", created_by=person)
-        
-        # self.stdout.write("Deleting old data...")
-        # models = [User, Thread, Comment, Club]
-        # for m in models:
-        #     m.objects.all().delete()
 
-        # self.stdout.write("Creating new data...")
-        # # Create all the users
-        # people = []
-        # for _ in range(NUM_USERS):
-        #     person = UserFactory()
-        #     people.append(person)
+        def progress(market):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {market.market_id}: {market.round} rounds")
 
-        # # Add some users to clubs
-        # for _ in range(NUM_CLUBS):
-        #     club = ClubFactory()
-        #     members = random.choices(
-        #         people,
-        #         k=USERS_PER_CLUB
-        #     )
-        #     club.user.add(*members)
+        totals = generate_markets(
+            users, options['markets'], rng,
+            min_traders=options['min_traders'],
+            max_traders=options['max_traders'],
+            num_rounds=options['rounds'],
+            endless_rounds=options['endless_rounds'],
+            endless_share=options['endless_share'],
+            population=options['population'],
+            skip_share=options['skip_share'],
+            batch_size=options['batch_size'],
+            progress=progress)
 
-        # # Create all the threads
-        # for _ in range(NUM_THREADS):
-        #     creator = random.choice(people)
-        #     thread = ThreadFactory(creator=creator)
-        #     # Create comments for each thread
-        #     for _ in range(COMMENTS_PER_THREAD):
-        #         commentor = random.choice(people)
-        #         CommentFactory(
-        #             user=commentor,
-        #             thread=thread
-        #         )
+        self.stdout.write(
+            f"Created {len(users)} users, {totals['markets']} markets, {totals['traders']} traders, "
+            f"{totals['trades']} trades and {totals['round_stats']} round stats "
+            f"in {time.perf_counter() - start:.1f} s")
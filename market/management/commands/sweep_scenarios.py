@@ -0,0 +1,107 @@
+# sweep_scenarios.py
+import csv
+import itertools
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from market.economics import sweep, REFERENCE_POPULATIONS
+from market.scenarios import SCENARIOS
+
+
+PARAMETERS = ['alpha', 'theta', 'gamma', 'min_cost', 'max_cost', 'initial_balance']
+
+
+def parse_grid(spec):
+    """
+    Parses a grid specification. Either a comma separated list of values ('10,14.5,20')
+    or a range given as start:stop:step, where stop is included ('100:200:25').
+    """
+    if ':' in spec:
+        try:
+            start, stop, step = (Decimal(value) for value in spec.split(':'))
+        except (ValueError, InvalidOperation):
+            raise CommandError(f"Invalid range '{spec}'. Use start:stop:step")
+        if step <= 0:
+            raise CommandError(f"The step in '{spec}' must be positive")
+        values = []
+        value = start
+        while value <= stop:
+            values.append(value)
+            value += step
+        return values
+    try:
+        return [Decimal(value) for value in spec.split(',')]
+    except InvalidOperation:
+        raise CommandError(f"Invalid list of values '{spec}'")
+
+
+class Command(BaseCommand):
+    help = ("Sweeps a grid of market parameters around a scenario and reports the equilibrium "
+            "price and amount, the profit margin and the expected bankruptcy rate pr. reference bot population")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', type=int, default=0,
+                            help="Index of the scenario in scenarios.py used for parameters that are not swept")
+        for name in PARAMETERS:
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name,
+                                help="Values to sweep, e.g. '10,14.5,20' or '100:200:25'")
+        parser.add_argument('--traders', type=int, default=20,
+                            help="Number of traders on the market")
+        parser.add_argument('--rounds', type=int,
+                            help="Number of rounds to simulate (defaults to max_rounds of the scenario)")
+        parser.add_argument('--runs', type=int, default=5,
+                            help="Number of simulated games pr. point and bot population")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--cache-dir', default=str(settings.BASE_DIR / 'sweep_cache'),
+                            help="Directory for cached results")
+        parser.add_argument('--no-cache', action='store_true')
+        parser.add_argument('--csv', help="Write the results to this csv file instead of stdout")
+
+    def handle(self, *args, **options):
+        try:
+            scenario = SCENARIOS[options['scenario']]
+        except IndexError:
+            raise CommandError(f"There is no scenario with index {options['scenario']}")
+
+        grids = []
+        for name in PARAMETERS:
+            if options[name]:
+                grids.append(parse_grid(options[name]))
+            else:
+                grids.append([Decimal(str(scenario[name]))])
+
+        points = [dict(zip(PARAMETERS, values)) for values in itertools.product(*grids)]
+        points = [params for params in points if params['min_cost'] <= params['max_cost']]
+        if not points:
+            raise CommandError("The grid has no points with min_cost <= max_cost")
+
+        num_rounds = options['rounds'] or scenario['max_rounds']
+        cache_dir = None if options['no_cache'] else options['cache_dir']
+
+        results, num_computed = sweep(
+            points, options['traders'], num_rounds, options['runs'], options['seed'], cache_dir)
+
+        fields = PARAMETERS + ['eq_price', 'eq_amount', 'eq_profit', 'profit_margin'] + \
+            [f'bankruptcy_rate_{name}' for name in REFERENCE_POPULATIONS]
+
+        out = open(options['csv'], 'w', newline='') if options['csv'] else self.stdout
+        try:
+            writer = csv.writer(out)
+            writer.writerow(fields)
+            for params, result in results:
+                row = {**params, **result}
+                writer.writerow([self.format(row[field]) for field in fields])
+        finally:
+            if options['csv']:
+                out.close()
+
+        self.stderr.write(
+            f"{len(results)} points, {num_computed} computed, {len(results) - num_computed} from cache")
+
+    @staticmethod
+    def format(value):
+        if isinstance(value, float):
+            return f"{value:.4f}"
+        return value
@@ -0,0 +1,127 @@
+"""
+Prometheus metrics.
+
+MetricsMiddleware records the number of requests, the latency and the SQL queries of each view,
+the engine records the duration of each settlement (also pr. market), and caches report hits
+and misses with record_cache. The metrics are served in the Prometheus text format by the metrics
+view at /metrics, for staff users or with the token in settings.METRICS_TOKEN
+(header "Authorization: Bearer <token>").
+
+The requests are not labelled with the market: the market_id of the url is chosen by the client,
+so any url would make a new time series.
+
+Gunicorn runs several worker processes. When the environment variable PROMETHEUS_MULTIPROC_DIR
+is set (see entrypoint.prod.sh and config/gunicorn.py), each worker writes its values to mmap
+files in that directory and the metrics view aggregates the files of all workers. The scheduler
+runs in its own container and serves its metrics (the rounds it settles) on a port of its own
+(see start_metrics_server).
+"""
+import asyncio
+import os
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess, start_http_server)
+
+from .querybudget import QueryLog
+
+
+REQUESTS = Counter(
+    'markedsspil_requests_total', "Requests pr. view", ['view', 'method', 'status'])
+REQUEST_LATENCY = Histogram(
+    'markedsspil_request_duration_seconds', "Latency of requests pr. view", ['view'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUEST_QUERIES = Histogram(
+    'markedsspil_request_queries', "SQL queries pr. request pr. view", ['view'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+SQL_SECONDS = Counter(
+    'markedsspil_sql_seconds_total', "Time spent executing SQL pr. view", ['view'])
+
+SETTLEMENT_DURATION = Histogram(
+    'markedsspil_settlement_duration_seconds', "Duration of finishing a round (see engine.finish_round)",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+MARKET_SETTLEMENT_SECONDS = Counter(
+    'markedsspil_market_settlement_seconds_total', "Time spent finishing rounds pr. market", ['market_id'])
+
+CACHE_REQUESTS = Counter(
+    'markedsspil_cache_requests_total', "Cache lookups pr. cache (the hit ratio is hit / (hit + miss))",
+    ['cache', 'result'])
+
+
+def record_cache(cache, hit):
+    """ Records a lookup in the cache with the given name """
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def record_settlement(market_id, seconds):
+    SETTLEMENT_DURATION.observe(seconds)
+    MARKET_SETTLEMENT_SECONDS.labels(market_id).inc(seconds)
+
+
+def start_metrics_server(port):
+    """ Serves the metrics of this process (e.g. the scheduler) in the Prometheus text format on the port """
+    start_http_server(port)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django that we are in async mode (like MiddlewareMixin)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        query_log = QueryLog()
+        start = time.perf_counter()
+        with connection.execute_wrapper(query_log):
+            response = self.get_response(request)
+        record_request(request, response, time.perf_counter() - start, query_log)
+        return response
+
+    async def __acall__(self, request):
+        # The queries of async views run in other threads (with sync_to_async), so they are not counted
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        record_request(request, response, time.perf_counter() - start)
+        return response
+
+
+def record_request(request, response, seconds, query_log=None):
+    # Requests to unknown urls are counted together, to keep the number of labels small
+    resolver_match = request.resolver_match
+    view = resolver_match.view_name if resolver_match else 'unknown'
+    REQUESTS.labels(view, request.method, response.status_code).inc()
+    REQUEST_LATENCY.labels(view).observe(seconds)
+    if query_log is not None:
+        REQUEST_QUERIES.labels(view).observe(query_log.count)
+        SQL_SECONDS.labels(view).inc(query_log.seconds)
+
+
+def has_access(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+@require_GET
+def metrics(request):
+    if not has_access(request):
+        return HttpResponseForbidden()
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
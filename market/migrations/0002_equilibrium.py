@@ -0,0 +1,56 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:08
+
+from decimal import Decimal
+from django.db import migrations, models
+
+from market.economics import equilibrium
+
+
+def set_equilibrium_of_existing_markets(apps, schema_editor):
+    """ Market.update_equilibrium is not available here, so we do the same calculation by hand """
+    Market = apps.get_model('market', 'Market')
+    for market in Market.objects.filter(game_over=False, deleted=False).iterator():
+        eq = equilibrium(market.alpha, market.theta, market.gamma,
+                         market.min_cost + market.accum_cost_change,
+                         market.max_cost + market.accum_cost_change)
+        if eq is None or max(eq['price'], eq['amount']) >= 10**10:
+            continue
+        market.eq_price = Decimal(eq['price']).quantize(Decimal('0.01'))
+        market.eq_amount = Decimal(eq['amount']).quantize(Decimal('0.01'))
+        market.save(update_fields=['eq_price', 'eq_amount'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='market',
+            name='eq_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='market',
+            name='eq_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='market',
+            name='equilibrium_params',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='roundstat',
+            name='eq_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='roundstat',
+            name='eq_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.RunPython(set_equilibrium_of_existing_markets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0002_equilibrium'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roundstat',
+            name='alpha',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='roundstat',
+            name='gamma',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='roundstat',
+            name='theta',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='trader',
+            name='round_bankrupt',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trader',
+            name='round_removed',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
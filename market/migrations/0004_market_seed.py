@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:17
+
+from django.db import migrations, models
+import market.models
+
+
+def give_existing_markets_their_own_seed(apps, schema_editor):
+    """ AddField gives all existing markets the same default seed """
+    Market = apps.get_model('market', 'Market')
+    markets = list(Market.objects.only('market_id'))
+    for existing_market in markets:
+        existing_market.seed = market.models.new_market_seed()
+    Market.objects.bulk_update(markets, ['seed'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0003_market_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='market',
+            name='seed',
+            field=models.PositiveIntegerField(default=market.models.new_market_seed),
+        ),
+        migrations.RunPython(give_existing_markets_their_own_seed, migrations.RunPython.noop),
+    ]
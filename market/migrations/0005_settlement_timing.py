@@ -0,0 +1,77 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:36
+
+from django.db import migrations, models
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_in_existing_rounds(apps, schema_editor):
+    """
+    The current round of an existing market started when the previous round was finished (or when
+    the market was created). The trades of finished rounds are counted.
+    """
+    Market = apps.get_model('market', 'Market')
+    RoundStat = apps.get_model('market', 'RoundStat')
+    Trade = apps.get_model('market', 'Trade')
+
+    last_finished = RoundStat.objects.filter(market=OuterRef('pk')).order_by('-round').values('created_at')[:1]
+    Market.objects.update(round_started_at=Coalesce(Subquery(last_finished), F('created_at')))
+
+    def count_trades(was_forced):
+        return Coalesce(Subquery(
+            Trade.objects.filter(trader__market=OuterRef('market'), round=OuterRef('round'), was_forced=was_forced)
+            .order_by().values('round').annotate(count=Count('id')).values('count'),
+            output_field=IntegerField()), 0)
+
+    RoundStat.objects.update(num_trades=count_trades(False), num_forced_trades=count_trades(True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0004_market_seed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='market',
+            name='round_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roundstat',
+            name='compute_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roundstat',
+            name='load_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roundstat',
+            name='num_forced_trades',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roundstat',
+            name='num_trades',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roundstat',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roundstat',
+            name='write_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='decision_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_in_existing_rounds, migrations.RunPython.noop),
+    ]
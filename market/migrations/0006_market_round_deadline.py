@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0005_settlement_timing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='market',
+            name='round_deadline',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
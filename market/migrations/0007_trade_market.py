@@ -0,0 +1,82 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:52
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models, transaction
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+BATCH_SIZE = 10000
+
+
+def set_market_of_trades(apps, schema_editor):
+    """
+    Copies the market of the trader to each trade. The trades are updated in batches of BATCH_SIZE ids,
+    each in its own transaction, so a big table is not locked for the whole backfill.
+    """
+    Trade = apps.get_model('market', 'Trade')
+    Trader = apps.get_model('market', 'Trader')
+    db_alias = schema_editor.connection.alias
+
+    trades = Trade.objects.using(db_alias)
+    last_id = trades.order_by('-id').values_list('id', flat=True).first() or 0
+    market_of_trader = Subquery(Trader.objects.using(db_alias).filter(pk=OuterRef('trader_id')).values('market_id')[:1])
+    for start in range(0, last_id + 1, BATCH_SIZE):
+        with transaction.atomic(using=db_alias):
+            trades.filter(id__gte=start, id__lt=start + BATCH_SIZE, market__isnull=True).update(
+                market_id=market_of_trader)
+
+
+class Migration(migrations.Migration):
+
+    # The backfill commits each batch (see set_market_of_trades), and the index is built concurrently
+    atomic = False
+
+    dependencies = [
+        ('market', '0006_market_round_deadline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trade',
+            name='market',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='market.market'),
+        ),
+        migrations.RunPython(set_market_of_trades, migrations.RunPython.noop),
+        # SET NOT NULL on its own scans the table under an ACCESS EXCLUSIVE lock. A validated CHECK
+        # constraint lets PostgreSQL skip that scan, and VALIDATE CONSTRAINT only takes a lock that lets
+        # trades be written meanwhile.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'ALTER TABLE market_trade ADD CONSTRAINT market_trade_market_id_not_null '
+                    'CHECK (market_id IS NOT NULL) NOT VALID',
+                    'ALTER TABLE market_trade DROP CONSTRAINT market_trade_market_id_not_null',
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE market_trade VALIDATE CONSTRAINT market_trade_market_id_not_null',
+                    migrations.RunSQL.noop,
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE market_trade ALTER COLUMN market_id SET NOT NULL',
+                    'ALTER TABLE market_trade ALTER COLUMN market_id DROP NOT NULL',
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE market_trade DROP CONSTRAINT market_trade_market_id_not_null',
+                    'ALTER TABLE market_trade ADD CONSTRAINT market_trade_market_id_not_null '
+                    'CHECK (market_id IS NOT NULL) NOT VALID',
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='trade',
+                    name='market',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='market.market'),
+                ),
+            ],
+        ),
+        AddIndexConcurrently(
+            model_name='trade',
+            index=models.Index(fields=['market', 'round', 'was_forced'], name='trade_market_round_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-19 14:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # The indexes are built without locking the traders for writes (CREATE INDEX CONCURRENTLY
+    # can't run in a transaction)
+    atomic = False
+
+    dependencies = [
+        ('market', '0007_trade_market'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='trader',
+            index=models.Index(condition=models.Q(('bankrupt', False), ('removed_from_market', False)), fields=['market', '-balance'], name='trader_active_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='trader',
+            index=models.Index(condition=models.Q(('removed_from_market', False)), fields=['market', '-balance'], name='trader_not_removed_idx'),
+        ),
+    ]
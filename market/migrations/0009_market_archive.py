@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-19 14:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0008_trader_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarketArchive',
+            fields=[
+                ('market', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='market.market')),
+                ('data', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('num_traders', models.IntegerField()),
+                ('num_trades', models.IntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='market',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+    ]
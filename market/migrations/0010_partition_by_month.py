@@ -0,0 +1,65 @@
+# Generated by Django 3.2.25 on 2026-10-19 14:11
+
+from django.db import migrations, models
+
+from market.partitions import PARTITIONED_TABLES, convert_to_partitioned, is_partitioned
+
+
+def partition_tables(apps, schema_editor):
+    """
+    Converts the trades and round stats to tables partitioned by the month of created_at (see
+    market/partitions.py). The rows are copied in batches while the site is running.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(table, connection):
+            convert_to_partitioned(table, using=connection)
+
+
+class Migration(migrations.Migration):
+
+    # The rows are copied in batches, each in its own transaction (see partition_tables)
+    atomic = False
+
+    dependencies = [
+        ('market', '0009_market_archive'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            # The partitioned tables get the indexes and the NOT NULL created_at when they are created
+            database_operations=[
+                migrations.RunPython(partition_tables, atomic=False),
+            ],
+            state_operations=[
+                migrations.RemoveConstraint(
+                    model_name='roundstat',
+                    name='market_and_round_unique_together',
+                ),
+                migrations.RemoveConstraint(
+                    model_name='trade',
+                    name='trader_and_round_unique_together',
+                ),
+                migrations.AlterField(
+                    model_name='roundstat',
+                    name='created_at',
+                    field=models.DateTimeField(auto_now_add=True),
+                ),
+                migrations.AlterField(
+                    model_name='trade',
+                    name='created_at',
+                    field=models.DateTimeField(auto_now_add=True),
+                ),
+                migrations.AddIndex(
+                    model_name='roundstat',
+                    index=models.Index(fields=['market', 'round'], name='roundstat_market_round_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='trade',
+                    index=models.Index(fields=['trader', 'round'], name='trade_trader_round_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0010_partition_by_month'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trader',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.25 on 2026-10-19 14:41
+
+from decimal import Decimal
+from django.db import migrations, models, transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 1000
+
+
+def set_balance_totals(apps, schema_editor):
+    """
+    Computes the balance totals of each market from its traders who have not been removed (as
+    models.refresh_balance_totals). The markets are updated in batches of BATCH_SIZE markets, each in its
+    own transaction.
+    """
+    Market = apps.get_model('market', 'Market')
+    Trader = apps.get_model('market', 'Trader')
+    db_alias = schema_editor.connection.alias
+
+    markets = Market.objects.using(db_alias)
+    market_ids = list(markets.order_by('market_id').values_list('market_id', flat=True))
+    traders = Trader.objects.using(db_alias).filter(
+        removed_from_market=False, market=OuterRef('pk')).order_by().values('market')
+    for start in range(0, len(market_ids), BATCH_SIZE):
+        with transaction.atomic(using=db_alias):
+            markets.filter(market_id__in=market_ids[start:start + BATCH_SIZE]).update(
+                balance_sum=Coalesce(Subquery(traders.annotate(total=Sum('balance')).values('total')),
+                                     Decimal('0.00')),
+                balance_count=Coalesce(Subquery(traders.annotate(count=Count('pk')).values('count')), 0))
+
+
+class Migration(migrations.Migration):
+
+    # The backfill commits each batch (see set_balance_totals)
+    atomic = False
+
+    dependencies = [
+        ('market', '0012_roundstat_extended_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='market',
+            name='balance_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='market',
+            name='balance_sum',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16),
+        ),
+        migrations.AddField(
+            model_name='market',
+            name='ranking_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(set_balance_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-19 14:44
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0013_market_balance_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roundstat',
+            name='ranking',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+    ]
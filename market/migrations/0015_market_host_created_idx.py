@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 14:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0014_roundstat_ranking'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='market',
+            index=models.Index(condition=models.Q(('deleted', False)), fields=['created_by', '-created_at', '-market_id'], name='market_host_created_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-19 18:40
+
+from django.db import migrations
+
+from market.partitions import PARTITIONED_TABLES, create_key_table, is_partitioned
+
+
+def create_key_tables(apps, schema_editor):
+    """
+    Replaces the triggers which looked for duplicates of new trades and round stats with the tables
+    of unique keys (see market/partitions.py). The keys of the existing rows are added in batches.
+    """
+    connection = schema_editor.connection
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(table, connection):
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_unique ON {table}")
+            cursor.execute(f"DROP FUNCTION IF EXISTS {table}_unique()")
+        create_key_table(table, using=connection)
+
+
+def drop_key_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(table, connection):
+            continue
+        with connection.cursor() as cursor:
+            for trigger in [f"{table}_keys", f"{table}_keys_update", f"{table}_keys_truncate"]:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+            cursor.execute(f"DROP FUNCTION IF EXISTS {table}_keys()")
+            cursor.execute(f"DROP FUNCTION IF EXISTS {table}_keys_truncate()")
+            cursor.execute(f"DROP TABLE IF EXISTS {table}_keys")
+
+
+class Migration(migrations.Migration):
+
+    # The keys are added in batches, each in its own transaction (see create_key_table)
+    atomic = False
+
+    dependencies = [
+        ('market', '0015_market_host_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_key_tables, drop_key_tables, atomic=False),
+    ]
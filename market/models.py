@@ -1,23 +1,75 @@
-from django.db import models
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
 from decimal import Decimal
-from random import choice
+import random
+import secrets
+from .economics import equilibrium
+from .metrics import record_cache
 
 
-def new_unique_market_id():
+MARKET_ID_CHARS = 'ABCDEFGHIJKLMSOPQRSTUVXYZ'
+
+# Traders who have not been removed from their market (active or bankrupt), and active traders.
+# The same conditions are used by the partial indexes of Trader, so PostgreSQL can use the indexes
+# for the queries filtering on them (see Trader.Meta).
+NOT_REMOVED = models.Q(removed_from_market=False)
+ACTIVE = models.Q(removed_from_market=False, bankrupt=False)
+
+# Seconds a ranking of the traders of a market is kept in the cache (see Market.ranking)
+RANKING_TIMEOUT = 60 * 60
+
+
+def dashboard_key(host_id):
+    """ The cache key of the dashboard of the host (see hosts.dashboard) """
+    return f"dashboard:{host_id}"
+
+
+def new_unique_market_id(rng=None):
     """
     Create a new unique market ID (8 alphabetic chars)
+    If a random generator rng is given, the ID is drawn from it (see Market.random_stream)
     """
     while True:
-        market_id = get_random_string(
-            8, allowed_chars='ABCDEFGHIJKLMSOPQRSTUVXYZ')
+        if rng is None:
+            market_id = get_random_string(8, allowed_chars=MARKET_ID_CHARS)
+        else:
+            market_id = ''.join(rng.choice(MARKET_ID_CHARS) for _ in range(8))
         if not Market.objects.filter(market_id=market_id).exists():
             break
     return market_id
 
 
+def refresh_balance_totals(markets):
+    """ Recomputes the running balance totals of the markets (see Market) from their traders in one query """
+    traders = Trader.objects.filter(NOT_REMOVED, market=models.OuterRef('pk')).order_by().values('market')
+    markets.update(
+        balance_sum=Coalesce(
+            models.Subquery(traders.annotate(total=models.Sum('balance')).values('total')), Decimal('0.00')),
+        balance_count=Coalesce(
+            models.Subquery(traders.annotate(count=models.Count('pk')).values('count')), 0),
+        ranking_version=models.F('ranking_version') + 1)
+
+
+def ranks(balances):
+    """
+    Returns a dict mapping the ids in balances (a dict of id -> balance) to their rank (1 for the
+    highest balance, ties ordered by id), in the order of the ranks
+    """
+    ordered = sorted(balances, key=lambda trader_id: (-balances[trader_id], trader_id))
+    return {trader_id: rank for rank, trader_id in enumerate(ordered, 1)}
+
+
+def new_market_seed():
+    """ A random seed for a new market """
+    return secrets.randbelow(2**31)
+
+
 class Market(models.Model):
     market_id = models.CharField(max_length=16, primary_key=True)
     product_name_singular = models.CharField(max_length=30)
@@ -83,11 +135,60 @@ class Market(models.Model):
     # Finish each round automatically when all traders are ready?
     monitor_auto_pilot = models.BooleanField(default=False)
 
+    # Finish each round automatically this many seconds after it started (if at least one trader has traded)?
+    # Both are handled by the round scheduler (see scheduler.py)
+    round_deadline = models.PositiveIntegerField(null=True, blank=True)
+
     # When a user 'deletes' one of his markets, we don't actually delete it, but set this value to True:
     deleted = models.BooleanField(default=False)
 
     game_over = models.BooleanField(default=False)
 
+    # The history of a finished or deleted market can be moved from the traders, trades and round stats
+    # into a compressed MarketArchive (see archive.py). The market itself stays, so its monitor page still works.
+    archived = models.BooleanField(default=False)
+
+    # The equilibrium price and amount for the current parameters (used as benchmarks on the monitor page).
+    # equilibrium_params records the parameters they were calculated from, so we only solve again
+    # when the parameters change (see update_equilibrium)
+    eq_price = models.DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True)
+    eq_amount = models.DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True)
+    equilibrium_params = models.CharField(max_length=200, blank=True, default='')
+
+    # Seed for all random choices made for the market (see random_stream). Two markets with the same seed
+    # and the same traders get the same production costs and the same robot decisions.
+    seed = models.PositiveIntegerField(default=new_market_seed)
+
+    # When the current round started (set when the market is created and when a round is finished)
+    round_started_at = models.DateTimeField(null=True, blank=True)
+
+    # The running sum and number of the balances of the traders who have not been removed (active or
+    # bankrupt), so the live average balance is read without loading the traders. ranking_version is
+    # increased whenever the ranking of the traders may change (see ranking). The fields are kept up to
+    # date when a trader joins, is removed or goes bankrupt and when a round is settled, and they are only
+    # written with update_balance_totals and refresh_balance_totals (see save).
+    balance_sum = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0.00'))
+    balance_count = models.IntegerField(default=0)
+    ranking_version = models.PositiveIntegerField(default=0)
+
+    BALANCE_TOTAL_FIELDS = ['balance_sum', 'balance_count', 'ranking_version']
+
+    # An existing market is saved with update_fields, so a market object loaded before another request
+    # changed the market doesn't write back old values. The balance totals are only changed with
+    # update_balance_totals and refresh_balance_totals. The fields set by update_equilibrium, and those
+    # changed when a round is settled (see engine.finish_round):
+    EQUILIBRIUM_FIELDS = ['eq_price', 'eq_amount', 'equilibrium_params']
+    SETTLEMENT_FIELDS = ['round', 'round_started_at', 'accum_cost_change', 'cost_slope', 'game_over'] + EQUILIBRIUM_FIELDS
+
+    class Meta:
+        # The markets of a host are listed page by page, newest first (see hosts.py)
+        indexes = [
+            models.Index(fields=['created_by', '-created_at', '-market_id'], condition=models.Q(deleted=False),
+                         name='market_host_created_idx'),
+        ]
+
     def check_game_over(self):
         """ 
         Checks if the game state should be set to game_over. 
@@ -99,10 +200,117 @@ class Market(models.Model):
         """
         Do the following before creating a new market object:
             *) Set unique custom id for market
+            *) Set the start of round 0
         """
         if not self.market_id:  # <== we are in fact creating a new market (not updating an existing market)
-            self.market_id = new_unique_market_id()
+            self.market_id = new_unique_market_id(self.random_stream('market_id'))
+        if self._state.adding and self.round_started_at is None:
+            self.round_started_at = timezone.now()
+        self.update_equilibrium()
         super(Market, self).save(*args, **kwargs)
+        self.forget_dashboard()
+
+    def forget_dashboard(self):
+        """
+        Removes the cached dashboard of the host of the market (see hosts.dashboard). Called whenever the
+        market row changes. The dashboard is removed when the transaction commits, so it isn't loaded
+        again from the rows before the change.
+        """
+        key = dashboard_key(self.created_by_id)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    def update_balance_totals(self, balance=0, count=0):
+        """
+        Adds balance and count to the running balance totals in the database (and the object) and
+        invalidates the cached ranking and dashboard. Called when a trader joins, is removed or goes bankrupt.
+        """
+        Market.objects.filter(pk=self.pk).update(
+            balance_sum=models.F('balance_sum') + balance,
+            balance_count=models.F('balance_count') + count,
+            ranking_version=models.F('ranking_version') + 1)
+        self.balance_sum += balance
+        self.balance_count += count
+        self.ranking_version += 1
+        self.forget_dashboard()
+
+    def refresh_balance_totals(self):
+        """
+        Recomputes the running balance totals from the traders in one query (e.g. when a round has been
+        settled) and invalidates the cached ranking and dashboard. The object is not updated.
+        """
+        refresh_balance_totals(Market.objects.filter(pk=self.pk))
+        self.forget_dashboard()
+
+    def avg_balance(self):
+        """ Returns the average balance of the traders who have not been removed (None if there are none) """
+        if not self.balance_count:
+            return None
+        return self.balance_sum / self.balance_count
+
+    def ranking(self):
+        """
+        Returns the leaderboard: the traders who have not been removed ordered by -balance (see ranks) as
+        dicts with id, name, balance, bankrupt, prod_cost, rank, and the rank_change and profit of the last
+        settled round (see RoundStat.ranking; None for traders who joined since). The ranking is cached
+        until ranking_version changes, i.e. it is computed once per settlement, join, removal or bankruptcy.
+        """
+        key = f"ranking:{self.market_id}:{self.ranking_version}"
+        ranking = cache.get(key)
+        record_cache('ranking', ranking is not None)
+        if ranking is None:
+            settled = []
+            if self.round > 0:
+                settled = self.round_stats().filter(round=self.round - 1).values_list(
+                    'ranking', flat=True).first() or []
+            settled = {entry['id']: entry for entry in settled}
+            traders = {trader['id']: trader for trader in self.active_or_bankrupt_traders().values(
+                'id', 'name', 'balance', 'bankrupt', 'prod_cost')}
+            ranking = []
+            for trader_id, rank in ranks({trader_id: trader['balance'] for trader_id, trader in traders.items()}).items():
+                entry = settled.get(trader_id, {})
+                ranking.append(dict(
+                    traders[trader_id],
+                    rank=rank,
+                    rank_change=entry.get('rank_change'),
+                    profit=Decimal(entry['profit']) if entry.get('profit') is not None else None,
+                ))
+            cache.set(key, ranking, RANKING_TIMEOUT)
+        return ranking
+
+    def seconds_since_round_start(self, now=None):
+        """ Returns the number of seconds since the current round started (None if we don't know) """
+        if self.round_started_at is None:
+            return None
+        return ((now or timezone.now()) - self.round_started_at).total_seconds()
+
+    def random_stream(self, purpose, *keys):
+        """
+        Returns a random generator for the market, determined by the seed of the market, the purpose
+        (e.g. 'prod_cost') and the keys (e.g. the round). Use a new stream for each independent choice,
+        so the choices don't depend on the order in which they are made.
+        """
+        return random.Random(':'.join(str(part) for part in [self.seed, purpose, *keys]))
+
+    def update_equilibrium(self):
+        """
+        Sets eq_price and eq_amount if alpha, theta, gamma or the costs have changed since they were last calculated.
+        We use the equilibrium of a market with many traders, as the number of traders changes during the game.
+        """
+        min_cost = self.min_cost + self.accum_cost_change
+        max_cost = self.max_cost + self.accum_cost_change
+        params = f"{self.alpha},{self.theta},{self.gamma},{min_cost},{max_cost}"
+        record_cache('equilibrium', params == self.equilibrium_params)
+        if params == self.equilibrium_params:
+            return
+
+        eq = equilibrium(self.alpha, self.theta, self.gamma, min_cost, max_cost)
+        # The fields can't hold values above 9999999999.99
+        if eq is None or max(eq['price'], eq['amount']) >= 10**10:
+            self.eq_price = self.eq_amount = None
+        else:
+            self.eq_price = Decimal(eq['price']).quantize(Decimal('0.01'))
+            self.eq_amount = Decimal(eq['amount']).quantize(Decimal('0.01'))
+        self.equilibrium_params = params
 
     def __str__(self):
         return f"{self.market_id}[{self.round}]:{self.alpha},{self.theta},{self.gamma},"
@@ -121,10 +329,7 @@ class Market(models.Model):
         Returns a query set of all active traders on the market.
         A trader is 'active' if he has not declared bankruptcy and has not been removed from the market.
         """
-        active_traders = Trader.objects.filter(
-            market=self,
-            removed_from_market=False,
-            bankrupt=False)
+        active_traders = Trader.objects.filter(ACTIVE, market=self)
         return active_traders
 
     def num_active_traders(self):
@@ -139,20 +344,41 @@ class Market(models.Model):
         i.e., all traders who have not been removed from market.
         The set is ordered by balance. 
         """
-        active_or_bankrupt_traders = Trader.objects.filter(
-            market=self,
-            removed_from_market=False,
-        ).order_by('-balance')
+        active_or_bankrupt_traders = Trader.objects.filter(NOT_REMOVED, market=self).order_by('-balance')
         return active_or_bankrupt_traders
 
+    def active_or_bankrupt_traders_with_ready_flag(self):
+        """
+        Returns active_or_bankrupt_traders, where each trader has the attribute 'ready'
+        (see Trader.is_ready). Uses a single query for all traders.
+        """
+        valid_trades = self.trades().filter(
+            trader=models.OuterRef('pk'), round=self.round, was_forced=False)
+        return self.active_or_bankrupt_traders().annotate(ready=models.Exists(valid_trades))
+
+    def trades(self):
+        """
+        Returns the trades on this market. The trades are not older than the market, so the partitions
+        of the months before the market was created are not read (see partitions.py).
+        """
+        trades = Trade.objects.filter(market=self)
+        if self.created_at:
+            trades = trades.filter(created_at__gte=self.created_at)
+        return trades
+
+    def round_stats(self):
+        """ Returns the round stats of this market (reading only the partitions since the market was created, like trades) """
+        round_stats = RoundStat.objects.filter(market=self)
+        if self.created_at:
+            round_stats = round_stats.filter(created_at__gte=self.created_at)
+        return round_stats
+
     def all_trades_this_round(self):
         """ 
         Returns all (including forced trades and trades made by removed traders) on this market in the current round.
+        Uses the index on (market, round, was_forced) of Trade.
         """
-        all_trades = Trade.objects.filter(
-            round=self.round,
-            trader__in=Trader.objects.filter(market=self),
-        )
+        all_trades = self.trades().filter(round=self.round)
         return all_trades
 
     def valid_trades_this_round(self):
@@ -177,18 +403,18 @@ class Market(models.Model):
         """
         Returns the number of 'bankrupt' (and non-removed) traders on the market.
         """
-        num_bankrupt_traders = Trader.objects.filter(
-            market=self,
-            removed_from_market=False,
-            bankrupt=True).count()
+        num_bankrupt_traders = Trader.objects.filter(NOT_REMOVED, market=self, bankrupt=True).count()
         return num_bankrupt_traders
 
     def all_are_bankrupt(self):
         """
         Returns True if at leat one trader is bankrupt and there are no active traders left in the game. 
         """
-        if self.num_bankrupt_traders() > 0:
-            if self.num_active_traders() == 0:
+        counts = Trader.objects.filter(NOT_REMOVED, market=self).aggregate(
+            num_bankrupt=models.Count('pk', filter=models.Q(bankrupt=True)),
+            num_active=models.Count('pk', filter=models.Q(bankrupt=False)))
+        if counts['num_bankrupt'] > 0:
+            if counts['num_active'] == 0:
                 return True
 
     def max_allowed_price(self):
@@ -227,6 +453,13 @@ class Trader(models.Model):
     # bankrupt will only be True if the trader has declared himself bankrupt
     bankrupt = models.BooleanField(default=False)
 
+    # The rounds in which the trader was removed or declared bankruptcy (used when exporting the market history)
+    round_removed = models.IntegerField(null=True, blank=True)
+    round_bankrupt = models.IntegerField(null=True, blank=True)
+
+    # The version of the player tokens of the trader. Increased to revoke the tokens (see playertoken.py)
+    token_version = models.PositiveIntegerField(default=0)
+
     class Meta:
         # There can only be one trader with a given name in a given market.
         # Specifying the constraint here to discover bugs in code during development
@@ -235,6 +468,11 @@ class Trader(models.Model):
             models.UniqueConstraint(
                 fields=['market', 'name'], name='market_and_name_unique_together'),
         ]
+        # Partial indexes for the traders shown on the monitor and play pages (ordered by balance)
+        indexes = [
+            models.Index(fields=['market', '-balance'], condition=ACTIVE, name='trader_active_idx'),
+            models.Index(fields=['market', '-balance'], condition=NOT_REMOVED, name='trader_not_removed_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         """
@@ -259,7 +497,10 @@ class Trader(models.Model):
             # what has been added to all other traders' production cost.
             self.prod_cost += self.market.accum_cost_change
 
+        adding = self._state.adding
         super(Trader, self).save(*args, **kwargs)
+        if adding and not self.removed_from_market and self.balance is not None:
+            self.market.update_balance_totals(self.balance, 1)
 
     def prod_cost_algorithm(self):
         """ 
@@ -268,14 +509,18 @@ class Trader(models.Model):
         possible production costs 
         """
 
+        # The n'th trader getting a cost from the algorithm uses the n'th 'prod_cost' stream of the market
+        rng = self.market.random_stream(
+            'prod_cost', UsedCosts.objects.filter(market=self.market).count())
+
         # Get all unused production costs
         unused_costs = UnusedCosts.objects.filter(
-            market=self.market)
+            market=self.market).order_by('cost', 'id')
 
         # If there are any unused costs,
         if len(unused_costs) > 0:
             # pick one at random
-            rnd_unused_cost = choice(unused_costs)
+            rnd_unused_cost = rng.choice(unused_costs)
             self.prod_cost = rnd_unused_cost.cost
             # then move it to the used costs
             UsedCosts(cost=self.prod_cost,
@@ -293,8 +538,8 @@ class Trader(models.Model):
                 UnusedCosts(cost=new_unused_cost,
                             market=self.market).save()
             # then pick one of the new unused costs for this trader
-            rnd_unused_cost = choice(
-                UnusedCosts.objects.filter(market=self.market))
+            rnd_unused_cost = rng.choice(
+                UnusedCosts.objects.filter(market=self.market).order_by('cost', 'id'))
             self.prod_cost = rnd_unused_cost.cost
             UsedCosts(cost=self.prod_cost,
                       market=self.market).save()
@@ -313,6 +558,8 @@ class Trader(models.Model):
         """ Remove trader from market """
         # If the market is in round 0 we do an actual deletion of the trader from the database
         # (this will also delete the trade he has possible already made in the first round)
+        if not self.removed_from_market and self.balance is not None:
+            self.market.update_balance_totals(-self.balance, -1)
         if self.market.round == 0:
             # Do an actual deletion of the trader from the database
             self.delete()
@@ -322,6 +569,9 @@ class Trader(models.Model):
             # shown on balance graph in all rounds following the removal of the trader)
             self.balance = None
             self.removed_from_market = True
+            self.round_removed = self.market.round
+            # The player can no longer use the token given when joining
+            self.token_version += 1
             self.save()
             # If the trader has made a trade in this round, delete this trade
             Trade.objects.filter(
@@ -339,6 +589,11 @@ class Trader(models.Model):
 
 class Trade(models.Model):
     trader = models.ForeignKey(Trader, on_delete=models.CASCADE)
+    # The market of the trader (denormalized, so the trades of a market in a round can be found with
+    # the index on (market, round, was_forced) without a join). Set from the trader in save();
+    # remember to set it when using bulk_create. The index on (market, round, was_forced) also serves
+    # lookups on the market alone, so the foreign key gets no index of its own.
+    market = models.ForeignKey(Market, on_delete=models.CASCADE, db_index=False)
 
     prod_cost = models.DecimalField(
         null=True,
@@ -388,16 +643,27 @@ class Trade(models.Model):
         decimal_places=2,
     )
 
-    created_at = models.DateTimeField(auto_now_add=True, null=True)
+    # The table is partitioned by the month of created_at (see partitions.py)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Seconds from the start of the round until the trader made the decision (null for forced trades
+    # and trades made by robots on the server)
+    decision_seconds = models.FloatField(null=True, blank=True)
 
     class Meta:
-        # There can only be one trade pr trader pr round
-        # Specifying the constraint here to discover bugs in code during development
-        constraints = [
-            models.UniqueConstraint(
-                fields=['trader', 'round'], name='trader_and_round_unique_together'),
+        # There can only be one trade pr trader pr round. The table is partitioned by the month of
+        # created_at (see partitions.py), and a partitioned table can't have a unique constraint
+        # without created_at, so this is an index, and the key is kept unique in market_trade_keys.
+        indexes = [
+            models.Index(fields=['trader', 'round'], name='trade_trader_round_idx'),
+            models.Index(fields=['market', 'round', 'was_forced'], name='trade_market_round_idx'),
         ]
 
+    def save(self, *args, **kwargs):
+        if self.market_id is None:
+            self.market_id = self.trader.market_id
+        super(Trade, self).save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.trader.name} ${self.unit_price} x {self.unit_amount} [{self.trader.market.market_id}][{self.round}]"
 
@@ -417,21 +683,72 @@ class RoundStat(models.Model):
     avg_amount = models.DecimalField(
         max_digits=12, decimal_places=2, null=True, blank=True)
 
-    created_at = models.DateTimeField(auto_now_add=True, null=True)
+    # The spread of the prices, the totals of the valid trades and the Herfindahl-Hirschman index of
+    # the units sold (the sum of the squared market shares in percent: 10000 if one trader sold all units)
+    median_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    min_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    price_stddev = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    units_produced = models.BigIntegerField(null=True, blank=True)
+    units_sold = models.BigIntegerField(null=True, blank=True)
+    total_profit = models.DecimalField(max_digits=16, decimal_places=2, null=True, blank=True)
+    hhi = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
+
+    # the market parameters used in the given round
+    alpha = models.DecimalField(
+        max_digits=14, decimal_places=2, null=True, blank=True)
+    theta = models.DecimalField(
+        max_digits=14, decimal_places=2, null=True, blank=True)
+    gamma = models.DecimalField(
+        max_digits=14, decimal_places=2, null=True, blank=True)
+
+    # the equilibrium price and amount with the market parameters used in the given round
+    eq_price = models.DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True)
+    eq_amount = models.DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True)
 
-    class Meta:
-        # There can only be one stat object pr market pr round
-        # Specifying the constraint here to discover bugs in code during development
+    # The ranking of the traders who had not been removed when the round was settled (see
+    # engine.settled_ranking): a list of dicts with id, rank, balance, rank_change and profit
+    ranking = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
 
-        constraints = [
-            models.UniqueConstraint(
-                fields=['market', 'round'], name='market_and_round_unique_together'),
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # When the round started (the round ended at created_at) and how it was settled: the number of
+    # trades and forced trades, and the seconds spent loading, computing and writing (see engine.finish_round)
+    started_at = models.DateTimeField(null=True, blank=True)
+    num_trades = models.IntegerField(null=True, blank=True)
+    num_forced_trades = models.IntegerField(null=True, blank=True)
+    load_seconds = models.FloatField(null=True, blank=True)
+    compute_seconds = models.FloatField(null=True, blank=True)
+    write_seconds = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        # There can only be one stat object pr market pr round. The table is partitioned like Trade,
+        # so this is an index, and the key is kept unique in market_roundstat_keys.
+        indexes = [
+            models.Index(fields=['market', 'round'], name='roundstat_market_round_idx'),
         ]
 
     def __str__(self):
         return f"{self.market.market_id}[{self.round}]"
 
 
+class MarketArchive(models.Model):
+    """ The history of an archived market (see archive.py) """
+    market = models.OneToOneField(Market, on_delete=models.CASCADE, primary_key=True)
+    # The history in the format of history.export_market_history, as zlib compressed json
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # The number of traders (not removed) and trades when the market was archived
+    num_traders = models.IntegerField()
+    num_trades = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.market_id} ({len(self.data)} bytes)"
+
+
 class UnusedCosts(models.Model):
     market = models.ForeignKey(Market, on_delete=models.CASCADE)
     cost = models.DecimalField(max_digits=14, decimal_places=2,
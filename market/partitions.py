@@ -0,0 +1,395 @@
+"""
+Monthly range partitions of the trades and round stats on PostgreSQL.
+
+market_trade and market_roundstat are partitioned by the month of created_at: market_trade_2026_10
+holds the trades made in October 2026, and so on. Nearly all queries are about running markets, so
+they touch the partition of the current month (and perhaps the previous one), which stays small and
+in the cache. The queries of a market go through Market.trades and Market.round_stats, which only
+look at rows created after the market, so PostgreSQL skips the partitions of the months before the
+market was created. Rows with a created_at outside all partitions go to the default partition (e.g.
+trades of a replayed history from before the table was partitioned); create_partition moves them to
+the partition of their month when it is created.
+
+A partitioned table can only have unique constraints which include created_at, so the (trader, round)
+and (market, round) keys are kept unique in a plain table next to each partitioned table
+(market_trade_keys and market_roundstat_keys, see create_key_table). Triggers insert the key of each
+new row into it, so inserting a duplicate raises a unique violation (IntegrityError) like the old
+constraints did, also when two transactions insert the same key at the same moment.
+
+Migration 0010 converts the tables with convert_to_partitioned, which copies the rows to a new
+partitioned table in batches while the site is running, and only locks the old table for the final
+catch-up and the swap. The partitions command creates the partitions for the coming months
+(ensure_partitions) and detaches the partitions of old months (detach_partition), so they can be
+archived or dropped as plain tables. The scheduler (see scheduler.py) also runs ensure_partitions
+once a day.
+"""
+import re
+from datetime import date, datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+PARTITIONED_TABLES = ['market_trade', 'market_roundstat']
+
+# The unique constraints of the tables, which become plain indexes (see the module docstring)
+UNIQUE_TO_INDEX = {
+    'trader_and_round_unique_together': 'trade_trader_round_idx',
+    'market_and_round_unique_together': 'roundstat_market_round_idx',
+}
+
+# The unique keys of the tables: (the columns, the name of the constraint). The keys are kept in
+# the tables <table>_keys (see the module docstring).
+UNIQUE_KEYS = {
+    'market_trade': (('trader_id', 'round'), 'trader_and_round_unique_together'),
+    'market_roundstat': (('market_id', 'round'), 'market_and_round_unique_together'),
+}
+
+PARTITION_NAME_RE = re.compile(r'_(\d{4})_(\d{2})$')
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_{month:%Y_%m}"
+
+
+def is_partitioned(table, using=connection):
+    if using.vendor != 'postgresql':
+        return False
+    with using.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", [table])
+        return cursor.fetchone()[0]
+
+
+def partitions(table, using=connection):
+    """ Returns (name, month, number of rows (estimated)) of the monthly partitions of the table, oldest first """
+    with using.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname, child.reltuples FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s) ORDER BY child.relname
+        """, [table])
+        result = []
+        for name, rows in cursor.fetchall():
+            match = PARTITION_NAME_RE.search(name)
+            if match:
+                result.append((name, date(int(match[1]), int(match[2]), 1), max(int(rows), 0)))
+        return result
+
+
+def create_partition(table, month, using=connection):
+    """
+    Creates the partition of the table for the month (a date in the month), if it does not exist.
+    The rows of the month in the default partition are moved to the new partition.
+    """
+    month = month_start(month)
+    name = partition_name(table, month)
+    bounds = [_month_bound(month), _month_bound(add_months(month, 1))]
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL, to_regclass(%s) IS NOT NULL",
+                       [name, f"{table}_default"])
+        exists, has_default = cursor.fetchone()
+        if exists:
+            return None
+        if not has_default:
+            cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", bounds)
+        else:
+            # A partition can't be created while the default partition has rows of its month, so the
+            # rows are moved to a plain table, which then becomes the partition
+            cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+            cursor.execute(f"""
+                WITH moved AS (
+                    DELETE FROM {table}_default WHERE created_at >= %s AND created_at < %s RETURNING *)
+                INSERT INTO {name} SELECT * FROM moved
+            """, bounds)
+            moved = cursor.rowcount
+            cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", bounds)
+            if moved and table in UNIQUE_KEYS and _has_key_table(cursor, table):
+                # The keys were deleted with the rows of the default partition
+                columns = ', '.join(UNIQUE_KEYS[table][0])
+                cursor.execute(f"INSERT INTO {table}_keys ({columns}) SELECT {columns} FROM {name}")
+        _name_partition_indexes(cursor, table)
+    return name
+
+
+def _name_partition_indexes(cursor, table):
+    """
+    Renames the indexes PostgreSQL creates on the partitions to <partition>_<index of the table>
+    (e.g. market_trade_2026_10_trade_market_round_idx), so the plans show which index is used.
+    """
+    cursor.execute("""
+        SELECT child.relname, partition.relname || '_' || parent.relname FROM pg_index parent_index
+        JOIN pg_class parent ON parent.oid = parent_index.indexrelid
+        JOIN pg_inherits ON pg_inherits.inhparent = parent.oid
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        JOIN pg_index child_index ON child_index.indexrelid = child.oid
+        JOIN pg_class partition ON partition.oid = child_index.indrelid
+        WHERE parent_index.indrelid = to_regclass(%s) AND NOT parent_index.indisprimary
+    """, [table])
+    for name, new_name in cursor.fetchall():
+        if name != new_name and len(new_name) <= 63:
+            cursor.execute(f"ALTER INDEX {name} RENAME TO {new_name}")
+
+
+def _month_bound(month):
+    # The partitions follow the months of the time zone of the site (like the rest of the pages)
+    return timezone.make_aware(datetime(month.year, month.month, 1))
+
+
+def ensure_partitions(ahead=3, now=None, using=connection):
+    """
+    Creates the partitions of the current month and the next ahead months for the partitioned
+    tables. Returns the names of the created partitions.
+    """
+    month = month_start(timezone.localtime(now or timezone.now()))
+    created = []
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(table, using):
+            continue
+        for months in range(ahead + 1):
+            name = create_partition(table, add_months(month, months), using)
+            if name:
+                created.append(name)
+    return created
+
+
+def running_markets_in_partition(name, using=connection):
+    """ Returns the IDs of the markets that are still played (not finished or deleted) with rows in the partition """
+    with using.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT DISTINCT market.market_id FROM {name} p
+            JOIN market_market market ON market.market_id = p.market_id
+            WHERE NOT market.game_over AND NOT market.deleted ORDER BY market.market_id
+        """)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def detach_partition(table, month, using=connection):
+    """
+    Detaches the partition of the table for the month. The partition becomes a plain table with the
+    same name, which can be archived (e.g. with pg_dump) and dropped. Raises ValueError if the
+    partition holds rows of markets that are still played.
+    """
+    name = partition_name(table, month_start(month))
+    running = running_markets_in_partition(name, using)
+    if running:
+        raise ValueError(f"{name} has rows of markets that are still played: {', '.join(running[:10])}")
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        if table in UNIQUE_KEYS and _has_key_table(cursor, table):
+            condition = ' AND '.join(f"k.{column} = p.{column}" for column in UNIQUE_KEYS[table][0])
+            cursor.execute(f"DELETE FROM {table}_keys k USING {name} p WHERE {condition}")
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+    return name
+
+
+def convert_to_partitioned(table, batch_size=50000, using=connection, log=None):
+    """
+    Replaces the table with a table partitioned by the month of created_at, with the same columns,
+    indexes and foreign keys. Works on a running site:
+
+     1. The partitioned table is created next to the table (as <table>_part) with a partition for
+        each month with rows, the coming months and a default partition.
+     2. A trigger on the table logs the ids of the rows inserted, updated or deleted from now on
+        in <table>_changes.
+     3. The rows are copied in batches of batch_size ids, each batch in its own transaction.
+     4. The logged rows are synced: they are deleted from the partitioned table and copied again
+        if they still exist (see _sync). This is repeated while more than batch_size rows changed.
+     5. The table is locked, the rows changed since 4. are synced, and the table is swapped with the
+        partitioned table, which gets the names of the old indexes and the foreign keys.
+
+    Must be called outside a transaction (e.g. from a migration with atomic = False).
+    """
+    def say(message):
+        if log:
+            log(message)
+
+    new_table = f"{table}_part"
+    with using.cursor() as cursor:
+        # Rows from before created_at was required get the creation time of their market
+        cursor.execute(f"""
+            UPDATE {table} t SET created_at = COALESCE(market.created_at, now())
+            FROM market_market market WHERE market.market_id = t.market_id AND t.created_at IS NULL
+        """)
+
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_changes")
+        cursor.execute(f"CREATE TABLE {table}_changes (id bigint NOT NULL)")
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION {table}_changes() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO {table}_changes VALUES (OLD.id);
+                ELSE
+                    INSERT INTO {table}_changes VALUES (NEW.id);
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        # The trigger may be left by an earlier attempt
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_changes ON {table}")
+        cursor.execute(f"CREATE TRIGGER {table}_changes AFTER INSERT OR UPDATE OR DELETE ON {table} "
+                       f"FOR EACH ROW EXECUTE FUNCTION {table}_changes()")
+
+        cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [table])
+        indexes = cursor.fetchall()
+        cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass "
+                       "AND contype = 'f'", [table])
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"SELECT min(created_at), min(id), max(id) FROM {table}")
+        first_created_at, min_id, max_id = cursor.fetchone()
+
+        cursor.execute(f"DROP TABLE IF EXISTS {new_table}")
+        cursor.execute(f"CREATE TABLE {new_table} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+        cursor.execute(f"ALTER TABLE {new_table} ALTER COLUMN created_at SET NOT NULL")
+        cursor.execute(f"ALTER TABLE {new_table} ADD CONSTRAINT {new_table}_pkey PRIMARY KEY (id, created_at)")
+        cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {new_table} DEFAULT")
+
+    # The partitions are named after the table, since they keep their names after the swap
+    now = timezone.localtime()
+    month = month_start(timezone.localtime(first_created_at) if first_created_at else now)
+    while month <= add_months(month_start(now), 3):
+        with using.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE {partition_name(table, month)} PARTITION OF {new_table} FOR VALUES FROM (%s) TO (%s)",
+                [_month_bound(month), _month_bound(add_months(month, 1))])
+        month = add_months(month, 1)
+
+    # The indexes get their names after the swap
+    renames = []
+    with using.cursor() as cursor:
+        for name, definition in indexes:
+            if name == f"{table}_pkey":
+                continue
+            final_name = UNIQUE_TO_INDEX.get(name, name)
+            definition = re.sub(r'^CREATE (UNIQUE )?INDEX \S+ ON \S+ ',
+                                f'CREATE INDEX {final_name}_part ON {new_table} ', definition)
+            cursor.execute(definition)
+            renames.append((f"{final_name}_part", final_name))
+
+    if min_id is not None:
+        for start in range(min_id, max_id + 1, batch_size):
+            with transaction.atomic(using=using.alias), using.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {new_table} SELECT * FROM {table} WHERE id >= %s AND id < %s",
+                               [start, start + batch_size])
+        say(f"Copied {table} (ids {min_id} to {max_id})")
+
+    while True:
+        with transaction.atomic(using=using.alias), using.cursor() as cursor:
+            synced = _sync(cursor, table, new_table)
+        say(f"Synced {synced} changed rows of {table}")
+        if synced <= batch_size:
+            break
+
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        _sync(cursor, table, new_table)
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+        if sequence:
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {new_table}.id")
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"DROP TABLE {table}_changes")
+        cursor.execute(f"DROP FUNCTION {table}_changes()")
+        cursor.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+        cursor.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {new_table}_pkey TO {table}_pkey")
+        for old_name, new_name in renames:
+            cursor.execute(f"ALTER INDEX {old_name} RENAME TO {new_name}")
+        # The foreign keys are added last, as rows deleted from the referenced tables during the copy
+        # would otherwise be blocked by their copies
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+        _name_partition_indexes(cursor, table)
+    say(f"Partitioned {table}")
+
+
+def _sync(cursor, table, new_table):
+    """
+    Copies the rows logged in <table>_changes from table to new_table (see convert_to_partitioned)
+    and returns the number of rows. A row changed while syncing is logged again and synced next time.
+    """
+    cursor.execute(f"""
+        WITH changed AS (DELETE FROM {table}_changes RETURNING id)
+        SELECT DISTINCT id FROM changed
+    """)
+    ids = [row[0] for row in cursor.fetchall()]
+    if ids:
+        cursor.execute(f"DELETE FROM {new_table} WHERE id = ANY(%s)", [ids])
+        cursor.execute(f"INSERT INTO {new_table} SELECT * FROM {table} WHERE id = ANY(%s)", [ids])
+    return len(ids)
+
+
+def _has_key_table(cursor, table):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [f"{table}_keys"])
+    return cursor.fetchone()[0]
+
+
+def create_key_table(table, batch_size=50000, using=connection):
+    """
+    Creates <table>_keys, which keeps the unique key of the table (UNIQUE_KEYS) for the partitioned
+    table: it has a row with the key of each row of the table, kept by triggers on the table, and
+    the key is its primary key. The keys of the existing rows are added in batches of batch_size ids,
+    locking the rows of each batch, so rows deleted meanwhile don't leave their keys behind.
+    Must be called outside a transaction (e.g. from a migration with atomic = False).
+    """
+    columns, constraint = UNIQUE_KEYS[table]
+    keys = f"{table}_keys"
+    key_condition = ' AND '.join(f"{column} = OLD.{column}" for column in columns)
+    new_values = ', '.join(f"NEW.{column}" for column in columns)
+    changed = ' OR '.join(f"OLD.{column} IS DISTINCT FROM NEW.{column}" for column in columns)
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        column_definitions = ', '.join(f"{column} {_column_type(cursor, table, column)} NOT NULL" for column in columns)
+        cursor.execute(f"CREATE TABLE {keys} ({column_definitions}, "
+                       f"CONSTRAINT {constraint} PRIMARY KEY ({', '.join(columns)}))")
+        # A row which moves to another partition (when created_at is changed) is deleted and inserted
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION {keys}() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    DELETE FROM {keys} WHERE {key_condition};
+                END IF;
+                IF TG_OP IN ('UPDATE', 'INSERT') THEN
+                    INSERT INTO {keys} VALUES ({new_values});
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION {keys}_truncate() RETURNS trigger AS $$
+            BEGIN
+                TRUNCATE {keys};
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute(f"CREATE TRIGGER {keys} AFTER INSERT OR DELETE ON {table} FOR EACH ROW EXECUTE FUNCTION {keys}()")
+        cursor.execute(f"CREATE TRIGGER {keys}_update AFTER UPDATE OF {', '.join(columns)} ON {table} "
+                       f"FOR EACH ROW WHEN ({changed}) EXECUTE FUNCTION {keys}()")
+        cursor.execute(f"CREATE TRIGGER {keys}_truncate AFTER TRUNCATE ON {table} "
+                       f"FOR EACH STATEMENT EXECUTE FUNCTION {keys}_truncate()")
+        cursor.execute(f"SELECT min(id), max(id) FROM {table}")
+        min_id, max_id = cursor.fetchone()
+
+    # Rows inserted from now on get their keys from the trigger
+    if min_id is not None:
+        for start in range(min_id, max_id + 1, batch_size):
+            with transaction.atomic(using=using.alias), using.cursor() as cursor:
+                cursor.execute(f"""
+                    INSERT INTO {keys} SELECT {', '.join(columns)} FROM {table}
+                    WHERE id >= %s AND id < %s FOR KEY SHARE
+                    ON CONFLICT DO NOTHING
+                """, [start, start + batch_size])
+
+
+def _column_type(cursor, table, column):
+    cursor.execute("SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                   "WHERE attrelid = %s::regclass AND attname = %s", [table, column])
+    return cursor.fetchone()[0]
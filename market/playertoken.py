@@ -0,0 +1,69 @@
+"""
+Signed player tokens.
+
+Players don't log in. When a player joins a market, join_market sets a cookie with a token holding
+the ID of the trader, the ID of the market and the token version of the trader
+(Trader.token_version), signed with SECRET_KEY so the player can't change it. The play pages find the
+player from the token, so a player request makes no query to the session table. (The hosts are
+logged in with allauth and still have sessions.)
+
+When the host removes a trader, the token version of the trader is increased, so the tokens given
+before are no longer valid.
+
+Players who joined before the tokens were introduced have their trader in the session. Such a
+session is read (once) when there is no token, and the play page replaces it with a token.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core import signing
+from django.http import HttpResponse
+
+COOKIE_NAME = 'player'
+SALT = 'market.playertoken'
+# The tokens last as long as the sessions of the players did
+MAX_AGE = settings.SESSION_COOKIE_AGE
+
+
+class PlayerToken(namedtuple('PlayerToken', ['trader_id', 'market_id', 'version'])):
+    """ version is None for a token read from an old session (see the module docstring) """
+
+    @property
+    def from_session(self):
+        return self.version is None
+
+    def is_valid_for(self, trader):
+        return trader.id == self.trader_id and (self.from_session or trader.token_version == self.version)
+
+
+def set_player_cookie(response, trader):
+    response.set_signed_cookie(COOKIE_NAME, f"{trader.id}:{trader.market_id}:{trader.token_version}", salt=SALT,
+                               max_age=MAX_AGE, httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE)
+    return response
+
+
+def cookie_value(trader):
+    """ Returns the signed token of the trader, as it is stored in the cookie (e.g. for tests and benchmarks) """
+    return set_player_cookie(HttpResponse(), trader).cookies[COOKIE_NAME].value
+
+
+def get_token(request):
+    """ Returns the PlayerToken of the request, or None if the client has not joined a market """
+    try:
+        value = request.get_signed_cookie(COOKIE_NAME, salt=SALT, max_age=MAX_AGE)
+    except KeyError:
+        return _token_from_session(request)
+    except signing.BadSignature:
+        return None
+    try:
+        trader_id, market_id, version = value.split(':')
+        return PlayerToken(int(trader_id), market_id, int(version))
+    except ValueError:
+        return None
+
+
+def _token_from_session(request):
+    # Only clients with a session cookie have a session to look at (others would get an empty session)
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES or 'trader_id' not in request.session:
+        return None
+    return PlayerToken(request.session['trader_id'], request.session.get('market_id'), None)
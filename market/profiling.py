@@ -0,0 +1,208 @@
+"""
+On-demand profiling of single requests.
+
+A staff user can profile a request by adding the query parameter ?profile=1 or the header
+"X-Profile: 1". ProfilingMiddleware then runs the request under cProfile, records the SQL
+statements, and stores in settings.PROFILE_DIR:
+
+ - <name>.prof: the pstats file (open with e.g. snakeviz or python -m pstats)
+ - <name>.collapsed: the call stacks sampled every millisecond (see StackSampler), one
+   "f1;f2;f3 <number of samples>" line pr. stack, ready for flamegraph.pl or speedscope
+ - <name>.sql: the SQL statements with their durations
+ - <name>.json: the path, view, market, duration etc. shown on the listing page
+
+The name starts with the time and the market ID of the request. The profiles view (/profiles/)
+lists the stored profiles, and profile_file downloads their files.
+"""
+import asyncio
+import collections
+import cProfile
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.decorators import user_passes_test
+from django.db import connection
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+
+
+PROFILE_EXTENSIONS = ['prof', 'collapsed', 'sql', 'json']
+PROFILE_NAME_RE = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9]{6}-[A-Za-z0-9_-]+$')
+
+# Stacks deeper than this are cut off in the collapsed file
+MAX_STACK_DEPTH = 200
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+
+
+def wants_profile(request):
+    return (request.GET.get('profile') == '1' or request.headers.get('X-Profile') == '1') \
+        and request.user.is_authenticated and request.user.is_staff
+
+
+class SQLLog:
+    """ Database execute wrapper recording the SQL (with parameters) and the duration of each query """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - start, sql, params))
+
+    def dump(self):
+        lines = [f"-- {len(self.queries)} queries, {sum(seconds for seconds, _, _ in self.queries) * 1000:.1f} ms"]
+        for seconds, sql, params in self.queries:
+            lines.append(f"\n-- {seconds * 1000:.2f} ms, params: {params!r}\n{sql};")
+        return '\n'.join(lines) + '\n'
+
+
+class ProfilingMiddleware:
+    """
+    Must come after AuthenticationMiddleware, since only staff users can profile requests.
+    Requests served by the ASGI workers (see docs/deployment.md) are not profiled.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django that we are in async mode (like MiddlewareMixin)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response) or not wants_profile(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        sql_log = SQLLog()
+        start = time.perf_counter()
+        with connection.execute_wrapper(sql_log), StackSampler() as sampler:
+            response = profiler.runcall(self.get_response, request)
+        seconds = time.perf_counter() - start
+
+        resolver_match = request.resolver_match
+        market_id = (resolver_match.kwargs.get('market_id') or '') if resolver_match else ''
+        save_profile(profiler, sampler, sql_log, {
+            'path': request.get_full_path(),
+            'method': request.method,
+            'view': resolver_match.view_name if resolver_match else '',
+            'market_id': market_id.upper(),
+            'status': response.status_code,
+            'seconds': seconds,
+            'queries': len(sql_log.queries),
+            'user': request.user.get_username(),
+        })
+        return response
+
+
+def save_profile(profiler, sampler, sql_log, info):
+    """ Writes the files of a profile and returns its name """
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    now = timezone.now()
+    name = f"{now:%Y%m%d-%H%M%S-%f}-{info['market_id'] or 'none'}"
+    info = {**info, 'name': name, 'created_at': now.isoformat()}
+
+    pstats.Stats(profiler).dump_stats(directory / f"{name}.prof")
+    (directory / f"{name}.collapsed").write_text(sampler.collapsed())
+    (directory / f"{name}.sql").write_text(sql_log.dump())
+    (directory / f"{name}.json").write_text(json.dumps(info, indent=2))
+    return name
+
+
+class StackSampler:
+    """
+    Samples the call stack of a thread every interval seconds (from another thread) and counts
+    the stacks. cProfile only records caller -> callee pairs, so the whole stacks needed for a
+    flamegraph can't be rebuilt from a pstats file (e.g. the middleware chain calls the same
+    function at every level).
+    """
+
+    def __init__(self, thread_id=None, interval=0.001):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """ Returns the stacks in the collapsed format ("f1;f2;f3 <number of samples>" pr. line) """
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.counts.items()))
+
+
+def stored_profiles():
+    """ Returns the info of the stored profiles, newest first """
+    directory = profile_dir()
+    if not directory.exists():
+        return []
+    profiles = []
+    for path in sorted(directory.glob('*.json'), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except ValueError:
+            continue
+    return profiles
+
+
+def is_staff(user):
+    return user.is_staff
+
+
+@require_GET
+@user_passes_test(is_staff)
+def profiles(request):
+    market_id = request.GET.get('market_id', '').upper()
+    profile_list = stored_profiles()
+    if market_id:
+        profile_list = [profile for profile in profile_list if profile['market_id'] == market_id]
+    return render(request, 'market/profiles.html', {
+        'profiles': profile_list,
+        'market_id': market_id,
+        'extensions': PROFILE_EXTENSIONS,
+    })
+
+
+@require_GET
+@user_passes_test(is_staff)
+def profile_file(request, name, extension):
+    if not PROFILE_NAME_RE.match(name) or extension not in PROFILE_EXTENSIONS:
+        raise Http404
+    path = profile_dir() / f"{name}.{extension}"
+    if not path.exists():
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name)
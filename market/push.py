@@ -0,0 +1,116 @@
+"""
+Push of market state to waiting players (long polling).
+
+A player waiting for the next round asks wait_for_round with the state it shows (round, number of
+ready and active traders). The request is held open until the state changes or WAIT_TIMEOUT
+seconds have passed. An open request is just a coroutine waiting on a future, so an ASGI worker
+can hold thousands of them (see docs/deployment.md).
+
+The RoundWatcher of each event loop checks the state of all markets with waiting clients every
+POLL_INTERVAL seconds in one query and wakes the clients whose market has changed, so the load on
+the database does not grow with the number of waiting clients. The watcher reads from the replica
+(if there is one, see dbrouter.py).
+
+The DashboardWatcher does the same for the dashboards of the hosts (see hosts.py): the dashboards of
+all hosts with a dashboard open are loaded in one query pr. check, and the last loaded dashboard of
+a host is shared by all the host's open dashboards until one of the markets changes.
+"""
+import asyncio
+import weakref
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+
+from .dbrouter import reading_from_replica
+from .hosts import host_dashboards
+from .models import Market
+from .scheduler import with_trader_counts
+
+
+POLL_INTERVAL = 1.0
+WAIT_TIMEOUT = 25.0
+
+STATE_FIELDS = ['round', 'game_over', 'num_ready', 'num_active']
+
+
+def market_states(market_ids):
+    """ Returns a dict with the state (a dict with STATE_FIELDS) of each of the markets (one query) """
+    markets = with_trader_counts(Market.objects.filter(market_id__in=market_ids))
+    return {state.pop('market_id'): state for state in markets.values('market_id', *STATE_FIELDS)}
+
+
+class RoundWatcher:
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        # market_id -> {future resolved with the new state: state shown by the client}
+        self.waiters = defaultdict(dict)
+        # The state of each market at the last check
+        self.states = {}
+        self._task = None
+
+    def load_states(self, keys):
+        """ Returns a dict with the current state of each of the watched keys (one query) """
+        return market_states(keys)
+
+    def has_changed(self, shown, current):
+        return any(shown.get(field) != current[field] for field in STATE_FIELDS)
+
+    async def wait(self, market_id, state, timeout=WAIT_TIMEOUT):
+        """
+        Waits until the state of the market differs from state (or timeout seconds have passed) and
+        returns the current state (None if the market does not exist)
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[market_id][future] = state
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # The state seen by the last check (many clients time out together, so we don't ask the database)
+            if market_id in self.states:
+                return self.states[market_id]
+            return (await sync_to_async(self.load_states)([market_id])).get(market_id)
+        finally:
+            waiters = self.waiters.get(market_id, {})
+            waiters.pop(future, None)
+            if not waiters:
+                self.waiters.pop(market_id, None)
+
+    async def _run(self):
+        while self.waiters:
+            market_ids = list(self.waiters)
+            with reading_from_replica():
+                states = await sync_to_async(self.load_states)(market_ids)
+            self.states = states
+            for market_id in market_ids:
+                current = states.get(market_id)
+                for future, shown in self.waiters.get(market_id, {}).items():
+                    if not future.done() and (current is None or self.has_changed(shown, current)):
+                        future.set_result(current)
+            await asyncio.sleep(self.interval)
+
+
+class DashboardWatcher(RoundWatcher):
+    """
+    Watches the dashboards of hosts: the keys are the ids of the hosts, and the state shown by a
+    client is the version of the dashboard (see hosts.host_dashboards)
+    """
+
+    def load_states(self, keys):
+        return host_dashboards(keys)
+
+    def has_changed(self, shown, current):
+        return shown != current['version']
+
+
+_watchers = weakref.WeakKeyDictionary()
+
+
+def get_watcher(watcher_class=RoundWatcher):
+    """ Returns the watcher of the given class (RoundWatcher or DashboardWatcher) of the running event loop """
+    watchers = _watchers.setdefault(asyncio.get_running_loop(), {})
+    if watcher_class not in watchers:
+        watchers[watcher_class] = watcher_class()
+    return watchers[watcher_class]
@@ -0,0 +1,106 @@
+"""
+Query budgets for views.
+
+Decorate a view with @query_budget(n) to declare the maximal number of SQL queries a request to the
+view may make. The budget is a constant: it must not grow with the number of traders or rounds, so
+N+1 query patterns (e.g. a query pr. trader in a template) are caught as soon as they creep in.
+
+QueryBudgetMiddleware counts the queries of each request. Depending on settings.QUERY_BUDGET_MODE it
+does nothing ('off', the default in production), logs a warning ('log') or raises QueryBudgetExceeded
+('raise', the default with DEBUG and in the tests) when a view goes over budget. The report lists the
+SQL statements that were executed more than once, which is where N+1 patterns show up.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries):
+    """ Declares the maximal number of queries a request to the decorated view may make """
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+class QueryLog:
+    """
+    Database execute wrapper counting the queries and the time spent executing them
+    (use with connection.execute_wrapper). If record_sql is True, the SQL of each query is kept.
+    """
+
+    def __init__(self, record_sql=False):
+        self.count = 0
+        self.seconds = 0.0
+        self.record_sql = record_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+            if self.record_sql:
+                self.statements.append(sql)
+
+    def duplicates(self):
+        """ Returns (count, sql) for each statement executed more than once, most frequent first """
+        return [(count, sql) for sql, count in Counter(self.statements).most_common() if count > 1]
+
+
+def budget_report(view_name, budget, query_log, max_statements=5):
+    lines = [f"{view_name} made {query_log.count} queries, but its budget is {budget}."]
+    duplicates = query_log.duplicates()
+    if duplicates:
+        lines.append("Repeated queries:")
+        for count, sql in duplicates[:max_statements]:
+            lines.append(f"  {count} x {sql[:300]}")
+    return '\n'.join(lines)
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django that we are in async mode (like MiddlewareMixin)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            # The queries of async views run in other threads (with sync_to_async) and can't be counted
+            # here. Their budgets are checked when they are called synchronously (tests and runserver).
+            return self.get_response(request)
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+        if mode == 'off':
+            return self.get_response(request)
+
+        query_log = QueryLog(record_sql=True)
+        with connection.execute_wrapper(query_log):
+            response = self.get_response(request)
+
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and query_log.count > budget:
+            report = budget_report(request.resolver_match.view_name, budget, query_log)
+            if mode == 'raise':
+                raise QueryBudgetExceeded(report)
+            logger.warning(report)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', None)
@@ -0,0 +1,173 @@
+"""
+Server-side round scheduler.
+
+Finishes rounds without an open monitor tab: in markets with monitor_auto_pilot when all active
+traders are ready, and in markets with a round_deadline when the deadline has passed (and at
+least one trader has traded, since a round can't be settled without trades).
+
+Each tick finds the due markets among all markets with auto-pilot or a deadline in one grouped query
+(see due_markets), so the load on the database does not grow with a query pr. market. The due
+rounds are finished by engine.finish_round in a pool of worker threads. A market locked by another
+request is skipped until the next tick, and engine.finish_round locks the market row and checks the
+round again, so a round is never finished twice (e.g. if the host clicks "Afslut runde" at the same time).
+
+Several scheduler processes can run (e.g. one pr. server); they elect a leader with a PostgreSQL
+advisory lock, and only the leader ticks. If the leader dies, its database session ends, the lock is
+released and another process takes over. Run it with the run_scheduler command.
+
+The leader also creates the monthly partitions of the coming months once a day (see partitions.py).
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import engine
+from .partitions import ensure_partitions
+from .models import ACTIVE, Market, Trader, Trade
+
+
+logger = logging.getLogger(__name__)
+
+# Key of the PostgreSQL advisory lock held by the leader (any number not used by other locks)
+SCHEDULER_LOCK_ID = 7_433_001
+
+# Seconds between creating the partitions of the coming months
+PARTITIONS_INTERVAL = 24 * 3600
+
+
+def _count(queryset, market_field):
+    """ Returns a subquery counting the rows of queryset (filtered on a single market with OuterRef) """
+    return Coalesce(Subquery(
+        queryset.order_by().values(market_field).annotate(count=Count('pk')).values('count'),
+        output_field=IntegerField()), 0)
+
+
+def with_trader_counts(markets):
+    """
+    Annotates the markets with the number of active traders (num_active) and the number of traders
+    who are ready (num_ready), as in the trader table
+    """
+    return markets.annotate(
+        num_active=_count(Trader.objects.filter(ACTIVE, market=OuterRef('pk')), 'market'),
+        num_ready=_count(Trade.objects.filter(
+            market=OuterRef('pk'), round=OuterRef('round'), was_forced=False,
+            trader__removed_from_market=False), 'market'),
+    )
+
+
+def scheduled_markets():
+    """ Returns the markets handled by the scheduler (see with_trader_counts) """
+    return with_trader_counts(Market.objects.filter(
+        Q(monitor_auto_pilot=True) | Q(round_deadline__isnull=False),
+        deleted=False, game_over=False,
+    ))
+
+
+def is_due(market, now):
+    """ Should the current round of the market (annotated by scheduled_markets) be finished now? """
+    if market.num_ready == 0:
+        return False
+    if market.monitor_auto_pilot and market.num_ready >= market.num_active:
+        return True
+    return (market.round_deadline is not None and market.round_started_at is not None
+            and now >= market.round_started_at + timedelta(seconds=market.round_deadline))
+
+
+def due_markets(now=None):
+    """ Returns (market_id, round) for each market with a round that should be finished now (one query) """
+    now = now or timezone.now()
+    return [(market.market_id, market.round) for market in scheduled_markets() if is_due(market, now)]
+
+
+def finish_due_round(market_id, round_num):
+    """
+    Finishes the round round_num of the market, unless it has been finished (or the market is locked
+    by another request) in the meantime. Returns True if the round was finished.
+    """
+    with transaction.atomic():
+        market = Market.objects.select_for_update(skip_locked=True).filter(
+            market_id=market_id, round=round_num, game_over=False).first()
+        if market is None or engine.finish_round(market) is None:
+            return False
+    logger.info("Finished round %s of market %s", round_num + 1, market_id)
+    return True
+
+
+def _finish_in_thread(market_id, round_num):
+    try:
+        return finish_due_round(market_id, round_num)
+    except Exception:
+        logger.exception("Could not finish round %s of market %s", round_num + 1, market_id)
+        # The connection of the thread may be broken; a new one is made for the next round
+        connections.close_all()
+        return False
+
+
+class Scheduler:
+
+    def __init__(self, interval=1.0, workers=4, lock_id=SCHEDULER_LOCK_ID):
+        self.interval = interval
+        self.workers = workers
+        self.lock_id = lock_id
+        self.is_leader = False
+        self._partitions_ensured_at = None
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='scheduler') if workers > 1 else None
+
+    def try_to_become_leader(self):
+        """
+        Takes the advisory lock if no other scheduler has it. The lock belongs to the database session,
+        so it is kept until the connection is closed. On other databases than PostgreSQL we are always leader.
+        """
+        if connection.vendor != 'postgresql':
+            self.is_leader = True
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", [self.lock_id])
+                self.is_leader = cursor.fetchone()[0]
+        return self.is_leader
+
+    def tick(self, now=None):
+        """ Finishes all due rounds and returns the IDs of the markets where a round was finished """
+        due = due_markets(now)
+        if self._executor:
+            results = list(self._executor.map(lambda args: _finish_in_thread(*args), due))
+        else:
+            results = [_finish_in_thread(*args) for args in due]
+        return [market_id for (market_id, _), finished in zip(due, results) if finished]
+
+    def ensure_partitions(self):
+        """ Creates the partitions of the coming months, if it was not done in the last PARTITIONS_INTERVAL seconds """
+        now = time.monotonic()
+        if self._partitions_ensured_at is not None and now - self._partitions_ensured_at < PARTITIONS_INTERVAL:
+            return
+        for name in ensure_partitions():
+            logger.info("Created partition %s", name)
+        self._partitions_ensured_at = now
+
+    def run(self, stop=None, max_ticks=None):
+        """ Ticks every interval seconds (as leader) until the event stop is set """
+        stop = stop or threading.Event()
+        ticks = 0
+        while not stop.is_set() and (max_ticks is None or ticks < max_ticks):
+            start = time.monotonic()
+            try:
+                if self.is_leader or self.try_to_become_leader():
+                    self.ensure_partitions()
+                    self.tick()
+            except DatabaseError:
+                # E.g. the database was restarted. The lock went with the old connection, so we must
+                # take it again on a new connection before the next tick.
+                logger.exception("Scheduler tick failed")
+                connection.close()
+                self.is_leader = False
+            ticks += 1
+            stop.wait(max(0.0, self.interval - (time.monotonic() - start)))
+        if self._executor:
+            self._executor.shutdown()
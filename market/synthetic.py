@@ -0,0 +1,299 @@
+"""
+Synthetic data for performance testing.
+
+generate_markets plays markets with the reference bots in economics.py in memory and writes
+users, markets, traders, trades and round statistics in batches with bulk_create. The rounds are
+settled with the same formulas as helpers.process_trade and engine.finish_round, so balances,
+trades and RoundStats are consistent, and the markets can be played further in the app.
+Used by the setup_test_data command and the benchmark suite.
+"""
+import io
+import math
+import statistics
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.utils import timezone
+
+from .economics import BOTS, REFERENCE_POPULATIONS, assign_bots, equilibrium, spread_costs
+from .engine import CENT, settled_ranking
+from .models import Market, Trader, Trade, RoundStat, UsedCosts, MARKET_ID_CHARS
+from .scenarios import SCENARIOS
+
+
+# The market fields set by a scenario (see create_market_details)
+SCENARIO_FIELDS = [
+    'product_name_singular', 'product_name_plural', 'initial_balance', 'alpha', 'theta', 'gamma',
+    'min_cost', 'max_cost', 'cost_slope', 'max_rounds', 'endless', 'allow_robots',
+]
+
+# Number of rounds played in endless markets (they have no max_rounds)
+MAX_ENDLESS_ROUNDS = 1000
+
+# The trades are generated as tuples with these fields (the first is the trader object)
+TRADE_FIELDS = ['trader', 'round', 'was_forced', 'unit_price', 'unit_amount', 'prod_cost', 'demand',
+                'units_sold', 'profit', 'balance_before', 'balance_after']
+
+
+def create_users(num_users, prefix='user', password='test'):
+    """
+    Returns num_users users named <prefix>0, <prefix>1, ... Existing users with these names are reused.
+    All new users get the same password.
+    """
+    User = get_user_model()
+    usernames = [f"{prefix}{i}" for i in range(num_users)]
+    existing = {user.username: user for user in User.objects.filter(username__in=usernames)}
+    # Hashing is slow, so we only do it once
+    hashed_password = make_password(password)
+    User.objects.bulk_create([
+        User(username=username, email=f"{username}@example.com", password=hashed_password)
+        for username in usernames if username not in existing])
+    users = {user.username: user for user in User.objects.filter(username__in=usernames)}
+    return [users[username] for username in usernames]
+
+
+def generate_markets(users, num_markets, rng, min_traders=10, max_traders=150, num_rounds=None,
+                     endless_rounds=MAX_ENDLESS_ROUNDS, endless_share=0.1, population='mixed', skip_share=0.05,
+                     scenarios=SCENARIOS, batch_size=5000, progress=None):
+    """
+    Creates num_markets markets with the scenarios in turn, each created by a random user and
+    with a random number of traders between min_traders and max_traders. A share endless_share
+    of the markets are made endless.
+    Each market is played for num_rounds rounds, or (if num_rounds is None) a random number of rounds
+    up to max_rounds (endless_rounds for endless markets). Finite markets that reach max_rounds are over.
+
+    The traders are played by the bots of the population in economics.REFERENCE_POPULATIONS, and
+    each trader skips a round (gets a forced trade) with probability skip_share. Traders who can't
+    afford to produce declare bankruptcy. progress is called with each market when it has been written.
+
+    Returns a dict with the number of markets, traders, trades and round stats created.
+    """
+    taken_ids = set(Market.objects.values_list('market_id', flat=True))
+    totals = {'markets': 0, 'traders': 0, 'trades': 0, 'round_stats': 0}
+    trades = []
+    for i in range(num_markets):
+        scenario = scenarios[i % len(scenarios)]
+        market = new_market(scenario, rng.choice(users), rng, taken_ids)
+        if rng.random() < endless_share:
+            market.endless = True
+        if num_rounds is not None:
+            rounds = num_rounds if market.endless else min(num_rounds, market.max_rounds)
+        else:
+            rounds = rng.randint(1, endless_rounds if market.endless else market.max_rounds)
+        num_traders = rng.randint(min_traders, max_traders)
+
+        market.save()
+        traders = new_traders(market, num_traders, rng)
+        round_stats = play_market(market, traders, population, rounds, skip_share, rng, trades)
+        # The traders are created with their final state, when the game has been played
+        Trader.objects.bulk_create(traders, batch_size=batch_size)
+        # The ids follow the order of the traders, so the ranks of traders with the same balance still hold
+        for round_stat in round_stats:
+            for entry in round_stat.ranking:
+                entry['id'] = traders[entry['id']].id
+        if market.min_cost < market.max_cost:
+            UsedCosts.objects.bulk_create(
+                [UsedCosts(market=market, cost=cost) for cost in set(trader.initial_cost for trader in traders)])
+        RoundStat.objects.bulk_create(round_stats, batch_size=batch_size)
+        market.save(update_fields=Market.SETTLEMENT_FIELDS)
+        # bulk_create doesn't save the traders one by one, so the balance totals are computed afterwards
+        market.refresh_balance_totals()
+
+        if len(trades) >= batch_size:
+            write_trades(trades, batch_size)
+            totals['trades'] += len(trades)
+            trades = []
+        totals['markets'] += 1
+        totals['traders'] += len(traders)
+        totals['round_stats'] += len(round_stats)
+        if progress:
+            progress(market)
+
+    write_trades(trades, batch_size)
+    totals['trades'] += len(trades)
+    return totals
+
+
+def new_market(scenario, created_by, rng, taken_ids):
+    """ Returns a new (unsaved) market with the parameters of the scenario """
+    while True:
+        market_id = ''.join(rng.choice(MARKET_ID_CHARS) for _ in range(8))
+        if market_id not in taken_ids:
+            taken_ids.add(market_id)
+            break
+    values = {field: scenario[field] for field in SCENARIO_FIELDS}
+    for field in ['initial_balance', 'alpha', 'theta', 'gamma', 'min_cost', 'max_cost', 'cost_slope']:
+        values[field] = Decimal(str(values[field])).quantize(Decimal('0.01'))
+    return Market(market_id=market_id, created_by=created_by, seed=rng.getrandbits(31), **values)
+
+
+def new_traders(market, num_traders, rng):
+    """
+    Returns the (unsaved) traders of the market with costs covering the whole spectrum from
+    min_cost to max_cost (like Trader.prod_cost_algorithm) in random order
+    """
+    costs = [Decimal(cost).quantize(Decimal('0.01'))
+             for cost in spread_costs(market.min_cost, market.max_cost, num_traders)]
+    rng.shuffle(costs)
+    traders = []
+    for i, cost in enumerate(costs):
+        trader = Trader(market=market, name=f"trader{i}", prod_cost=cost, balance=market.initial_balance,
+                        round_joined=0, auto_play=market.allow_robots)
+        trader.initial_cost = cost
+        traders.append(trader)
+    return traders
+
+
+def write_trades(trades, batch_size):
+    """
+    Writes trades given as tuples of TRADE_FIELDS. On PostgreSQL we use COPY, which is many
+    times faster than bulk_create for millions of rows.
+    """
+    created_at = timezone.now()
+    if connection.vendor != 'postgresql':
+        Trade.objects.bulk_create([
+            Trade(created_at=created_at, market_id=trade[0].market_id, **dict(zip(TRADE_FIELDS, trade)))
+            for trade in trades],
+            batch_size=batch_size)
+        return
+
+    columns = ['trader_id', 'market_id'] + TRADE_FIELDS[1:] + ['created_at']
+    created_at = created_at.isoformat()
+    with connection.cursor() as cursor:
+        for start in range(0, len(trades), batch_size):
+            data = io.StringIO()
+            for trade in trades[start:start + batch_size]:
+                values = [trade[0].id, trade[0].market_id, *trade[1:], created_at]
+                data.write('\t'.join(r'\N' if value is None else str(value) for value in values))
+                data.write('\n')
+            data.seek(0)
+            cursor.copy_expert(
+                f"COPY {Trade._meta.db_table} ({', '.join(columns)}) FROM STDIN", data)
+
+
+def play_market(market, traders, population, num_rounds, skip_share, rng, trades):
+    """
+    Plays num_rounds rounds of the market, appends the trades (as tuples of TRADE_FIELDS) to the list
+    trades and returns the RoundStats. Updates market and traders, but does not save them.
+    The traders have no ids yet, so the rankings of the RoundStats refer to the traders by their index
+    in traders (see generate_markets).
+    """
+    bots = [BOTS[name] for name in assign_bots(REFERENCE_POPULATIONS[population], len(traders))]
+    states = [{'round': 0} for _ in traders]
+    alpha, theta, gamma = market.alpha, market.theta, market.gamma
+    round_stats = []
+
+    for round_num in range(num_rounds):
+        min_cost = market.min_cost + market.accum_cost_change
+        max_price = market.max_allowed_price()
+        eq = equilibrium(alpha, theta, gamma, min_cost, market.max_cost + market.accum_cost_change)
+
+        decisions = []
+        # The indexes of the traders who made the decisions
+        traded = []
+        for i, (trader, bot, state) in enumerate(zip(traders, bots, states)):
+            if not trader.bankrupt and trader.balance < trader.prod_cost:
+                trader.bankrupt = True
+                trader.round_bankrupt = round_num
+            if trader.bankrupt or rng.random() < skip_share:
+                trades.append((trader, round_num, True, None, None, trader.prod_cost, None,
+                               None, None, trader.balance, trader.balance))
+                continue
+            max_amount = math.floor(trader.balance / trader.prod_cost)
+            state.update({
+                'prod_cost': float(trader.prod_cost),
+                'min_cost': float(min_cost),
+                'max_price': float(max_price),
+                'max_amount': max_amount,
+                'equilibrium': eq,
+            })
+            price, amount = bot(state, rng)
+            # Clamp the choices to the values allowed by the trade form
+            price = min(max(Decimal('0.00'), Decimal(price).quantize(Decimal('0.01'))), max_price)
+            amount = min(max(0, int(amount)), max_amount)
+            decisions.append((trader, state, price, amount))
+            traded.append(i)
+
+        if not decisions:
+            # A round can't be settled without trades, so the market stays in this round
+            del trades[-len(traders):]
+            break
+
+        # Settle the round like engine.finish_round and helpers.process_trade
+        avg_price = sum(price for _, _, price, _ in decisions) / len(decisions)
+        # All traders joined in round 0, so they are all in the ranking before the rounds after it
+        balances_before = {i: trader.balance for i, trader in enumerate(traders)} if round_num > 0 else {}
+        units_sold_by_trader, profits = [], []
+        for trader, state, price, amount in decisions:
+            demand = max(0, round(alpha - (gamma + theta) * price + theta * avg_price))
+            units_sold = min(demand, amount)
+            profit = price * units_sold - trader.prod_cost * amount
+            units_sold_by_trader.append(units_sold)
+            profits.append(profit)
+            trades.append((trader, round_num, False, price, amount, trader.prod_cost, demand,
+                           units_sold, profit, trader.balance, trader.balance + profit))
+            trader.balance += profit
+            # The bots treat the first round they trade in as round 0
+            state.update({
+                'round': round_num + 1,
+                'price_last_round': float(price),
+                'amount_last_round': amount,
+                'demand_last_round': demand,
+                'profit_last_round': float(profit),
+                'avg_price_last_round': float(avg_price),
+            })
+
+        round_stats.append(RoundStat(
+            market=market,
+            round=round_num,
+            avg_price=avg_price,
+            avg_balance_after=sum(trader.balance for trader in traders) / len(traders),
+            avg_amount=Decimal(sum(amount for _, _, _, amount in decisions)) / len(decisions),
+            alpha=alpha,
+            theta=theta,
+            gamma=gamma,
+            eq_price=market.eq_price,
+            eq_amount=market.eq_amount,
+            num_trades=len(decisions),
+            num_forced_trades=len(traders) - len(decisions),
+            ranking=settled_ranking(
+                balances_before,
+                {i: trader.balance for i, trader in enumerate(traders)},
+                dict(zip(traded, profits))),
+            **spread_and_totals([price for _, _, price, _ in decisions],
+                                [amount for _, _, _, amount in decisions], units_sold_by_trader, profits)))
+
+        for trader in traders:
+            new_cost = trader.prod_cost + market.cost_slope
+            if new_cost > 0:
+                trader.prod_cost = new_cost
+        market.accum_cost_change += market.cost_slope
+        # The slope is reset after each round (see engine.finish_round)
+        market.cost_slope = Decimal('0.00')
+        market.update_equilibrium()
+        market.round += 1
+
+    if market.check_game_over():
+        market.game_over = True
+    return round_stats
+
+
+def spread_and_totals(prices, amounts, units_sold, profits):
+    """
+    Returns the spread of the prices, the totals and the HHI of the valid trades of a round (given as
+    lists with a value pr. trade), computed like engine.round_statistics computes them in the database
+    """
+    total_sold = sum(units_sold)
+    hhi = 10000 * Decimal(sum(sold * sold for sold in units_sold)) / total_sold ** 2 if total_sold else None
+    return {
+        'median_price': Decimal(statistics.median(prices)).quantize(CENT),
+        'min_price': min(prices),
+        'max_price': max(prices),
+        'price_stddev': Decimal(statistics.pstdev(prices)).quantize(CENT),
+        'units_produced': sum(amounts),
+        'units_sold': total_sold,
+        'total_profit': sum(profits),
+        'hhi': hhi.quantize(CENT) if hhi is not None else None,
+    }
@@ -43,7 +43,15 @@ def to_float(value):
     return str(value)
 
 
+def rank_change(value):
+    """ Shows the number of places a trader moved up (or down) in the last round as an arrow """
+    if not value:
+        return ''
+    return f"▲{value}" if value > 0 else f"▼{-value}"
+
+
 register.filter('field_name_to_label', field_name_to_label)
 register.filter('get_attribute', get_attribute)
 register.filter('subtract', subtract)
 register.filter('to_float', to_float)
+register.filter('rank_change', rank_change)
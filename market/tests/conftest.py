@@ -11,6 +11,11 @@ def english(settings):
     # Change language (for situations where LocaleMiddleware is disabled)
     translation.activate("en-US")
 
+@pytest.fixture(scope='function', autouse=True)
+def query_budgets(settings):
+    # Fail tests when a view makes more queries than its budget (see querybudget.py)
+    settings.QUERY_BUDGET_MODE = 'raise'
+
 @pytest.fixture
 def logged_in_user(db, client):
     user = UserFactory()
@@ -0,0 +1,117 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+import json
+from datetime import timedelta
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from ..archive import archivable_markets, archive_market, load_history
+from ..forms import TraderForm
+from ..history import export_market_history
+from ..models import Market, MarketArchive, RoundStat, Trade, Trader, UsedCosts
+from .factories import MarketFactory
+from .test_history import play_market
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
+def monitor_context(client, market):
+    response = client.get(reverse('market:monitor', args=(market.market_id,)))
+    assert response.status_code == 200
+    return response.context
+
+
+def test_archive_market_moves_history_to_archive(db):
+    market = play_market()
+    history = export_market_history(market)
+    num_trades = Trade.objects.filter(market=market).count()
+
+    deleted = archive_market(market.market_id, batch_size=7)
+
+    assert deleted['Trade'] == num_trades
+    assert deleted['Trader'] == 6
+    for model in [Trader, Trade, RoundStat, UsedCosts]:
+        assert not model.objects.filter(market=market).exists()
+    market.refresh_from_db()
+    assert market.archived
+    assert MarketArchive.objects.get(market=market).num_trades == num_trades
+    assert load_history(market) == history
+    # Archiving again does nothing
+    assert archive_market(market.market_id) is None
+
+
+def test_monitor_page_is_rendered_from_archive(client, logged_in_user):
+    market = play_market()
+    market.created_by = logged_in_user
+    market.game_over = True
+    market.save()
+    before = monitor_context(client, market)
+
+    archive_market(market.market_id)
+    after = monitor_context(client, market)
+
+    for key in ['balanceDataSet', 'priceDataSet', 'amountDataSet', 'spreadDataSet', 'concentrationDataSet',
+                'num_active_traders', 'all_are_bankrupt']:
+        assert after[key] == before[key]
+    assert [(trader.name, trader.balance, trader.bankrupt) for trader in after['traders']] == \
+        [(trader.name, trader.balance, trader.bankrupt) for trader in before['traders']]
+    # The second time the rehydrated archive is taken from the cache
+    assert monitor_context(client, market)['priceDataSet'] == before['priceDataSet']
+
+
+def test_archived_deleted_market_is_shown_as_finished(client, logged_in_user):
+    market = play_market()
+    market.created_by = logged_in_user
+    market.deleted = True
+    market.save()
+    archive_market(market.market_id)
+
+    context = monitor_context(client, market)
+    assert context['market'].game_over
+    assert not Market.objects.get(market_id=market.market_id).game_over
+    # Nobody can join an archived market
+    assert not TraderForm({'name': 'newcomer', 'market_id': market.market_id}).is_valid()
+
+
+def test_archivable_markets(db):
+    now = timezone.now()
+    old = now - timedelta(days=40)
+    finished = MarketFactory(game_over=True, round_started_at=old)
+    deleted = MarketFactory(deleted=True, round_started_at=old)
+    MarketFactory(round_started_at=old)
+    MarketFactory(game_over=True, round_started_at=now)
+    MarketFactory(game_over=True, round_started_at=old, archived=True)
+
+    assert set(archivable_markets(30, now)) == {finished, deleted}
+
+
+def test_archive_markets_command(db, capsys, tmp_path):
+    market = play_market()
+    market.game_over = True
+    market.save()
+    Market.objects.filter(pk=market.pk).update(round_started_at=timezone.now() - timedelta(days=40))
+
+    call_command('archive_markets', '--dry-run')
+    assert f"Would archive {market.market_id}" in capsys.readouterr().out
+    assert not Market.objects.get(pk=market.pk).archived
+
+    call_command('archive_markets', '--pause', '0')
+    assert f"Archived {market.market_id}" in capsys.readouterr().out
+    assert Market.objects.get(pk=market.pk).archived
+
+    # The export command exports archived markets from the archive
+    call_command('export_market_history', market.market_id, '--output', str(tmp_path))
+    history = json.loads((tmp_path / f"{market.market_id}.json").read_text())
+    assert len(history['trades']) == MarketArchive.objects.get(market=market).num_trades
@@ -0,0 +1,53 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+import json
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from ..benchmarks import VIEWS, run_benchmarks, compare_results
+from ..models import Market, Trade
+
+
+def test_run_benchmarks_times_all_views_and_keeps_nothing(db):
+    results = run_benchmarks(traders=[3], rounds=[2], repeat=2)
+
+    assert [result['view'] for result in results['results']] == VIEWS
+    for result in results['results']:
+        assert result['traders'] == 3 and result['rounds'] == 2
+        assert result['queries'] > 0
+        assert 0 < result['wall_ms']['min'] <= result['wall_ms']['median'] <= result['wall_ms']['max']
+    assert not Market.objects.exists()
+    assert not Trade.objects.exists()
+
+
+def test_compare_results_flags_slower_views_and_more_queries():
+    def results(monitor_ms, monitor_queries):
+        return {'results': [
+            {'view': 'monitor', 'traders': 10, 'rounds': 1, 'wall_ms': {'median': monitor_ms}, 'queries': monitor_queries},
+            {'view': 'play_get', 'traders': 10, 'rounds': 1, 'wall_ms': {'median': 10.0}, 'queries': 5},
+        ]}
+
+    assert compare_results(results(10.0, 5), results(12.0, 5)) == []
+    assert compare_results(results(10.0, 5), results(20.0, 5))[0][0] == ('monitor', 10, 1)
+    assert len(compare_results(results(10.0, 5), results(20.0, 6))) == 2
+    # Small absolute differences are ignored
+    assert compare_results(results(0.1, 5), results(0.5, 5)) == []
+
+
+def test_benchmark_commands(db, tmp_path):
+    call_command('run_benchmarks', traders=[2], rounds=[1], views='current_round', repeat=1,
+                 output=str(tmp_path / 'baseline.json'))
+    baseline = json.loads((tmp_path / 'baseline.json').read_text())
+    assert len(baseline['results']) == 1
+
+    baseline['results'][0]['queries'] -= 1
+    (tmp_path / 'faster.json').write_text(json.dumps(baseline))
+    with pytest.raises(CommandError):
+        call_command('compare_benchmarks', str(tmp_path / 'faster.json'), str(tmp_path / 'baseline.json'))
@@ -0,0 +1,90 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+from datetime import timedelta
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+
+from ..cleanup import CLEANUP_LOCK_ID, abandoned_markets, collect_garbage, delete_in_batches
+from ..models import Market, UnusedCosts, UsedCosts
+from .factories import MarketFactory, TraderFactory
+
+
+def make_session(expire_date):
+    session = SessionStore()
+    session['trader_id'] = 1
+    session.create()
+    Session.objects.filter(session_key=session.session_key).update(expire_date=expire_date)
+    return session.session_key
+
+
+def old_market(days=10, **kwargs):
+    market = MarketFactory(**kwargs)
+    Market.objects.filter(pk=market.pk).update(created_at=timezone.now() - timedelta(days=days))
+    return market
+
+
+def test_abandoned_markets(db):
+    abandoned = old_market()
+    old_market(round=1)
+    old_market(days=1)
+    TraderFactory(market=old_market(), removed_from_market=True)
+    assert list(abandoned_markets(7)) == [abandoned]
+
+
+def test_delete_in_batches(db):
+    now = timezone.now()
+    for i in range(7):
+        make_session(now - timedelta(days=1))
+    fresh = make_session(now + timedelta(days=1))
+
+    assert delete_in_batches(Session.objects.filter(expire_date__lt=now), batch_size=3, max_batches=2) == 6
+    assert delete_in_batches(Session.objects.filter(expire_date__lt=now), batch_size=3) == 1
+    assert list(Session.objects.values_list('session_key', flat=True)) == [fresh]
+
+
+def test_collect_garbage(db):
+    now = timezone.now()
+    make_session(now - timedelta(days=3))
+    kept_session = make_session(now - timedelta(days=1))
+    abandoned = old_market()
+    UnusedCosts.objects.create(market=abandoned, cost=abandoned.min_cost)
+    played = old_market(round=3)
+    archived = old_market(round=3, archived=True)
+    UnusedCosts.objects.create(market=archived, cost=archived.min_cost)
+    UsedCosts.objects.create(market=archived, cost=archived.min_cost)
+    UsedCosts.objects.create(market=played, cost=played.min_cost)
+
+    deleted = collect_garbage(session_days=2, batch_size=1)
+
+    assert deleted == {'sessions': 1, 'markets': 1, 'unused costs': 1, 'used costs': 1}
+    assert list(Session.objects.values_list('session_key', flat=True)) == [kept_session]
+    assert not Market.objects.filter(pk=abandoned.pk).exists()
+    assert UsedCosts.objects.get().market == played
+    assert collect_garbage(session_days=2) == {'sessions': 0, 'markets': 0, 'unused costs': 0, 'used costs': 0}
+
+
+def test_cleanup_command(db, capsys):
+    old_market()
+    call_command('cleanup', '--pause', '0')
+    assert "Deleted 0 sessions, 1 markets, 0 unused costs, 0 used costs" in capsys.readouterr().out
+
+
+def test_cleanup_command_does_not_run_twice(db, capsys):
+    # Another run holds the lock (on another database session)
+    other = connection.copy()
+    try:
+        with other.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", [CLEANUP_LOCK_ID])
+        call_command('cleanup')
+        assert "Another cleanup is running" in capsys.readouterr().out
+    finally:
+        other.close()
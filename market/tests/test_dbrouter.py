@@ -0,0 +1,138 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+
+The tests with two database aliases only run when the replica is configured, e.g.:
+POSTGRES_REPLICA_HOST=$POSTGRES_HOST pytest -k replica
+(the replica alias is then a mirror of the test database)
+"""
+import pytest
+from django.conf import settings as django_settings
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import reverse
+
+from .. import playertoken
+from ..dbrouter import STICKY_COOKIE, ReplicaMiddleware, ReplicaRouter, reading_from_replica, replica_reads
+from ..models import Market
+from ..querybudget import QueryLog
+from .factories import MarketFactory, TraderFactory, UnProcessedTradeFactory
+
+
+def test_router_reads_from_primary_outside_replica_views(settings):
+    settings.REPLICA_DATABASE = 'replica'
+    assert ReplicaRouter().db_for_read(Market) == 'default'
+
+
+def test_router_reads_from_replica_in_replica_views(settings):
+    settings.REPLICA_DATABASE = 'replica'
+    with reading_from_replica():
+        assert ReplicaRouter().db_for_read(Market) == 'replica'
+        assert ReplicaRouter().db_for_write(Market) == 'default'
+    assert ReplicaRouter().db_for_read(Market) == 'default'
+
+
+def test_router_reads_from_primary_without_replica(settings):
+    settings.REPLICA_DATABASE = None
+    with reading_from_replica():
+        assert ReplicaRouter().db_for_read(Market) == 'default'
+
+
+def test_router_reads_from_primary_in_transaction(settings, db):
+    settings.REPLICA_DATABASE = 'replica'
+    with reading_from_replica(), transaction.atomic():
+        assert ReplicaRouter().db_for_read(Market) == 'default'
+
+
+def run_middleware(request, view_func):
+    """ Runs the request through ReplicaMiddleware and returns (response, the alias read from in the view) """
+    read_from = []
+
+    def get_response(request):
+        middleware.process_view(request, view_func, (), {})
+        read_from.append(ReplicaRouter().db_for_read(Market))
+        return HttpResponse()
+
+    middleware = ReplicaMiddleware(get_response)
+    response = middleware(request)
+    return response, read_from[0]
+
+
+def test_middleware_reads_from_replica_in_get_of_replica_views(settings):
+    settings.REPLICA_DATABASE = 'replica'
+    view = replica_reads(lambda request: None)
+    assert run_middleware(RequestFactory().get('/'), view)[1] == 'replica'
+    assert run_middleware(RequestFactory().get('/'), lambda request: None)[1] == 'default'
+    assert run_middleware(RequestFactory().post('/'), view)[1] == 'default'
+    # The value does not leak out of the request
+    assert ReplicaRouter().db_for_read(Market) == 'default'
+
+
+def test_middleware_sticks_to_primary_after_post(settings):
+    settings.REPLICA_DATABASE = 'replica'
+    settings.REPLICA_STICKY_SECONDS = 7
+    view = replica_reads(lambda request: None)
+
+    response, _ = run_middleware(RequestFactory().post('/'), view)
+    assert response.cookies[STICKY_COOKIE]['max-age'] == 7
+
+    request = RequestFactory().get('/')
+    request.COOKIES[STICKY_COOKIE] = '1'
+    assert run_middleware(request, view)[1] == 'default'
+
+
+def test_middleware_sets_no_cookie_without_replica(settings):
+    settings.REPLICA_DATABASE = None
+    response, _ = run_middleware(RequestFactory().post('/'), replica_reads(lambda request: None))
+    assert STICKY_COOKIE not in response.cookies
+
+
+requires_replica = pytest.mark.skipif(
+    'replica' not in django_settings.DATABASES, reason="POSTGRES_REPLICA_HOST is not set")
+
+
+@requires_replica
+@pytest.mark.django_db(transaction=True, databases=['default', 'replica'])
+def test_replica_monitor_reads_from_replica_until_round_is_finished(client, logged_in_user, settings):
+    settings.REPLICA_DATABASE = 'replica'
+    market = MarketFactory(created_by=logged_in_user)
+    UnProcessedTradeFactory(trader=TraderFactory(market=market), round=0)
+
+    replica_queries = QueryLog()
+    with connections['replica'].execute_wrapper(replica_queries):
+        assert client.get(reverse('market:monitor', args=(market.market_id,))).status_code == 200
+    assert replica_queries.count > 0
+
+    # Read your writes: after finishing the round, the monitor page reads from the primary
+    response = client.post(reverse('market:finish_round', args=(market.market_id,)))
+    assert STICKY_COOKIE in response.cookies
+    replica_queries = QueryLog()
+    with connections['replica'].execute_wrapper(replica_queries):
+        response = client.get(reverse('market:monitor', args=(market.market_id,)))
+    assert response.context['market'].round == 1
+    assert replica_queries.count == 0
+
+
+@requires_replica
+@pytest.mark.django_db(transaction=True, databases=['default', 'replica'])
+def test_replica_play_reads_from_primary_after_trade(client, settings):
+    settings.REPLICA_DATABASE = 'replica'
+    trader = TraderFactory()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
+    url = reverse('market:play', args=(trader.market.market_id,))
+
+    replica_queries = QueryLog()
+    with connections['replica'].execute_wrapper(replica_queries):
+        assert client.get(url).status_code == 200
+    assert replica_queries.count > 0
+
+    client.post(url, {'unit_price': 10, 'unit_amount': 5})
+    replica_queries = QueryLog()
+    with connections['replica'].execute_wrapper(replica_queries):
+        response = client.get(url)
+    assert response.context['wait']
+    assert replica_queries.count == 0
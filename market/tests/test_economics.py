@@ -0,0 +1,84 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+import random
+
+from ..economics import demands, equilibrium, equilibrium_trade, assign_bots, simulate, sweep
+
+
+def profit(price, other_prices, cost, alpha, theta, gamma):
+    """ Profit of a trader who produces exactly what is demanded (without rounding of demand) """
+    prices = [price] + other_prices
+    avg_price = sum(prices) / len(prices)
+    demand = alpha - (gamma + theta) * price + theta * avg_price
+    return (price - cost) * demand
+
+
+def test_demands_uses_same_formula_as_process_trade():
+    # avg. price is 11, so demand = 105 - 17.5 * price + 14.5 * 11
+    assert demands([10, 12], 105, 14.5, 3) == [
+        round(105 - 17.5 * 10 + 14.5 * 11), round(105 - 17.5 * 12 + 14.5 * 11)]
+
+
+def test_demands_is_never_negative():
+    assert demands([1, 1000], 105, 14.5, 3)[1] == 0
+
+
+def test_symmetric_equilibrium_is_a_best_response():
+    """ No trader can gain by deviating from the equilibrium price when all others play it """
+    alpha, theta, gamma, cost, n = 105, 14.5, 3.0, 8, 10
+    eq = equilibrium(alpha, theta, gamma, cost, num_traders=n)
+    others = [eq['price']] * (n - 1)
+    best = profit(eq['price'], others, cost, alpha, theta, gamma)
+    for deviation in [-0.5, -0.01, 0.01, 0.5]:
+        assert profit(eq['price'] + deviation, others, cost, alpha, theta, gamma) < best
+    assert abs(eq['amount'] - (alpha - gamma * eq['price'])) < 1e-9
+
+
+def test_heterogeneous_equilibrium_is_a_best_response_for_each_cost():
+    alpha, theta, gamma, min_cost, max_cost, n = 220, 20.0, 4.3, 10, 18, 3
+    eq = equilibrium(alpha, theta, gamma, min_cost, max_cost, num_traders=n)
+    costs = [10, 14, 18]
+    prices = [equilibrium_trade(eq, min_cost, cost)[0] for cost in costs]
+    assert abs(sum(prices) / n - eq['price']) < 1e-9
+    for i, cost in enumerate(costs):
+        others = prices[:i] + prices[i+1:]
+        best = profit(prices[i], others, cost, alpha, theta, gamma)
+        assert profit(prices[i] + 0.05, others, cost, alpha, theta, gamma) < best
+        assert profit(prices[i] - 0.05, others, cost, alpha, theta, gamma) < best
+
+
+def test_equilibrium_is_none_without_price_sensitivity_and_competition():
+    assert equilibrium(100, 0, 0, 8) is None
+
+
+def test_assign_bots_respects_weights_and_interleaves():
+    names = assign_bots({'random': 1, 'follower': 3}, 8)
+    assert names.count('random') == 2
+    assert names.count('follower') == 6
+    assert names[:4].count('random') == 1
+
+
+def test_simulate_is_reproducible():
+    params = {'alpha': 105, 'theta': 14.5, 'gamma': 3.0, 'min_cost': 8,
+              'max_cost': 8, 'initial_balance': 5000}
+    balances = [[state['balance'] for state in simulate(params, {'random': 1}, 5, 10, random.Random(1))]
+                for _ in range(2)]
+    assert balances[0] == balances[1]
+
+
+def test_sweep_reuses_cached_points(tmp_path):
+    points = [{'alpha': alpha, 'theta': 14.5, 'gamma': 3.0, 'min_cost': 8,
+               'max_cost': 8, 'initial_balance': 5000} for alpha in [100, 105]]
+    first, num_computed = sweep(points, 5, 3, runs=1, cache_dir=tmp_path)
+    assert num_computed == 2
+
+    # Extending the grid only computes the new point
+    points.append(dict(points[0], alpha=110))
+    second, num_computed = sweep(points, 5, 3, runs=1, cache_dir=tmp_path)
+    assert num_computed == 1
+    assert second[:2] == first
@@ -0,0 +1,201 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+import io
+import random
+from decimal import Decimal
+
+from django.core.management import call_command
+
+from ..engine import finish_round, add_bot_trades, fast_forward
+from ..models import Market, Trade, RoundStat
+from .factories import MarketFactory, TraderFactory, UnProcessedTradeFactory
+
+
+def test_finish_round_processes_trades_and_creates_forced_trades(db):
+    market = MarketFactory(round=2)
+    trader1 = TraderFactory(market=market)
+    trader2 = TraderFactory(market=market, balance=Decimal('100.00'))
+    UnProcessedTradeFactory(trader=trader1, round=2)
+
+    result = finish_round(market)
+
+    assert result == {'num_trades': 1, 'num_forced_trades': 1}
+    trader1.refresh_from_db()
+    trade = Trade.objects.get(trader=trader1, round=2)
+    assert trade.balance_after == trader1.balance
+    forced_trade = Trade.objects.get(trader=trader2, round=2)
+    assert forced_trade.was_forced
+    assert forced_trade.balance_after == Decimal('100.00')
+    assert RoundStat.objects.get(market=market, round=2).avg_price == trade.unit_price
+    market.refresh_from_db()
+    assert market.round == 3
+
+
+def test_finish_round_saves_extended_statistics(db):
+    market = MarketFactory(round=1)
+    traders = [TraderFactory(market=market, prod_cost=Decimal('5.00'), balance=Decimal('5000.00')) for _ in range(4)]
+    for trader, price, amount in zip(traders, ['10.00', '20.00', '60.00'], [10, 20, 30]):
+        UnProcessedTradeFactory(trader=trader, round=1, unit_price=Decimal(price), unit_amount=amount)
+    removed = TraderFactory(market=market, removed_from_market=True, balance=None)
+
+    finish_round(market)
+
+    round_stat = RoundStat.objects.get(market=market, round=1)
+    trades = list(Trade.objects.filter(market=market, round=1, was_forced=False))
+    sold = [trade.units_sold for trade in trades]
+    assert (round_stat.min_price, round_stat.median_price, round_stat.max_price) == (10, 20, 60)
+    assert round_stat.avg_price == 30
+    assert round_stat.price_stddev == Decimal('21.60')
+    assert round_stat.avg_amount == 20
+    assert round_stat.units_produced == 60
+    assert round_stat.units_sold == sum(sold)
+    assert round_stat.total_profit == sum(trade.profit for trade in trades)
+    assert round_stat.hhi == (Decimal(10000 * sum(units ** 2 for units in sold)) / sum(sold) ** 2).quantize(Decimal('0.01'))
+    balances = [trader.balance for trader in market.all_traders() if trader.id != removed.id]
+    assert round_stat.avg_balance_after == (sum(balances) / 4).quantize(Decimal('0.01'))
+    assert (round_stat.num_trades, round_stat.num_forced_trades) == (3, 2)
+
+
+def test_finish_round_saves_ranking_with_rank_changes(db):
+    market = MarketFactory(round=1, alpha=105, theta=Decimal('14.5'), gamma=3)
+    first = TraderFactory(market=market, prod_cost=Decimal('1.00'), balance=Decimal('1000.00'))
+    second = TraderFactory(market=market, prod_cost=Decimal('1.00'), balance=Decimal('990.00'))
+    newcomer = TraderFactory(market=market, prod_cost=Decimal('1.00'), balance=Decimal('500.00'), round_joined=1)
+    # demand = 105 - 3 * 5 = 90, so the second trader sells all 10 units with a profit of 40
+    UnProcessedTradeFactory(trader=second, round=1, unit_price=Decimal('5.00'), unit_amount=10)
+
+    finish_round(market)
+
+    ranking = RoundStat.objects.get(market=market, round=1).ranking
+    assert [(entry['id'], entry['rank'], entry['rank_change']) for entry in ranking] == \
+        [(second.id, 1, 1), (first.id, 2, -1), (newcomer.id, 3, None)]
+    assert [entry['profit'] for entry in ranking] == ['40.00', None, None]
+    assert ranking[0]['balance'] == '1030.00'
+
+    # The live ranking of the market shows the changes of the last settled round
+    market.refresh_from_db()
+    assert [(entry['name'], entry['rank_change'], entry['profit']) for entry in market.ranking()] == \
+        [(second.name, 1, 40), (first.name, -1, None), (newcomer.name, None, None)]
+
+
+def test_round_is_not_finished_twice(db):
+    market = MarketFactory(round=2)
+    UnProcessedTradeFactory(trader=TraderFactory(market=market), round=2)
+    # E.g. the host's request and the scheduler loaded the market at the same time
+    stale = Market.objects.get(pk=market.pk)
+
+    assert finish_round(market) is not None
+    assert finish_round(stale) is None
+    assert RoundStat.objects.filter(market=market).count() == 1
+    market.refresh_from_db()
+    assert market.round == 3
+
+
+def test_round_without_valid_trades_is_not_finished(db):
+    market = MarketFactory(round=2)
+    TraderFactory(market=market)
+    assert finish_round(market) is None
+    market.refresh_from_db()
+    assert market.round == 2
+
+
+def test_finish_round_uses_constant_number_of_queries(db, django_assert_max_num_queries):
+    market = MarketFactory()
+    for i in range(20):
+        UnProcessedTradeFactory(trader=TraderFactory(market=market), round=0)
+    for i in range(10):
+        TraderFactory(market=market)
+
+    with django_assert_max_num_queries(12):
+        finish_round(market)
+
+
+def test_add_bot_trades_only_for_traders_in_robot_mode(db):
+    market = MarketFactory()
+    robot = TraderFactory(market=market, auto_play=True)
+    human = TraderFactory(market=market)
+    TraderFactory(market=market, auto_play=True, balance=Decimal('1.00'))  # can't afford to produce
+
+    assert add_bot_trades(market, 'random', random.Random(1)) == 1
+    trade = Trade.objects.get(trader=robot)
+    assert trade.round == 0
+    assert 0 <= trade.unit_price <= market.max_allowed_price()
+    assert not Trade.objects.filter(trader=human).exists()
+
+    # A robot which has already traded doesn't trade again
+    assert add_bot_trades(market, 'random', random.Random(1)) == 0
+
+
+def test_fast_forward_plays_rounds_with_robots(db):
+    market = MarketFactory(max_rounds=15)
+    TraderFactory(market=market, auto_play=True, balance=Decimal('5000.00'))
+    TraderFactory(market=market, auto_play=True, balance=Decimal('5000.00'))
+    human = TraderFactory(market=market)
+
+    report = fast_forward(market, 5, rng=random.Random(1))
+
+    assert [result['round'] for result in report] == [0, 1, 2, 3, 4]
+    assert all(result['num_trades'] == 2 and result['num_forced_trades'] == 1 for result in report)
+    assert all(result['seconds'] >= 0 for result in report)
+    market.refresh_from_db()
+    assert market.round == 5
+    assert RoundStat.objects.filter(market=market).count() == 5
+    assert Trade.objects.filter(trader=human, was_forced=True).count() == 5
+
+
+def test_fast_forward_stops_when_game_is_over(db):
+    market = MarketFactory(max_rounds=3)
+    TraderFactory(market=market, auto_play=True, balance=Decimal('5000.00'))
+
+    report = fast_forward(market, 10, rng=random.Random(1))
+
+    assert len(report) == 3
+    market.refresh_from_db()
+    assert market.game_over
+
+
+def test_fast_forward_stops_when_nobody_trades(db):
+    market = MarketFactory()
+    TraderFactory(market=market)
+
+    assert fast_forward(market, 10) == []
+    market.refresh_from_db()
+    assert market.round == 0
+
+
+def test_finish_round_records_settlement_timing(db):
+    market = MarketFactory(round=2)
+    round_started_at = market.round_started_at
+    trader1 = TraderFactory(market=market)
+    TraderFactory(market=market)
+    UnProcessedTradeFactory(trader=trader1, round=2)
+
+    finish_round(market)
+
+    round_stat = RoundStat.objects.get(market=market, round=2)
+    assert round_stat.num_trades == 1
+    assert round_stat.num_forced_trades == 1
+    assert round_stat.started_at == round_started_at
+    for seconds in [round_stat.load_seconds, round_stat.compute_seconds, round_stat.write_seconds]:
+        assert seconds >= 0
+    market.refresh_from_db()
+    assert market.round_started_at > round_started_at
+
+
+def test_round_timings_command(db):
+    market = MarketFactory()
+    trader = TraderFactory(market=market)
+    UnProcessedTradeFactory(trader=trader, round=0, decision_seconds=12.0)
+    finish_round(market)
+
+    out = io.StringIO()
+    call_command('round_timings', market.market_id.lower(), stdout=out)
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[1].split()[:5] == ['1', '0.0', 's', '1', '0']
+    assert '12.0 s' in lines[1]
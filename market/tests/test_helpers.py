@@ -10,7 +10,11 @@ docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test fu
 """
 
 from django.test import TestCase
-from ..helpers import create_forced_trade, process_trade, generate_balance_list
+import json
+
+from ..helpers import (create_forced_trade, process_trade, generate_balance_list, add_context_for_trader_table,
+                       add_graph_context_for_monitor_page)
+from ..models import Market
 from decimal import Decimal
 from decimal import Decimal
 from .factories import MarketFactory, TraderFactory, TradeFactory, UnProcessedTradeFactory, ForcedTradeFactory
@@ -198,3 +202,31 @@ class TestGenerateBalanceList(TestCase):
         self.assertEqual(generate_balance_list(
             trader)[2], market.initial_balance)
         self.assertEqual(len(generate_balance_list(trader)), 3)
+
+
+def test_trader_table_overlays_ready_flags_on_cached_ranking(db, django_assert_num_queries):
+    market = MarketFactory()
+    waiting = TraderFactory(market=market, balance=Decimal('200.00'))
+    ready = TraderFactory(market=market, balance=Decimal('100.00'))
+    add_context_for_trader_table({'market': market})
+    UnProcessedTradeFactory(trader=ready, round=0)
+
+    # The ranking is cached, so only the ready flags are queried
+    with django_assert_num_queries(1):
+        context = add_context_for_trader_table({'market': market})
+    assert [(trader.id, trader.ready) for trader in context['traders']] == [(waiting.id, False), (ready.id, True)]
+    assert (context['num_ready_traders'], context['num_active_traders']) == (1, 2)
+
+
+def test_monitor_graph_averages_balances_when_totals_have_not_caught_up(db):
+    market = MarketFactory()
+    TraderFactory(market=market, balance=Decimal('300.00'))
+    TraderFactory(market=market, balance=Decimal('100.00'))
+    # E.g. a join interleaved with refresh_balance_totals
+    Market.objects.filter(pk=market.pk).update(balance_sum=0, balance_count=0)
+    market.refresh_from_db()
+
+    context = add_graph_context_for_monitor_page({'market': market})
+
+    average = [dataset for dataset in json.loads(context['balanceDataSet']) if dataset['label'] == 'Average'][0]
+    assert average['data'][-1] == 200.0
@@ -0,0 +1,100 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+import json
+import random
+from decimal import Decimal
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from ..engine import fast_forward
+from ..history import export_market_history, replay_market_history
+from ..models import Market, Trader, Trade, RoundStat
+from .factories import MarketFactory, TraderFactory
+
+
+def play_market():
+    """ Plays a small market with a late join, a cost change, a removal and a bankruptcy """
+    market = MarketFactory(max_rounds=10)
+    for i in range(3):
+        TraderFactory(market=market, auto_play=True, balance=Decimal('5000.00'))
+    removed = TraderFactory(market=market, auto_play=True, balance=Decimal('5000.00'))
+    bankrupt = TraderFactory(market=market, auto_play=True, balance=Decimal('5000.00'))
+    fast_forward(market, 2, rng=random.Random(1))
+
+    market.refresh_from_db()
+    TraderFactory(market=market, auto_play=True, balance=Decimal('5000.00'), round_joined=market.round)
+    market.cost_slope = Decimal('1.50')
+    market.save()
+    removed.refresh_from_db()
+    removed.remove()
+    bankrupt.refresh_from_db()
+    bankrupt.bankrupt = True
+    bankrupt.round_bankrupt = market.round
+    bankrupt.save()
+    fast_forward(market, 3, rng=random.Random(2))
+    market.refresh_from_db()
+    return market
+
+
+def test_export_market_history_is_json_serializable(db):
+    market = play_market()
+
+    history = json.loads(json.dumps(export_market_history(market)))
+
+    assert history['market']['market_id'] == market.market_id
+    assert len(history['traders']) == 6
+    assert len(history['trades']) == Trade.objects.filter(trader__market=market).count()
+    assert [settlement['round'] for settlement in history['settlements']] == [0, 1, 2, 3, 4]
+    assert sum(1 for trader in history['traders'] if trader['round_removed'] == 2) == 1
+    assert sum(1 for trader in history['traders'] if trader['round_bankrupt'] == 2) == 1
+
+
+def test_replay_reproduces_recorded_market(db):
+    market = play_market()
+    history = json.loads(json.dumps(export_market_history(market)))
+
+    replayed, mismatches = replay_market_history(history)
+
+    assert mismatches == []
+    assert replayed.market_id != market.market_id
+    assert replayed.round == market.round
+    assert replayed.accum_cost_change == market.accum_cost_change
+    assert RoundStat.objects.filter(market=replayed).count() == 5
+    assert sorted(Trader.objects.filter(market=replayed).values_list('balance', flat=True), key=str) == \
+        sorted(Trader.objects.filter(market=market).values_list('balance', flat=True), key=str)
+
+
+def test_replay_reports_mismatches(db):
+    market = play_market()
+    history = json.loads(json.dumps(export_market_history(market)))
+    history['settlements'][1]['avg_price'] = '999.00'
+    history['trades'][0]['balance_after'] = '0.01'
+
+    replayed, mismatches = replay_market_history(history)
+
+    assert len(mismatches) == 2
+    assert any('avg_price' in mismatch for mismatch in mismatches)
+
+
+def test_export_and_replay_commands(db, tmp_path, capsys):
+    market = play_market()
+
+    call_command('export_market_history', market.market_id, output=str(tmp_path))
+    call_command('replay_market_history', str(tmp_path))
+
+    assert 'OK' in capsys.readouterr().out
+    # The replay is rolled back by default
+    assert Market.objects.count() == 1
+
+    history = json.loads((tmp_path / f"{market.market_id}.json").read_text())
+    history['trades'][0]['profit'] = '123.45'
+    (tmp_path / f"{market.market_id}.json").write_text(json.dumps(history))
+    with pytest.raises(CommandError):
+        call_command('replay_market_history', str(tmp_path))
@@ -0,0 +1,123 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+from decimal import Decimal
+
+from django.utils import timezone
+
+from ..archive import archive_market
+from ..engine import finish_round
+from ..hosts import dashboard, format_cursor, host_dashboards, page_of_markets, parse_cursor
+from ..models import Market, RoundStat
+from .factories import MarketFactory, TraderFactory, UnProcessedTradeFactory, UserFactory
+
+
+def test_cursor_survives_the_url():
+    now = timezone.now()
+    assert parse_cursor(format_cursor((now, 'ABCDEFGH'))) == (now, 'ABCDEFGH')
+    assert parse_cursor(format_cursor((None, 'ABCDEFGH'))) == (None, 'ABCDEFGH')
+    for value in [None, '', 'ABCDEFGH', 'yesterday~ABCDEFGH', '2021-01-01T00:00:00~']:
+        assert parse_cursor(value) is None
+
+
+def test_pages_include_markets_without_created_at(db):
+    host = UserFactory()
+    markets = [MarketFactory(created_by=host) for _ in range(4)]
+    # Markets made before created_at was recorded come first
+    Market.objects.filter(pk__in=[market.pk for market in markets[:2]]).update(created_at=None)
+    MarketFactory(created_by=host, deleted=True)
+
+    shown = []
+    cursor = None
+    while True:
+        page, cursor = page_of_markets(host, cursor, page_size=1)
+        shown += [market.market_id for market in page]
+        if cursor is None:
+            break
+    assert shown == sorted([market.market_id for market in markets[:2]], reverse=True) + \
+        [market.market_id for market in reversed(markets[2:])]
+
+
+def test_dashboard_shows_live_markets_of_host(db):
+    host = UserFactory()
+    market = MarketFactory(created_by=host, round=2)
+    RoundStat.objects.create(market=market, round=1, avg_price=Decimal('12.50'))
+    ready = TraderFactory(market=market, balance=Decimal('300.00'))
+    UnProcessedTradeFactory(trader=ready, round=2)
+    TraderFactory(market=market, balance=Decimal('100.00'))
+    TraderFactory(market=market, balance=Decimal('50.00'), bankrupt=True)
+    TraderFactory(market=market, balance=None, removed_from_market=True)
+    for finished in [{'game_over': True}, {'deleted': True}, {'archived': True}]:
+        MarketFactory(created_by=host, **finished)
+    MarketFactory()
+
+    assert dashboard(host)['markets'] == [{
+        'market_id': market.market_id, 'round': 2, 'max_rounds': market.max_rounds, 'endless': market.endless,
+        'num_ready': 1, 'num_active': 2, 'num_bankrupt': 1,
+        'avg_price': Decimal('12.50'), 'avg_balance': Decimal('150.00'),
+    }]
+
+
+def test_dashboards_of_hosts_are_loaded_in_one_query(db, django_assert_num_queries):
+    hosts = [UserFactory() for _ in range(3)]
+    for host in hosts[:2]:
+        for _ in range(2):
+            TraderFactory(market=MarketFactory(created_by=host))
+    with django_assert_num_queries(1):
+        dashboards = host_dashboards([host.id for host in hosts])
+    assert [len(dashboards[host.id]['markets']) for host in hosts] == [2, 2, 0]
+
+
+def test_dashboard_version_changes_with_markets(db):
+    host = UserFactory()
+    trader = TraderFactory(market=MarketFactory(created_by=host))
+    version = host_dashboards([host.id])[host.id]['version']
+    assert host_dashboards([host.id])[host.id]['version'] == version
+    UnProcessedTradeFactory(trader=trader, round=0)
+    assert host_dashboards([host.id])[host.id]['version'] != version
+
+
+def test_dashboard_is_cached_until_it_is_loaded_again(db, django_assert_num_queries):
+    host = UserFactory()
+    trader = TraderFactory(market=MarketFactory(created_by=host))
+    version = dashboard(host)['version']
+    with django_assert_num_queries(0):
+        assert dashboard(host)['version'] == version
+    UnProcessedTradeFactory(trader=trader, round=0)
+    # The DashboardWatcher loads the dashboards of the hosts with a dashboard open
+    host_dashboards([host.id])
+    with django_assert_num_queries(0):
+        assert dashboard(host)['markets'][0]['num_ready'] == 1
+
+
+def test_cached_dashboard_is_removed_when_a_market_changes(db, django_capture_on_commit_callbacks):
+    host = UserFactory()
+    markets = [MarketFactory(created_by=host) for _ in range(3)]
+    trader = TraderFactory(market=markets[0])
+    dashboard(host)
+
+    def shown():
+        return {market['market_id']: market['round'] for market in dashboard(host)['markets']}
+
+    # The cached dashboard is removed when the transaction commits
+    with django_capture_on_commit_callbacks(execute=True):
+        new_market = MarketFactory(created_by=host)
+    assert new_market.market_id in shown()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        UnProcessedTradeFactory(trader=trader, round=0)
+        finish_round(markets[0])
+    assert shown()[markets[0].market_id] == 1
+
+    with django_capture_on_commit_callbacks(execute=True):
+        markets[1].game_over = True
+        markets[1].save(update_fields=['game_over'])
+    assert markets[1].market_id not in shown()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        archive_market(markets[2].market_id)
+    assert markets[2].market_id not in shown()
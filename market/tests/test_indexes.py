@@ -0,0 +1,101 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+
+The queries run on the busiest pages must use the indexes made for them. The planner picks indexes
+from the table statistics, so the tests fill the tables with many markets with a realistic mix of
+traders, ANALYZE them and check the plans the planner chooses.
+"""
+import re
+
+import pytest
+from decimal import Decimal
+
+from django.db import connection
+from django.utils import timezone
+
+from ..models import Market, Trade, Trader
+from ..partitions import month_start, partition_name
+from ..scheduler import scheduled_markets
+from .factories import MarketFactory, TraderFactory, UnProcessedTradeFactory, UserFactory
+
+NUM_MARKETS = 100
+TRADERS_PR_MARKET = 100
+ROUNDS = 3
+
+
+@pytest.fixture
+def markets(db):
+    """
+    NUM_MARKETS markets in round ROUNDS - 1, each with TRADERS_PR_MARKET traders (of whom a fifth have
+    gone bankrupt and a few have been removed) and their trades. Many classes play at the same time, so
+    the rows of the markets are mixed in the tables. Returns the markets.
+    """
+    host = UserFactory()
+    markets = Market.objects.bulk_create([
+        MarketFactory.build(round=ROUNDS - 1, monitor_auto_pilot=True, created_by=host, market_id=f"M{i:07d}")
+        for i in range(NUM_MARKETS)])
+    traders = Trader.objects.bulk_create([
+        Trader(market=market, name=f"trader{i}", prod_cost=Decimal('8.00'),
+               balance=None if i % 50 == 0 else Decimal(1000 + i), removed_from_market=i % 50 == 0,
+               bankrupt=i % 5 == 1)
+        for i in range(TRADERS_PR_MARKET) for market in markets])
+    Trade.objects.bulk_create([
+        Trade(trader=trader, market_id=trader.market_id, round=round_num, unit_price=Decimal('10.00'),
+              unit_amount=10, was_forced=trader.bankrupt and round_num > 0)
+        for round_num in range(ROUNDS) for trader in traders])
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE market_market, market_trader, market_trade")
+    return markets
+
+
+def test_trade_gets_market_of_trader(db):
+    trader = TraderFactory()
+    assert UnProcessedTradeFactory(trader=trader).market == trader.market
+
+
+def test_trades_this_round_use_market_round_index(markets):
+    # The trades are in the partition of this month; the empty partitions of the coming months may be scanned
+    market = markets[0]
+    partition = partition_name('market_trade', month_start(timezone.localtime()))
+    for trades in [market.all_trades_this_round(), market.valid_trades_this_round()]:
+        plan = trades.explain()
+        assert f'{partition}_trade_market_round_idx' in plan
+        assert not re.search(rf'Seq Scan on {partition}\b', plan)
+
+
+def test_scheduler_counts_ready_traders_with_market_round_index(markets):
+    assert 'trade_market_round_idx' in scheduled_markets().explain()
+
+
+def test_trades_of_previous_rounds_use_market_round_index(markets):
+    market = markets[0]
+    plan = Trade.objects.filter(market=market, round__lte=market.round - 1).explain()
+    assert 'trade_market_round_idx' in plan
+
+
+def test_active_traders_use_partial_index(markets):
+    assert 'trader_active_idx' in markets[0].active_traders().explain()
+
+
+def test_active_or_bankrupt_traders_use_index_on_market(markets):
+    # Few traders are removed, so the index of the traders not removed is about as big as the index on
+    # market and the planner may pick either. Both find the traders of the market without a scan.
+    market = markets[0]
+    for traders in [market.active_or_bankrupt_traders(), market.active_or_bankrupt_traders_with_ready_flag(),
+                    market.active_or_bankrupt_traders().filter(bankrupt=True)]:
+        plan = traders.explain()
+        assert "Index Cond: ((market_id)::text = 'M0000000'::text)" in plan
+        assert 'Seq Scan on market_trader' not in plan
+
+
+def test_all_are_bankrupt(db):
+    market = MarketFactory()
+    assert not market.all_are_bankrupt()
+    TraderFactory(market=market, bankrupt=True)
+    assert market.all_are_bankrupt()
+    TraderFactory(market=market)
+    assert not market.all_are_bankrupt()
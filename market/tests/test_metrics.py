@@ -0,0 +1,72 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+from django.urls import reverse
+from prometheus_client import REGISTRY
+
+from .factories import MarketFactory, TraderFactory, UnProcessedTradeFactory, UserFactory
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics_count_requests_latency_and_queries_pr_view(client, db):
+    before = sample('markedsspil_requests_total', view='market:home', method='GET', status='200')
+    before_latency = sample('markedsspil_request_duration_seconds_count', view='market:home')
+
+    client.get(reverse('market:home'))
+
+    assert sample('markedsspil_requests_total', view='market:home', method='GET', status='200') == before + 1
+    assert sample('markedsspil_request_duration_seconds_count', view='market:home') == before_latency + 1
+    assert sample('markedsspil_request_queries_count', view='market:home') > 0
+
+
+def test_metrics_count_settlements_pr_market(client, logged_in_user):
+    market = MarketFactory(created_by=logged_in_user)
+    UnProcessedTradeFactory(trader=TraderFactory(market=market), round=0)
+    before = sample('markedsspil_settlement_duration_seconds_count')
+
+    client.post(reverse('market:finish_round', args=(market.market_id,)))
+
+    assert sample('markedsspil_settlement_duration_seconds_count') == before + 1
+    assert sample('markedsspil_market_settlement_seconds_total', market_id=market.market_id) > 0
+
+
+def test_metrics_of_requests_are_not_labelled_with_market_id_from_url(client, db):
+    client.get('/nosuchmarket/play/')
+    samples = [sample for metric in REGISTRY.collect() for sample in metric.samples]
+    assert not any(sample.labels.get('market_id', '').upper() == 'NOSUCHMARKET' for sample in samples)
+
+
+def test_metrics_count_equilibrium_cache_lookups(db):
+    before = sample('markedsspil_cache_requests_total', cache='equilibrium', result='hit')
+    market = MarketFactory()
+    market.save()
+    assert sample('markedsspil_cache_requests_total', cache='equilibrium', result='hit') == before + 1
+
+
+def test_metrics_endpoint_is_protected(client, db, settings):
+    settings.METRICS_TOKEN = 'secret'
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code == 403
+
+    response = client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+    assert response.status_code == 200
+    assert b'markedsspil_requests_total' in response.content
+
+    user = UserFactory()
+    client.force_login(user)
+    assert client.get('/metrics').status_code == 403
+    user.is_staff = True
+    user.save()
+    assert client.get('/metrics').status_code == 200
+
+
+def test_metrics_endpoint_without_token_setting_only_allows_staff(client, db, settings):
+    settings.METRICS_TOKEN = ''
+    assert client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code == 403
@@ -10,7 +10,12 @@ docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test fu
 """
 
 
-from ..models import Trade, RoundStat, UnusedCosts, UsedCosts
+import random
+
+from django.core.cache import cache
+
+from ..models import Market, Trade, RoundStat, UnusedCosts, UsedCosts, new_unique_market_id
+from ..engine import fast_forward
 from decimal import Decimal
 from .factories import MarketFactory, TradeFactory, TraderFactory
 
@@ -18,10 +23,79 @@ from .factories import MarketFactory, TradeFactory, TraderFactory
 ### Test MarketModel ###
 # All relevant properties are currently being tested in the test_factories test suite
     
+def test_market_equilibrium_is_set_on_creation(db):
+    market = MarketFactory(alpha=105, theta=Decimal('14.5'), gamma=3, min_cost=8, max_cost=8)
+    # avg. price = (alpha + (gamma + theta) * cost) / (2 * gamma + theta)
+    # (105 + 17.5 * 8) / 20.5
+    assert market.eq_price == Decimal('11.95')
+    # alpha - gamma * price
+    assert market.eq_amount == Decimal('69.15')
+
+
+def test_market_equilibrium_is_updated_when_parameters_change(db):
+    market = MarketFactory(alpha=105, theta=Decimal('14.5'), gamma=3, min_cost=8, max_cost=8)
+    old_price = market.eq_price
+
+    market.alpha = 200
+    market.save()
+    market.refresh_from_db()
+    assert market.eq_price > old_price
+
+    # moving all costs also moves the equilibrium
+    price = market.eq_price
+    market.accum_cost_change = 5
+    market.save()
+    assert market.eq_price > price
+
+
+def test_market_equilibrium_is_not_solved_again_with_unchanged_parameters(db, monkeypatch):
+    market = MarketFactory()
+    calls = []
+    monkeypatch.setattr('market.models.equilibrium', lambda *args: calls.append(args))
+    market.round += 1
+    market.save()
+    assert calls == []
+
+
 ### Test TraderModel ###
 # Most relevant properties are currently being tested in the test_factories test suite
 
 
+def test_market_random_stream_is_determined_by_seed_purpose_and_keys(db):
+    market = MarketFactory(seed=42)
+    other_market = MarketFactory(seed=42)
+
+    assert market.random_stream('bots', 3).random() == other_market.random_stream('bots', 3).random()
+    assert market.random_stream('bots', 3).random() != market.random_stream('bots', 4).random()
+    assert market.random_stream('bots', 3).random() != market.random_stream('prod_cost', 3).random()
+
+
+def test_new_unique_market_id_with_random_generator(db):
+    market_id = new_unique_market_id(random.Random(1))
+    assert market_id == new_unique_market_id(random.Random(1))
+    assert len(market_id) == 8
+
+    # An ID that is taken is skipped
+    MarketFactory(market_id=market_id)
+    assert new_unique_market_id(random.Random(1)) != market_id
+
+
+def test_markets_with_same_seed_get_same_costs_and_robot_trades(db):
+    def play(seed):
+        market = MarketFactory(seed=seed, min_cost=Decimal('5.00'), max_cost=Decimal('25.00'))
+        UnusedCosts.objects.create(market=market, cost=market.min_cost)
+        UnusedCosts.objects.create(market=market, cost=market.max_cost)
+        for i in range(6):
+            # The factory sets a cost, so we create the traders like the join_market view does
+            TraderFactory(market=market, prod_cost=None, auto_play=True, balance=Decimal('5000.00'))
+        fast_forward(market, 3)
+        return [(trade.trader.prod_cost, trade.unit_price, trade.unit_amount)
+                for trade in Trade.objects.filter(trader__market=market).order_by('round', 'trader_id')]
+
+    assert play(7) == play(7)
+    assert play(7) != play(8)
+
+
 def test_max_allowed_price(db):
     market = MarketFactory(max_cost=100)
     trader1 = TraderFactory(market=market, prod_cost=16)
@@ -35,6 +109,43 @@ def test_max_allowed_price(db):
     assert market.max_allowed_price() == (12 + 50)*4
 
 
+def test_balance_totals_follow_join_remove_and_settlement(db):
+    market = MarketFactory(initial_balance=5000, round=1)
+    stale = Market.objects.get(pk=market.pk)
+    trader1 = TraderFactory(market=market, balance=3000)
+    trader2 = TraderFactory(market=market, balance=1000)
+    assert (market.balance_sum, market.balance_count, market.avg_balance()) == (4000, 2, 2000)
+
+    # A market object loaded before the traders joined is saved with the fields it changed, so it
+    # doesn't overwrite the totals
+    stale.monitor_auto_pilot = True
+    stale.save(update_fields=['monitor_auto_pilot'])
+    market.refresh_from_db()
+    assert (market.balance_sum, market.balance_count) == (4000, 2)
+
+    trader1.remove()
+    market.refresh_from_db()
+    assert (market.balance_sum, market.balance_count) == (1000, 1)
+
+    fast_forward(market, 1, all_traders_are_bots=True)
+    market.refresh_from_db()
+    trader2.refresh_from_db()
+    assert (market.balance_sum, market.balance_count) == (trader2.balance, 1)
+
+
+def test_ranking_is_cached_until_it_may_change(db, django_assert_num_queries):
+    cache.clear()
+    market = MarketFactory()
+    trader1 = TraderFactory(market=market, balance=100)
+    trader2 = TraderFactory(market=market, balance=200)
+    assert [entry['id'] for entry in market.ranking()] == [trader2.id, trader1.id]
+    with django_assert_num_queries(0):
+        market.ranking()
+
+    trader3 = TraderFactory(market=market, balance=300)
+    assert [entry['name'] for entry in market.ranking()] == [trader3.name, trader2.name, trader1.name]
+
+
 def test_prod_cost_algorithm(db):
     # We start out with a market and unused costs.
     market = MarketFactory()
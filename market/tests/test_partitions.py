@@ -0,0 +1,173 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+from datetime import date, datetime, timedelta
+
+import pytest
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from ..partitions import (PARTITIONED_TABLES, add_months, convert_to_partitioned, create_partition, detach_partition, ensure_partitions, is_partitioned,
+                          month_start, partition_name, partitions)
+from ..models import RoundStat, Trade
+from .factories import MarketFactory, TraderFactory, UnProcessedTradeFactory
+
+
+def partition_of(trade):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT tableoid::regclass::text FROM market_trade WHERE id = %s", [trade.id])
+        return cursor.fetchone()[0]
+
+
+def old_trade(market, months_ago):
+    """ A trade of the market created months_ago months ago, in a partition made for it """
+    month = add_months(month_start(timezone.localtime()), -months_ago)
+    for table in PARTITIONED_TABLES:
+        create_partition(table, month)
+    trade = UnProcessedTradeFactory(trader=TraderFactory(market=market))
+    created_at = timezone.make_aware(datetime(month.year, month.month, 15))
+    Trade.objects.filter(pk=trade.pk).update(created_at=created_at)
+    return month
+
+
+def test_tables_are_partitioned(db):
+    for table in PARTITIONED_TABLES:
+        assert is_partitioned(table)
+
+
+def test_add_months():
+    assert add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert partition_name('market_trade', date(2024, 3, 1)) == 'market_trade_2024_03'
+
+
+def test_ensure_partitions_creates_coming_months(db):
+    now = timezone.now() + timedelta(days=400)
+    created = ensure_partitions(ahead=2, now=now)
+    month = month_start(timezone.localtime(now))
+    expected = [partition_name(table, add_months(month, months)) for table in PARTITIONED_TABLES for months in range(3)]
+    assert created == expected
+    assert ensure_partitions(ahead=2, now=now) == []
+    assert add_months(month, 2) in [month for _, month, _ in partitions('market_trade')]
+
+
+def test_new_trade_is_stored_in_partition_of_current_month(db):
+    trade = UnProcessedTradeFactory()
+    assert partition_of(trade) == partition_name('market_trade', month_start(timezone.localtime()))
+
+
+def test_partition_of_running_market_is_not_detached(db):
+    market = MarketFactory()
+    month = old_trade(market, 12)
+
+    with pytest.raises(ValueError, match=market.market_id):
+        detach_partition('market_trade', month)
+
+    market.game_over = True
+    market.save()
+    assert detach_partition('market_trade', month) == partition_name('market_trade', month)
+    # The trades of the detached month are no longer in the table
+    assert not Trade.objects.filter(market=market).exists()
+
+
+def test_duplicate_keys_are_rejected_across_partitions(db):
+    trade = UnProcessedTradeFactory(round=3)
+    month = old_trade(trade.trader.market, 2)
+    # The trade moves to the partition of an old month
+    Trade.objects.filter(pk=trade.pk).update(created_at=timezone.make_aware(datetime(month.year, month.month, 2)))
+    with pytest.raises(IntegrityError, match='trader_and_round_unique_together'), transaction.atomic():
+        Trade.objects.create(trader=trade.trader, round=3)
+
+    RoundStat.objects.create(market=trade.market, round=3)
+    with pytest.raises(IntegrityError, match='market_and_round_unique_together'), transaction.atomic():
+        RoundStat.objects.create(market=trade.market, round=3)
+
+    # The key goes with the trade
+    Trade.objects.filter(pk=trade.pk).delete()
+    Trade.objects.create(trader=trade.trader, round=3)
+    Trade.objects.filter(trader=trade.trader, round=3).update(round=4)
+    Trade.objects.create(trader=trade.trader, round=3)
+
+
+def test_create_partition_moves_rows_from_default_partition(db):
+    trade = UnProcessedTradeFactory(round=3)
+    month = add_months(month_start(timezone.localtime()), -40)
+    Trade.objects.filter(pk=trade.pk).update(created_at=timezone.make_aware(datetime(month.year, month.month, 5)))
+    assert partition_of(trade) == 'market_trade_default'
+
+    assert create_partition('market_trade', month) == partition_name('market_trade', month)
+    assert partition_of(trade) == partition_name('market_trade', month)
+    with pytest.raises(IntegrityError), transaction.atomic():
+        Trade.objects.create(trader=trade.trader, round=3)
+
+
+def test_trades_of_market_skip_partitions_before_market(db):
+    market = MarketFactory()
+    old_trade(MarketFactory(), 2)
+    old_partition = partition_name('market_trade', add_months(month_start(timezone.localtime()), -2))
+    assert old_partition in Trade.objects.filter(market=market, round=0).explain()
+    assert old_partition not in market.all_trades_this_round().explain()
+
+
+def test_detached_rows_leave_their_keys(db):
+    market = MarketFactory(game_over=True)
+    month = old_trade(market, 12)
+    trade = Trade.objects.get(market=market)
+    detach_partition('market_trade', month)
+    Trade.objects.create(trader=trade.trader, round=trade.round)
+
+
+def test_partitions_command(db, capsys):
+    running, finished = MarketFactory(), MarketFactory(game_over=True)
+    month = old_trade(running, 13)
+    old_trade(finished, 14)
+    before = add_months(month_start(timezone.localtime()), -12)
+
+    call_command('partitions', '--detach-before', f"{before:%Y-%m}")
+    captured = capsys.readouterr()
+    assert f"Detached {partition_name('market_trade', add_months(month, -1))}" in captured.out
+    assert f"{partition_name('market_trade', month)} has rows of markets that are still played" in captured.err
+    current = partition_name('market_trade', month_start(timezone.localtime()))
+    assert f"{current}: about" in captured.out
+
+
+def test_convert_to_partitioned(db):
+    markets = [MarketFactory(), MarketFactory(game_over=True)]
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE market_scratch (
+                id serial PRIMARY KEY,
+                market_id varchar(16) NOT NULL REFERENCES market_market (market_id),
+                round integer NOT NULL,
+                created_at timestamp with time zone
+            )
+        """)
+        cursor.execute("CREATE INDEX market_scratch_round_idx ON market_scratch (market_id, round)")
+        for market in markets:
+            cursor.execute("""
+                INSERT INTO market_scratch (market_id, round, created_at)
+                SELECT %s, round, now() - interval '40 days' * (round %% 3) FROM generate_series(0, 99) round
+            """, [market.market_id])
+        cursor.execute("UPDATE market_scratch SET created_at = NULL WHERE round = 99")
+
+    convert_to_partitioned('market_scratch', batch_size=30)
+
+    assert is_partitioned('market_scratch')
+    assert len(partitions('market_scratch')) >= 6
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*), count(created_at), max(id) FROM market_scratch")
+        assert cursor.fetchone() == (200, 200, 200)
+        # New rows continue the sequence
+        cursor.execute("INSERT INTO market_scratch (market_id, round, created_at) VALUES (%s, 100, now()) RETURNING id",
+                       [markets[0].market_id])
+        assert cursor.fetchone()[0] == 201
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'market_scratch'")
+        assert {row[0] for row in cursor.fetchall()} == {'market_scratch_pkey', 'market_scratch_round_idx'}
+        # The log of the changed rows is gone with the old table
+        cursor.execute("SELECT to_regclass('market_scratch_changes')")
+        assert cursor.fetchone()[0] is None
@@ -0,0 +1,84 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import playertoken
+from ..models import Trader
+from .factories import MarketFactory, TraderFactory
+
+
+def join(client, market, name='Hanne'):
+    client.post(reverse('market:join_market'), {'name': name, 'market_id': market.market_id})
+    return Trader.objects.get(market=market, name=name)
+
+
+def test_join_market_sets_player_token(client, db):
+    market = MarketFactory()
+    trader = join(client, market)
+
+    token = playertoken.get_token(client.get(reverse('market:home')).wsgi_request)
+    assert token == (trader.id, market.market_id, 0)
+    assert token.is_valid_for(trader)
+
+
+def test_play_page_does_not_use_sessions(client, db):
+    market = MarketFactory(round=1)
+    join(client, market)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('market:play', args=(market.market_id,)))
+    assert response.status_code == 200
+    assert not [query for query in queries if 'django_session' in query['sql']]
+
+
+def test_tampered_token_is_rejected(client, db):
+    trader = TraderFactory()
+    other = TraderFactory(market=trader.market)
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader).replace(
+        f"{trader.id}:", f"{other.id}:", 1)
+
+    response = client.get(reverse('market:play', args=(trader.market.market_id,)))
+    assert response['Location'] == reverse('market:home')
+    response = client.post(reverse('market:declare_bankruptcy', args=(other.id,)))
+    assert response['Location'] == reverse('market:home')
+    assert not Trader.objects.get(id=other.id).bankrupt
+
+
+def test_removing_trader_revokes_token(client, db):
+    market = MarketFactory(round=2)
+    trader = join(client, market)
+
+    Trader.objects.get(id=trader.id).remove()
+
+    assert Trader.objects.get(id=trader.id).token_version == 1
+    assertion = "You have been permanently removed"
+    assert assertion in client.get(reverse('market:play', args=(market.market_id,))).content.decode()
+    # Only the current token is valid, even if the trader is no longer marked as removed
+    Trader.objects.filter(id=trader.id).update(removed_from_market=False)
+    assert assertion in client.get(reverse('market:play', args=(market.market_id,))).content.decode()
+    response = client.post(reverse('market:declare_bankruptcy', args=(trader.id,)))
+    assert response['Location'] == reverse('market:home')
+    # The home page no longer says that the client has joined the market
+    assert "Du deltager allerede" not in client.get(reverse('market:home')).content.decode()
+
+
+def test_session_of_player_who_joined_before_tokens_is_replaced_by_token(client, db):
+    trader = TraderFactory()
+    session = client.session
+    session['trader_id'] = trader.id
+    session['market_id'] = trader.market.market_id
+    session['username'] = trader.name
+    session.save()
+
+    response = client.get(reverse('market:play', args=(trader.market.market_id,)))
+    assert response.status_code == 200
+    assert response.cookies[playertoken.COOKIE_NAME].value
+    token = playertoken.get_token(client.get(reverse('market:home')).wsgi_request)
+    assert token == (trader.id, trader.market.market_id, 0)
@@ -0,0 +1,106 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+import json
+import pstats
+import time
+
+from django.urls import reverse
+
+from ..profiling import StackSampler, stored_profiles
+from .factories import MarketFactory, TraderFactory, UserFactory
+
+
+def staff_client(client):
+    user = UserFactory(is_staff=True)
+    client.force_login(user)
+    return user
+
+
+def test_staff_user_can_profile_request(client, db, settings, tmp_path):
+    settings.PROFILE_DIR = tmp_path
+    user = staff_client(client)
+    market = MarketFactory(created_by=user)
+    TraderFactory(market=market)
+
+    response = client.get(reverse('market:monitor', args=(market.market_id,)), {'profile': '1'})
+    assert response.status_code == 200
+
+    profiles = stored_profiles()
+    assert len(profiles) == 1
+    profile = profiles[0]
+    assert profile['market_id'] == market.market_id
+    assert profile['view'] == 'market:monitor'
+    assert profile['name'].endswith(market.market_id)
+    assert profile['queries'] > 0
+
+    stats = pstats.Stats(str(tmp_path / f"{profile['name']}.prof"))
+    assert any(name == 'monitor' for _, _, name in stats.stats)
+    assert (tmp_path / f"{profile['name']}.collapsed").exists()
+    assert 'SELECT' in (tmp_path / f"{profile['name']}.sql").read_text()
+
+
+def test_profile_header(client, db, settings, tmp_path):
+    settings.PROFILE_DIR = tmp_path
+    staff_client(client)
+    client.get(reverse('market:home'), HTTP_X_PROFILE='1')
+    assert stored_profiles()[0]['market_id'] == ''
+
+
+def test_only_staff_users_can_profile(client, db, settings, tmp_path):
+    settings.PROFILE_DIR = tmp_path
+    client.get(reverse('market:home'), {'profile': '1'})
+    client.force_login(UserFactory())
+    client.get(reverse('market:home'), {'profile': '1'})
+    assert stored_profiles() == []
+
+
+def test_profiles_page(client, db, settings, tmp_path):
+    settings.PROFILE_DIR = tmp_path
+    user = UserFactory()
+    client.force_login(user)
+    assert client.get(reverse('profiles')).status_code == 302
+
+    user.is_staff = True
+    user.save()
+    market = MarketFactory(created_by=user)
+    client.get(reverse('market:monitor', args=(market.market_id,)), {'profile': '1'})
+    client.get(reverse('market:home'), {'profile': '1'})
+
+    response = client.get(reverse('profiles'))
+    assert response.status_code == 200
+    assert len(response.context['profiles']) == 2
+    response = client.get(reverse('profiles'), {'market_id': market.market_id.lower()})
+    assert len(response.context['profiles']) == 1
+
+    name = response.context['profiles'][0]['name']
+    response = client.get(reverse('profile_file', args=(name, 'json')))
+    assert response.status_code == 200
+    assert json.loads(b''.join(response.streaming_content))['name'] == name
+    assert client.get(reverse('profile_file', args=(name, 'py'))).status_code == 404
+    assert client.get(reverse('profile_file', args=('..-secret', 'json'))).status_code == 404
+
+
+def outer():
+    return inner()
+
+
+def inner():
+    start = time.perf_counter()
+    while time.perf_counter() - start < 0.05:
+        pass
+
+
+def test_stack_sampler():
+    with StackSampler() as sampler:
+        outer()
+    lines = sampler.collapsed().splitlines()
+    assert lines
+    stacks = [line.rsplit(' ', 1)[0].split(';') for line in lines]
+    assert any(stack[-2].startswith('outer (test_profiling.py') and stack[-1].startswith('inner (')
+               for stack in stacks if len(stack) > 1)
+    assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
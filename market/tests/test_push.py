@@ -0,0 +1,97 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+import asyncio
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Market
+from ..hosts import dashboard
+from ..push import DashboardWatcher, RoundWatcher, market_states
+from .factories import MarketFactory, TraderFactory, UnProcessedTradeFactory, UserFactory
+
+
+def test_market_states(db):
+    market = MarketFactory(round=3)
+    UnProcessedTradeFactory(trader=TraderFactory(market=market), round=3)
+    TraderFactory(market=market)
+    TraderFactory(market=market, bankrupt=True)
+
+    assert market_states([market.market_id, 'UNKNOWN']) == {
+        market.market_id: {'round': 3, 'game_over': False, 'num_ready': 1, 'num_active': 2}}
+
+
+def test_wait_for_round_answers_right_away_when_state_differs(client, db):
+    market = MarketFactory(round=3)
+    TraderFactory(market=market)
+    response = client.get(reverse('market:wait_for_round', args=(market.market_id,)), {'round': 2})
+    assert response.json() == {'round': 3, 'num_active_traders': 1, 'num_ready_traders': 0, 'game_over': False}
+
+
+def test_wait_for_round_404_when_market_does_not_exist(client, db):
+    assert client.get(reverse('market:wait_for_round', args=('BARMARKETID',))).status_code == 404
+
+
+def test_watcher_wakes_waiting_clients_when_round_changes(db):
+    market = MarketFactory(round=3)
+    state = market_states([market.market_id])[market.market_id]
+    watcher = RoundWatcher(interval=0.05)
+
+    async def finish_round_soon():
+        await asyncio.sleep(0.1)
+        await sync_to_async(Market.objects.filter(pk=market.pk).update)(round=4)
+
+    async def wait_and_finish():
+        result, _ = await asyncio.gather(watcher.wait(market.market_id, state, timeout=5), finish_round_soon())
+        return result
+
+    assert async_to_sync(wait_and_finish)()['round'] == 4
+    assert not watcher.waiters
+
+
+def test_watcher_returns_state_after_timeout(db):
+    market = MarketFactory(round=3)
+    state = market_states([market.market_id])[market.market_id]
+    watcher = RoundWatcher(interval=0.05)
+    assert async_to_sync(watcher.wait)(market.market_id, state, timeout=0.1) == state
+
+
+def test_watcher_makes_one_query_pr_check_for_all_waiting_clients(db):
+    markets = [MarketFactory() for _ in range(3)]
+    states = market_states([market.market_id for market in markets])
+    watcher = RoundWatcher(interval=0.1)
+
+    async def many_clients():
+        return await asyncio.gather(*[
+            watcher.wait(market.market_id, states[market.market_id], timeout=0.35)
+            for market in markets for _ in range(20)])
+
+    with CaptureQueriesContext(connection) as queries:
+        results = async_to_sync(many_clients)()
+    assert len(results) == 60
+    assert len(queries) <= 5
+
+
+def test_dashboard_watcher_wakes_host_when_a_market_changes(db):
+    host = UserFactory()
+    trader = TraderFactory(market=MarketFactory(created_by=host))
+    version = dashboard(host)['version']
+    watcher = DashboardWatcher(interval=0.05)
+
+    async def trade_soon():
+        await asyncio.sleep(0.1)
+        await sync_to_async(UnProcessedTradeFactory)(trader=trader, round=0)
+
+    async def wait_and_trade():
+        result, _ = await asyncio.gather(watcher.wait(host.id, version, timeout=5), trade_soon())
+        return result
+
+    assert async_to_sync(wait_and_trade)()['markets'][0]['num_ready'] == 1
+    assert not watcher.waiters
@@ -0,0 +1,76 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+import logging
+
+import pytest
+from django.urls import reverse
+
+from .. import playertoken, views
+from ..querybudget import QueryBudgetExceeded, QueryLog, budget_report
+from .factories import MarketFactory, TraderFactory, TradeFactory, UnProcessedTradeFactory
+
+
+def create_market_with_history(user, num_traders, num_rounds):
+    market = MarketFactory(created_by=user, round=num_rounds)
+    for i in range(num_traders):
+        trader = TraderFactory(market=market)
+        for round_num in range(num_rounds):
+            TradeFactory(trader=trader, round=round_num)
+        if i % 2:
+            UnProcessedTradeFactory(trader=trader, round=num_rounds)
+    return market
+
+
+@pytest.mark.parametrize('view_name', ['monitor', 'trader_table', 'current_round'])
+def test_host_views_stay_within_budget_for_large_markets(client, logged_in_user, view_name):
+    # The middleware raises QueryBudgetExceeded in the tests, if the view goes over budget
+    market = create_market_with_history(logged_in_user, 25, 4)
+    response = client.get(reverse(f'market:{view_name}', args=(market.market_id,)))
+    assert response.status_code == 200
+
+
+def test_play_view_stays_within_budget(client, db):
+    market = create_market_with_history(None, 25, 4)
+    trader = market.all_traders().first()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
+
+    assert client.get(reverse('market:play', args=(market.market_id,))).status_code == 200
+
+
+def test_view_over_budget_raises(client, logged_in_user, monkeypatch):
+    market = create_market_with_history(logged_in_user, 2, 1)
+    monkeypatch.setattr(views.trader_table, 'query_budget', 1)
+
+    with pytest.raises(QueryBudgetExceeded, match='market:trader_table made'):
+        client.get(reverse('market:trader_table', args=(market.market_id,)))
+
+
+def test_view_over_budget_is_logged_in_log_mode(client, logged_in_user, monkeypatch, settings, caplog):
+    settings.QUERY_BUDGET_MODE = 'log'
+    market = create_market_with_history(logged_in_user, 2, 1)
+    monkeypatch.setattr(views.trader_table, 'query_budget', 1)
+
+    with caplog.at_level(logging.WARNING, logger='market.querybudget'):
+        response = client.get(reverse('market:trader_table', args=(market.market_id,)))
+
+    assert response.status_code == 200
+    assert 'budget is 1' in caplog.text
+
+
+def test_budget_report_shows_repeated_queries():
+    query_log = QueryLog(record_sql=True)
+    for sql in ['SELECT a', 'SELECT b', 'SELECT b', 'SELECT b', 'SELECT c', 'SELECT c']:
+        query_log(lambda *args: None, sql, None, False, {})
+
+    report = budget_report('market:monitor', 4, query_log)
+
+    assert query_log.count == 6
+    assert 'market:monitor made 6 queries, but its budget is 4.' in report
+    assert '3 x SELECT b' in report
+    assert report.index('3 x SELECT b') < report.index('2 x SELECT c')
+    assert 'SELECT a' not in report
@@ -0,0 +1,132 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+import io
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.db import connection, connections
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import Market, RoundStat
+from ..partitions import add_months, month_start, partition_name, partitions
+from ..scheduler import Scheduler, due_markets, finish_due_round
+from .factories import MarketFactory, TraderFactory, UnProcessedTradeFactory
+
+
+def market_with_traders(num_ready, num_not_ready, **kwargs):
+    market = MarketFactory(round=0, **kwargs)
+    for _ in range(num_ready):
+        UnProcessedTradeFactory(trader=TraderFactory(market=market), round=0)
+    for _ in range(num_not_ready):
+        TraderFactory(market=market)
+    return market
+
+
+def test_auto_pilot_market_is_due_when_all_active_traders_are_ready(db):
+    ready = market_with_traders(2, 0, monitor_auto_pilot=True)
+    not_ready = market_with_traders(2, 1, monitor_auto_pilot=True)
+    TraderFactory(market=ready, bankrupt=True)
+    TraderFactory(market=ready, removed_from_market=True)
+    market_with_traders(2, 0, monitor_auto_pilot=False)
+    market_with_traders(0, 0, monitor_auto_pilot=True)
+    market_with_traders(2, 0, monitor_auto_pilot=True, game_over=True)
+    market_with_traders(2, 0, monitor_auto_pilot=True, deleted=True)
+
+    assert due_markets() == [(ready.market_id, 0)]
+    assert not_ready.market_id not in dict(due_markets())
+
+
+def test_market_is_due_when_deadline_has_passed_and_someone_has_traded(db):
+    market = market_with_traders(1, 2, round_deadline=60)
+    without_trades = market_with_traders(0, 2, round_deadline=60)
+    now = timezone.now()
+
+    assert due_markets(now) == []
+    assert due_markets(now + timedelta(seconds=61)) == [(market.market_id, 0)]
+    assert without_trades.market_id not in dict(due_markets(now + timedelta(seconds=61)))
+
+
+def test_due_markets_uses_one_query(db, django_assert_num_queries):
+    for _ in range(5):
+        market_with_traders(3, 1, monitor_auto_pilot=True, round_deadline=30)
+    with django_assert_num_queries(1):
+        assert len(due_markets(timezone.now() + timedelta(seconds=31))) == 5
+
+
+def test_tick_finishes_due_rounds_once(db):
+    market = market_with_traders(2, 0, monitor_auto_pilot=True)
+    scheduler = Scheduler(workers=1)
+
+    assert scheduler.tick() == [market.market_id]
+    market.refresh_from_db()
+    assert market.round == 1
+    assert RoundStat.objects.filter(market=market).count() == 1
+
+    # Nobody has traded in the new round
+    assert scheduler.tick() == []
+
+
+def test_finish_due_round_skips_rounds_finished_in_the_meantime(db):
+    market = market_with_traders(2, 0, monitor_auto_pilot=True)
+    Market.objects.filter(pk=market.pk).update(round=1)
+    assert not finish_due_round(market.market_id, 0)
+    assert not RoundStat.objects.filter(market=market).exists()
+
+
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="advisory locks are a PostgreSQL feature")
+def test_only_one_scheduler_is_leader(db):
+    scheduler = Scheduler(workers=1, lock_id=123)
+    assert scheduler.try_to_become_leader()
+    other_connection = connections.create_connection('default')
+    try:
+        with other_connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [123])
+            assert cursor.fetchone()[0] is False
+    finally:
+        other_connection.close()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [123])
+
+
+def test_scheduler_creates_coming_partitions_once_a_day(db, django_assert_num_queries):
+    dropped = partition_name('market_trade', add_months(month_start(timezone.localtime()), 3))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE {dropped}")
+    scheduler = Scheduler(workers=1)
+    scheduler.ensure_partitions()
+    assert dropped in [name for name, _, _ in partitions('market_trade')]
+    with django_assert_num_queries(0):
+        scheduler.ensure_partitions()
+
+
+def test_run_scheduler_command_once(db):
+    market = market_with_traders(1, 0, monitor_auto_pilot=True)
+    out = io.StringIO()
+    call_command('run_scheduler', once=True, workers=1, stdout=out)
+    assert "Finished 1 rounds" in out.getvalue()
+    market.refresh_from_db()
+    assert market.round == 1
+
+
+def test_monitor_reloads_when_round_was_finished_by_scheduler(client, logged_in_user, settings):
+    market = market_with_traders(1, 0, monitor_auto_pilot=True, created_by=logged_in_user)
+    url = reverse('market:trader_table', args=(market.market_id,))
+    settings.ROUND_SCHEDULER = 0
+    assert b'next_round()\n' in client.get(url, {'round': '0'}).content
+
+    settings.ROUND_SCHEDULER = 1
+    response = client.get(url, {'round': '0'})
+    assert b'window.location.reload()' not in response.content
+    # The scheduler finishes the round, not the browser
+    assert b'next_round()\n' not in response.content
+
+    Market.objects.filter(pk=market.pk).update(round=1)
+    response = client.get(url, {'round': '0'})
+    assert b'window.location.reload()' in response.content
@@ -0,0 +1,84 @@
+"""
+To run all tests:
+$ make test
+
+To run only one or some tests:
+docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
+"""
+import random
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.db.models import Sum, Count
+
+from ..engine import finish_round, round_statistics
+from ..models import Market, Trader, Trade, RoundStat
+from ..synthetic import create_users, generate_markets
+
+EXTENDED_STAT_FIELDS = ['median_price', 'min_price', 'max_price', 'price_stddev', 'units_produced', 'units_sold',
+                        'total_profit', 'hhi']
+
+
+def test_generate_markets_creates_consistent_markets(db):
+    users = create_users(3)
+    totals = generate_markets(users, 4, random.Random(1), min_traders=5, max_traders=12, num_rounds=6,
+                              endless_share=0.5)
+
+    assert totals['markets'] == Market.objects.count() == 4
+    assert totals['traders'] == Trader.objects.count()
+    assert totals['trades'] == Trade.objects.count()
+    assert totals['round_stats'] == RoundStat.objects.count()
+    for market in Market.objects.all():
+        assert RoundStat.objects.filter(market=market).count() == market.round
+        for trader in Trader.objects.filter(market=market).annotate(
+                total_profit=Sum('trade__profit'), num_trades=Count('trade')):
+            assert trader.num_trades == market.round
+            assert trader.balance == market.initial_balance + (trader.total_profit or 0)
+
+
+def test_generated_round_stats_match_the_trades(db):
+    generate_markets(create_users(1), 2, random.Random(3), min_traders=6, max_traders=15, num_rounds=4)
+    for round_stat in RoundStat.objects.all():
+        expected = round_statistics(round_stat.market, round_stat.round)
+        assert all(getattr(round_stat, field) is not None for field in EXTENDED_STAT_FIELDS)
+        # The median is computed as a float in the database, so its last cent may be rounded differently
+        assert abs(round_stat.median_price - expected.pop('median_price')) <= Decimal('0.01')
+        assert {field: getattr(round_stat, field) for field in EXTENDED_STAT_FIELDS[1:]} == \
+            {field: expected[field] for field in EXTENDED_STAT_FIELDS[1:]}
+
+
+def test_generated_round_stats_store_the_ranking(db):
+    generate_markets(create_users(1), 1, random.Random(4), min_traders=5, max_traders=10, num_rounds=3,
+                     endless_share=1)
+    market = Market.objects.get()
+    rankings = list(RoundStat.objects.filter(market=market).order_by('round').values_list('ranking', flat=True))
+    assert all(entry['rank_change'] is None for entry in rankings[0])
+    assert [(entry['id'], Decimal(entry['balance'])) for entry in rankings[-1]] == \
+        list(market.active_or_bankrupt_traders().order_by('-balance', 'id').values_list('id', 'balance'))
+    ranking = market.ranking()
+    assert all(entry['rank_change'] is not None for entry in ranking)
+    assert sum(entry['rank_change'] for entry in ranking) == 0
+
+
+def test_generated_markets_can_be_played_further(db):
+    generate_markets(create_users(1), 1, random.Random(2), min_traders=5, max_traders=5, num_rounds=3,
+                     endless_share=1)
+    market = Market.objects.get()
+    for trader in market.active_traders():
+        Trade.objects.create(trader=trader, round=market.round, unit_price=trader.prod_cost,
+                             unit_amount=1, balance_before=trader.balance, prod_cost=trader.prod_cost)
+
+    finish_round(market)
+
+    assert RoundStat.objects.filter(market=market).count() == 4
+
+
+def test_setup_test_data_is_deterministic(db):
+    def generate():
+        call_command('setup_test_data', users=2, markets=3, min_traders=5, max_traders=10, seed=7)
+        trades = list(Trade.objects.order_by('trader__market__market_id', 'trader__name', 'round').values_list(
+            'trader__market__market_id', 'trader__name', 'round', 'unit_price', 'unit_amount', 'balance_after'))
+        Market.objects.all().delete()
+        return trades
+
+    assert generate() == generate()
@@ -8,9 +8,14 @@ $ make test_views
 To run only one or some tests:
 docker-compose -f docker-compose.dev.yml run web pytest -k <substring of test function names to run>
 """
+import json
+from datetime import timedelta
+from urllib.parse import urlencode
 from django.test import TestCase
 from django.urls import reverse
-from ..models import Market, Trader, Trade, RoundStat, UnusedCosts
+from django.utils import timezone
+from .. import hosts, playertoken
+from ..models import Market, MarketArchive, Trader, Trade, RoundStat, UnusedCosts
 from ..forms import TraderForm
 from decimal import Decimal
 from .factories import TradeFactory, UnProcessedTradeFactory, ForcedTradeFactory, TraderFactory, UserFactory, MarketFactory
@@ -52,13 +57,8 @@ def test_home_view_name_and_template(client):
 
 def test_home_view_notify_users_who_have_already_joined_a_market(client, db):
     market = MarketFactory()
-    trader = TraderFactory()
-
-    session = client.session
-    session['trader_id'] = trader.id
-    session['market_id'] = market.market_id
-    session['username'] = 'Alberte'
-    session.save()
+    trader = TraderFactory(market=market, name='Alberte')
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
 
     response = client.get(reverse('market:home'))
 
@@ -73,7 +73,7 @@ def test_join_market_view_proper_behavior_when_no_market_id_in_form(db, client):
     response = client.post(reverse('market:join_market'), {
         'username': 'Helle', 'market_id': ''})
     assert response.status_code == 200
-    assert 'trader_id' not in client.session
+    assert playertoken.COOKIE_NAME not in client.cookies
     assertContains(response, "This field is required.")
     assert Trader.objects.all().count() == 0
 
@@ -82,7 +82,7 @@ def test_join_market_view_proper_behavior_when_no_username_in_form(db, client):
     response = client.post(reverse('market:join_market'), {
         'name': '', 'market_id': 'SOME_MARKET_ID'})
     assert response.status_code == 200
-    assert not ('trader_id' in client.session)
+    assert playertoken.COOKIE_NAME not in client.cookies
     assertContains(response, "This field is required.")
     assert Trader.objects.all().count() == 0
 
@@ -92,7 +92,7 @@ def test_join_market_view_proper_behavior_when_no_market_with_posted_market_id(d
     response = client.post(reverse('market:join_market'), {
         'name': 'Hanne', 'market_id': market_id_with_no_referent})
     assert (response.status_code == 200)
-    assert not ('trader_id' in client.session)
+    assert playertoken.COOKIE_NAME not in client.cookies
     assertContains(
         response, 'Der er intet marked med dette ID')
     assert (Trader.objects.all().count() == 0)
@@ -105,7 +105,7 @@ def test_join_market_view_proper_behaviour_and_nice_feedback_message_when_userna
     response = client.post(reverse('market:join_market'), {
         'name': 'jonna', 'market_id': market.market_id})
     assert (response.status_code == 200)
-    assert not ('trader_id' in client.session)
+    assert playertoken.COOKIE_NAME not in client.cookies
     assertContains(
         response, 'Der er allerede en producent med dette navn')
     assert (Trader.objects.all().count() == 1)
@@ -119,7 +119,7 @@ def test_join_market_view_new_trader_created_when_form_is_valid(db, client):
     new_trader = Trader.objects.first()
     assert (new_trader.market == market)
     assert (new_trader.balance == market.initial_balance)
-    assert ('trader_id' in client.session)
+    assert (playertoken.COOKIE_NAME in client.cookies)
     assert (response.status_code == 302)
     assert (response['Location'] == reverse(
         'market:play', args=(market.market_id,)))
@@ -373,6 +373,21 @@ def test_monitor_view_market_is_in_context(client, db, logged_in_user):
     assert response.context['market'].round == 0
 
 
+def test_monitor_view_shows_equilibrium_benchmarks(client, db, logged_in_user):
+    market = MarketFactory(created_by=logged_in_user, round=1)
+    TraderFactory(market=market)
+    RoundStat.objects.create(market=market, round=0, avg_price=10, avg_balance_after=5000, avg_amount=20,
+                             eq_price=Decimal('11.30'), eq_amount=Decimal('71.10'))
+    response = client.get(
+        reverse('market:monitor', args=(market.market_id,)))
+    prices = json.loads(response.context['priceDataSet'])
+    amounts = json.loads(response.context['amountDataSet'])
+    # one value for the finished round and one for the current round
+    assert prices[-1]['label'] == 'Equilibrium'
+    assert prices[-1]['data'] == [11.30, float(market.eq_price)]
+    assert amounts[-1]['data'] == [71.10, float(market.eq_amount)]
+
+
 def test_monitor_view_bad_market_id_raises_404(client, db, logged_in_user):
     market = MarketFactory()
     response = client.get(
@@ -382,7 +397,7 @@ def test_monitor_view_bad_market_id_raises_404(client, db, logged_in_user):
 
 # Test PlayViewGetRequest
 
-def test_player_view_get_no_trader_id_in_session_redirects_to_home(client):
+def test_player_view_get_no_player_token_redirects_to_home(client):
     # some client who has not joined tries to access the wait page
     response = client.get(reverse('market:play', args=('SOMEMARKETD',)))
 
@@ -397,10 +412,7 @@ def test_player_view_get_if_no_errors_and_time_to_wait_return_play_template_with
 
     # a user has joined properly
     trader = TraderFactory(market=market)
-    session = client.session
-    session['trader_id'] = trader.pk
-    session['username'] = 'Hans'
-    session.save()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
 
     # the user has made a trade in this round (and should now be waiting)
     TradeFactory(trader=trader, round=0)
@@ -433,10 +445,7 @@ def test_player_view_get_proper_behavior_in_round_4_when_user_has_made_trade_in_
 
     # a user has joined properly
     trader = TraderFactory(market=market)
-    session = client.session
-    session['trader_id'] = trader.pk
-    session['username'] = 'Hans'
-    session.save()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
 
     # the user has made a trade in_last_round
     TradeFactory(trader=trader, round=3, unit_price=Decimal('134.98'))
@@ -468,10 +477,7 @@ def test_player_view_get_proper_behavior_in_round_4_when_user_has_made_trade_in_
 
     # a user has joined properly
     trader = TraderFactory(market=market)
-    session = client.session
-    session['trader_id'] = trader.pk
-    session['username'] = 'Hans'
-    session.save()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
 
     # the user has made a trade in round 2
     TradeFactory(trader=trader, round=2)
@@ -504,10 +510,7 @@ def test_player_view_get_form_attributes_are_set_correctly(client, db):
 
     # a user has joined properly
     trader = TraderFactory(market=market, balance=101, prod_cost=2)
-    session = client.session
-    session['trader_id'] = trader.pk
-    session['username'] = 'Hans'
-    session.save()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
 
     # user made a real trade in round 3(last round)
     TradeFactory(trader=trader, round=3, unit_price=4, unit_amount=12)
@@ -535,10 +538,7 @@ def test_player_view_get_game_over_when_rounds_equal_max_round(client, db):
 
     # a user has joined properly
     trader = TraderFactory(market=market, balance=101, prod_cost=2)
-    session = client.session
-    session['trader_id'] = trader.pk
-    session['username'] = 'Hans'
-    session.save()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
 
     # user goes to play url
     response = client.get(reverse('market:play', args=(market.market_id,)))
@@ -567,9 +567,7 @@ def test_player_view_post_market_id_not_found_redirects_to_home(client):
 def test_player_view_post_test_if_all_data_is_good_then_save_trade_and_redirect_to_play(client, db):
     trader = TraderFactory()
 
-    session = client.session
-    session['trader_id'] = trader.pk
-    session.save()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
 
     # the client sends in a trade form with valid data
     response = client.post(
@@ -586,6 +584,7 @@ def test_player_view_post_test_if_all_data_is_good_then_save_trade_and_redirect_
     assert (trade.profit is None)
     assert (trade.balance_after is None)
     assert (trade.balance_before == TraderFactory.balance)
+    assert trade.decision_seconds >= 0
 
     # after a successful post request, we should redirect to play
     assert (response.status_code == 302)
@@ -597,9 +596,7 @@ def test_player_view_post_test_if_all_data_is_good_then_save_trade_and_redirect_
 def test_player_view_post_error_message_to_user_when_invalid_form(client, db):
     trader = TraderFactory()
 
-    session = client.session
-    session['trader_id'] = trader.pk
-    session.save()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
 
     # the client sends in a trade form with invalid data (unit price is blank)
     response = client.post(
@@ -689,6 +686,71 @@ def test_mymarkets_view_user_has_created_a_market(client, logged_in_user):
     assertContains(response, market.market_id)
 
 
+def test_mymarkets_view_pages_through_markets_newest_first(client, logged_in_user, monkeypatch):
+    monkeypatch.setattr(hosts, 'PAGE_SIZE', 2)
+    markets = [MarketFactory(created_by=logged_in_user) for _ in range(5)]
+    now = timezone.now()
+    for i, market in enumerate(markets):
+        # Two markets created at the same time are ordered by market_id
+        Market.objects.filter(pk=market.pk).update(created_at=now - timedelta(days=min(i, 3)))
+    newest_first = markets[:3] + sorted(markets[3:], key=lambda market: market.market_id, reverse=True)
+
+    shown = []
+    url = reverse('market:my_markets')
+    while url:
+        response = client.get(url)
+        shown += [market.market_id for market in response.context['markets']]
+        next_page = response.context['next_page']
+        url = f"{reverse('market:my_markets')}?{urlencode({'after': next_page})}" if next_page else None
+    assert shown == [market.market_id for market in newest_first]
+
+
+def test_mymarkets_view_shows_traders_and_activity_with_constant_queries(client, logged_in_user):
+    markets = [MarketFactory(created_by=logged_in_user) for _ in range(10)]
+    for market in markets:
+        for _ in range(3):
+            TraderFactory(market=market)
+    archived = MarketFactory(created_by=logged_in_user, archived=True)
+    MarketArchive.objects.create(market=archived, data=b'', num_traders=7, num_trades=0)
+
+    # The view has a query budget, which doesn't grow with the number of markets (see querybudget.py)
+    response = client.get(reverse('market:my_markets'))
+    num_traders = {market.market_id: market.num_traders for market in response.context['markets']}
+    assert num_traders == {**{market.market_id: 3 for market in markets}, archived.market_id: 7}
+    assert all(market.last_activity for market in response.context['markets'])
+
+
+def test_dashboard_shows_live_markets_of_user(client, logged_in_user):
+    market = MarketFactory(created_by=logged_in_user)
+    over = MarketFactory(created_by=logged_in_user, game_over=True)
+    other = MarketFactory()
+    response = client.get(reverse('market:dashboard'))
+    assertContains(response, market.market_id)
+    assertNotContains(response, over.market_id)
+    assertNotContains(response, other.market_id)
+
+
+def test_wait_for_dashboard_answers_right_away_when_version_differs(client, logged_in_user):
+    market = MarketFactory(created_by=logged_in_user)
+    response = client.get(reverse('market:wait_for_dashboard'), {'version': 'old'})
+    assertContains(response, market.market_id)
+    assert response.context['dashboard']['version'] != 'old'
+
+
+def test_wait_for_dashboard_renders_table_once_pr_version(client, logged_in_user):
+    market = MarketFactory(created_by=logged_in_user)
+    first = client.get(reverse('market:wait_for_dashboard'), {'version': 'old'})
+    second = client.get(reverse('market:wait_for_dashboard'), {'version': 'old'})
+    assert second.templates == []
+    assert second.content == first.content
+    assertContains(second, market.market_id)
+
+
+def test_wait_for_dashboard_login_required(client, db):
+    response = client.get(reverse('market:wait_for_dashboard'))
+    assert response.status_code == 302
+
+
 def test_mymarket_gets_deleted_on_post_request(client, logged_in_user):
     """ Market with given ID gets 'deleted' on post request """
     market = MarketFactory(created_by=logged_in_user)
@@ -870,9 +932,7 @@ def test_remove_trader_from_market_in_round_0(client, logged_in_user):
 def test_declare_bankruptcy(client, db):
     """ Testing declare bankruptcy functionality """
     trader = TraderFactory()
-    session = client.session
-    session['trader_id'] = trader.id
-    session.save()
+    client.cookies[playertoken.COOKIE_NAME] = playertoken.cookie_value(trader)
 
     assert not trader.bankrupt
 
@@ -952,6 +1012,19 @@ def test_finish_round_view_production_cost_cannot_get_negative(client, db, logge
 
 
 
+def test_finish_round_view_redirects_when_round_can_not_be_finished(client, logged_in_user):
+    """ A round without trades (or finished by the scheduler in the meantime) is not finished """
+    market = MarketFactory(created_by=logged_in_user)
+    TraderFactory(market=market)
+
+    response = client.post(reverse('market:finish_round', args=(market.market_id,)), follow=True)
+
+    assert response.redirect_chain[0] == (reverse('market:monitor', args=(market.market_id,)), 302)
+    assert "Runden blev ikke afsluttet" in response.content.decode()
+    market.refresh_from_db()
+    assert market.round == 0
+
+
 def test_finish_round_view_404_when_market_does_not_exists(client, logged_in_user):
     """ If market with given id does not exist, return 404 page """
     url = reverse('market:finish_round', args=('BADMARKETID',))
@@ -1052,6 +1125,43 @@ def test_finish_round_view_created_forced_moves_for_inactive_player(client, logg
     assert (market.round == 8)
 
 
+def test_finish_round_view_stores_equilibrium_of_the_round(client, logged_in_user):
+    market = MarketFactory(created_by=logged_in_user, cost_slope=Decimal('2.00'))
+    eq_price = market.eq_price
+    UnProcessedTradeFactory(trader=TraderFactory(market=market), round=0)
+
+    client.post(reverse('market:finish_round', args=(market.market_id,)))
+
+    # The round is stored with the equilibrium it was played with ...
+    assert RoundStat.objects.get(market=market, round=0).eq_price == eq_price
+    # ... while the market has a new equilibrium as costs have moved
+    market.refresh_from_db()
+    assert market.eq_price > eq_price
+
+
+def test_fast_forward_view_plays_rounds_and_reports_timing(client, logged_in_user):
+    market = MarketFactory(created_by=logged_in_user, endless=True)
+    TraderFactory(market=market, auto_play=True, balance=Decimal('5000.00'))
+    TraderFactory(market=market)
+
+    response = client.post(
+        reverse('market:fast_forward', args=(market.market_id,)), {'rounds': 4}, follow=True)
+
+    market.refresh_from_db()
+    assert market.round == 4
+    assertContains(response, "Spolede 4 runder frem")
+
+
+def test_fast_forward_view_user_has_no_access_to_other_users_market(client, logged_in_user):
+    market = MarketFactory()
+    TraderFactory(market=market, auto_play=True)
+    response = client.post(
+        reverse('market:fast_forward', args=(market.market_id,)), {'rounds': 4})
+    assert response.status_code == 302
+    market.refresh_from_db()
+    assert market.round == 0
+
+
 class FinishRoundViewMultipleUserTest(TestCase):
 
     @classmethod
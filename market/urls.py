@@ -16,7 +16,10 @@ urlpatterns = [
     path('<market_id>/monitor/', views.monitor, name='monitor'),
     path('<market_id>/market-edit/', views.market_edit, name='market_edit'),
     path('my_markets/', views.my_markets, name='my_markets'),
+    path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/wait_for_dashboard/', views.wait_for_dashboard, name='wait_for_dashboard'),
     path('<market_id>/finish_round', views.finish_round, name='finish_round'),
+    path('<market_id>/fast_forward', views.fast_forward, name='fast_forward'),
     path('<market_id>/toggle_monitor_auto_pilot_setting/',
          views.toggle_monitor_auto_pilot_setting, name='toggle_monitor_auto_pilot_setting'),
     path('<market_id>/set_game_over',
@@ -27,4 +30,6 @@ urlpatterns = [
          views.trader_table, name='trader_table'),
     path('<market_id>/current_round/',
           views.current_round, name='current_round'),
+    path('<market_id>/wait_for_round/',
+         views.wait_for_round, name='wait_for_round'),
 ]
@@ -1,17 +1,27 @@
 from math import floor
 import json
+from django.core.cache import cache
+from django.db import transaction
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect, JsonResponse
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.views.decorators.http import require_GET, require_POST
 from django.http import HttpResponse
-from .models import Market, Trader, Trade, RoundStat, UnusedCosts
+from .models import Market, Trader, UnusedCosts
 from .forms import MarketForm, MarketUpdateForm, TraderForm, TradeForm
-from .helpers import create_forced_trade, process_trade, generate_balance_list, add_graph_context_for_monitor_page, generate_prod_cost_list
+from .helpers import create_forced_trade, generate_balance_list, add_graph_context_for_monitor_page, generate_prod_cost_list, add_context_for_trader_table
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 import json
 from .scenarios import SCENARIOS
+from . import archive, engine, hosts, playertoken
+from .dbrouter import replica_reads
+from .metrics import record_cache
+from .querybudget import query_budget
+from .push import DashboardWatcher, get_watcher, market_states
 
 @login_required
 def market_edit(request, market_id):
@@ -22,13 +32,18 @@ def market_edit(request, market_id):
         return HttpResponseRedirect(reverse('market:home'))
 
     if request.method == 'POST':
-        form = MarketUpdateForm(request.POST, instance=market)
-        if form.is_valid():
-            form.save()
-            messages.success(
-                request, "Du opdaterede markedet."
-            )
-            return HttpResponseRedirect(reverse('market:monitor', args=(market.market_id,)))
+        with transaction.atomic():
+            # The market is locked and only the changed fields are written, so a round settled at the same
+            # time (e.g. by the scheduler) is not rolled back
+            market = Market.objects.select_for_update().get(pk=market.pk)
+            form = MarketUpdateForm(request.POST, instance=market)
+            if form.is_valid():
+                form.save(commit=False)
+                market.save(update_fields=form.changed_data + Market.EQUILIBRIUM_FIELDS)
+                messages.success(
+                    request, "Du opdaterede markedet."
+                )
+                return HttpResponseRedirect(reverse('market:monitor', args=(market.market_id,)))
 
     else:  # request.method = 'GET'
         form = MarketUpdateForm(instance=market)
@@ -46,39 +61,62 @@ def robot_logs(request):
  
 
 
-@require_GET
-@login_required
-def trader_table(request, market_id):
+# trader_table, current_round and wait_for_round are polled by all open monitor and play pages. They are
+# async views served by the ASGI workers (see docs/deployment.md), so waiting requests don't hold a worker.
+# The decorators require_GET and login_required don't support async views in Django 3.2, so the checks
+# are made in the views.
+
+# The budget covers a poll after the ranking has changed (see Market.ranking); the other polls only
+# query the ready flags of the round
+@query_budget(7)
+@replica_reads
+async def trader_table(request, market_id):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    return await sync_to_async(render_trader_table)(request, market_id)
+
+
+def render_trader_table(request, market_id):
+    if not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
     market = get_object_or_404(Market, market_id=market_id)
 
     # If user is not the creator of the market, redirect to home page
     if not request.user == market.created_by:
         return HttpResponseRedirect(reverse('market:home'))
 
-    return render(request, 'market/trader-table.html', {'market': market})
+    if market.archived:
+        context = archive.add_archived_monitor_context({'market': market})
+    else:
+        context = add_context_for_trader_table({'market': market})
+    # The round shown on the monitor page. If the round has been finished since, the page is reloaded.
+    context['shown_round'] = request.GET.get('round')
+    return render(request, 'market/trader-table.html', context)
 
 
 def add_context_for_join_form(context, request):
     """ Helper function used by view functions below """
+    token = playertoken.get_token(request)
 
     # If the client has already joined a market
-    if 'trader_id' in request.session:
+    if token is not None:
+        trader = Trader.objects.select_related('market').filter(id=token.trader_id).first()
 
         # If trader is in database
-        if Trader.objects.filter(id=request.session['trader_id']).exists():
-            trader = Trader.objects.get(id=request.session['trader_id'])
+        if trader is not None:
+            context['player'] = trader
             # If trader has been removed from market
-            if trader.removed_from_market:
-                request.session['removed_from_market'] = True
+            context['player_removed'] = trader.removed_from_market or not token.is_valid_for(trader)
+            market = trader.market
 
         # If trader has been deleted from database
         else:
-            request.session['removed_from_market'] = True
+            context['player_removed'] = True
+            market = Market.objects.filter(market_id=token.market_id).first()
 
         # We add this market to the context to notify the client
-        market = get_object_or_404(
-            Market, market_id=request.session['market_id'])
-        context['market'] = market
+        if market is not None:
+            context['market'] = market
     return context
 
 
@@ -96,18 +134,16 @@ def join_market(request):
         new_trader.round_joined = market.round
         new_trader.save()
 
-        request.session['trader_id'] = new_trader.pk
-        request.session['username'] = form.cleaned_data['name']
-        request.session['market_id'] = form.cleaned_data['market_id']
-
         # If player joins a game in round n>0, create 'forced trades' for round 0,1,..,n-1
         if market.round > 0:
             for round_num in range(market.round):
                 create_forced_trade(
                     trader=new_trader, round_num=round_num, is_new_trader=True)
 
-        # After joining the market, the player is redirected to the play page
-        return redirect(reverse('market:play', args=(market.market_id,)))
+        # After joining the market, the player is redirected to the play page. The player is
+        # recognized by the token in the cookie (see playertoken.py).
+        response = redirect(reverse('market:play', args=(market.market_id,)))
+        return playertoken.set_player_cookie(response, new_trader)
 
     context = add_context_for_join_form({'form': form}, request)
     return render(request, 'market/home.html', context)
@@ -130,6 +166,7 @@ def home(request):
     return render(request, 'market/home.html', context)
 
 
+@query_budget(4)
 @login_required
 def my_markets(request):
 
@@ -137,13 +174,53 @@ def my_markets(request):
         delete_market_id = request.POST['delete_market_id']
         market = get_object_or_404(Market, market_id=delete_market_id)
         market.deleted = True
-        market.save()
+        market.save(update_fields=['deleted'])
         return HttpResponseRedirect(reverse('market:my_markets'))
 
-    markets = Market.objects.filter(
-        created_by=request.user, deleted=False).order_by('-created_at')
+    # The markets are shown page by page (see hosts.py)
+    markets, next_cursor = hosts.page_of_markets(request.user, hosts.parse_cursor(request.GET.get('after')))
+    context = {
+        'markets': markets,
+        'next_page': hosts.format_cursor(next_cursor) if next_cursor else None,
+        'first_page': 'after' in request.GET,
+    }
+    return render(request, 'market/my_markets.html', context)
+
 
-    return render(request, 'market/my_markets.html', {'markets': markets})
+@query_budget(4)
+@replica_reads
+@login_required
+@require_GET
+def dashboard(request):
+    """ The live markets of the host on one page (see hosts.py; the dashboard is cached for a few seconds) """
+    return render(request, 'market/dashboard.html', {'dashboard': hosts.dashboard(request.user)})
+
+
+# No query budget: the watcher makes a query pr. second while the request waits
+@replica_reads
+async def wait_for_dashboard(request):
+    """
+    Long polling: answers with the dashboard of the host when it differs from the version given in the
+    query string, or after push.WAIT_TIMEOUT seconds
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    user_id = await sync_to_async(_authenticated_user_id)(request)
+    if user_id is None:
+        return redirect_to_login(request.get_full_path())
+    dashboard = await get_watcher(DashboardWatcher).wait(user_id, request.GET.get('version'))
+    # The open dashboards of a host wait for the same versions, so the table is rendered once pr. version
+    key = f"dashboard-table:{user_id}:{dashboard['version']}"
+    table = cache.get(key)
+    record_cache('dashboard-table', table is not None)
+    if table is None:
+        table = await sync_to_async(render_to_string)('market/dashboard-table.html', {'dashboard': dashboard})
+        cache.set(key, table, hosts.DASHBOARD_TIMEOUT)
+    return HttpResponse(table)
+
+
+def _authenticated_user_id(request):
+    return request.user.id if request.user.is_authenticated else None
 
 
 @login_required
@@ -231,7 +308,7 @@ def toggle_monitor_auto_pilot_setting(request, market_id):
         return HttpResponseRedirect(reverse('market:home'))
 
     market.monitor_auto_pilot = not market.monitor_auto_pilot
-    market.save()
+    market.save(update_fields=['monitor_auto_pilot'])
     return redirect(reverse('market:monitor', args=(market.market_id,)))
 
 
@@ -245,7 +322,7 @@ def set_game_over(request, market_id):
         return HttpResponseRedirect(reverse('market:home'))
 
     market.game_over = True
-    market.save()
+    market.save(update_fields=['game_over'])
 
     return redirect(reverse('market:monitor', args=(market.market_id,)))
 
@@ -259,74 +336,45 @@ def finish_round(request, market_id):
     if not request.user == market.created_by:
         return HttpResponseRedirect(reverse('market:home'))
 
-    # Query the trade decisions made by the traders in the current round
-    valid_trades = market.valid_trades_this_round()
-
-    # Let's assert that there is at leat 1 valid trade. Otherwise we will get a zero division error,
-    # when calculating the avg. price below.
-    assert(len(valid_trades) >
-           0), "No trades in market this round. Can't calculate avg. price."
-
-    # Calculate the average price (will be used to calculate the demand for each traders good)
-    avg_price = sum(
-        [trade.unit_price for trade in valid_trades]) / len(valid_trades)
-
-    # Process each of the valid trades
-    for trade in valid_trades:
-        process_trade(
-            market, trade, avg_price)
-
-    # Create 'forced trades' for all traders who did not make a trade in time
-    for trader in market.all_traders():
-        if not trader.is_ready():
-            create_forced_trade(
-                trader=trader, round_num=market.round, is_new_trader=False)
-
-    # Let's assert that at this point, there is exactly one trade pr trader in the current round
-    assert(len(market.all_trades_this_round()) == len(market.all_traders())
-           ), f"Number of trades in this round does not equal num traders ."
-
-    # Save data for charts
-    round_stat = RoundStat.objects.create(
-        market=market, round=market.round, avg_price=avg_price)
-
-    active_or_bankrupt_traders = market.active_or_bankrupt_traders()
-
-    round_stat.avg_balance_after = sum(
-        [trader.balance for trader in active_or_bankrupt_traders])/len(active_or_bankrupt_traders)
+    if engine.finish_round(market) is None:
+        messages.warning(
+            request, "Runden blev ikke afsluttet, da den allerede er afsluttet, eller ingen spillere har handlet i den.")
 
-    round_stat.avg_amount = sum(
-        [trade.unit_amount for trade in valid_trades]) / len(valid_trades)
-
-    round_stat.save()
-    
-    # SHOULD only be per round ...
-    for trader in market.all_traders():
-        new_cost = trader.prod_cost + market.cost_slope
-        if new_cost > 0:
-            trader.prod_cost = new_cost
-            trader.save()
-
-    # Update total production cost change
-    market.accum_cost_change += market.cost_slope
-
-    # Update market round
-    market.round += 1
+    return redirect(reverse('market:monitor', args=(market.market_id,)))
 
-    # Check game over
-    if market.check_game_over():
-        market.game_over = True
 
-    # we should probably reset cost_slope to prevent it from accumulating, no?
-    market.cost_slope = 0
+@require_POST
+@login_required
+def fast_forward(request, market_id):
+    market = get_object_or_404(Market, market_id=market_id)
 
-    market.save()
+    # If user is not the creator of the market, redirect to home page
+    if not request.user == market.created_by:
+        return HttpResponseRedirect(reverse('market:home'))
 
-    
+    try:
+        num_rounds = int(request.POST.get('rounds', 1))
+    except ValueError:
+        num_rounds = 1
+    num_rounds = max(1, min(num_rounds, engine.MAX_FAST_FORWARD_ROUNDS))
+
+    report = engine.fast_forward(market, num_rounds)
+
+    if report:
+        total_time = sum(result['seconds'] for result in report)
+        round_times = ", ".join(
+            f"{result['round'] + 1}: {result['seconds'] * 1000:.0f} ms" for result in report)
+        messages.success(
+            request, f"Spolede {len(report)} runder frem på {total_time:.2f} sek. (tid pr. runde: {round_times})")
+    else:
+        messages.warning(
+            request, "Ingen runder blev afsluttet, da ingen spillere har handlet i den aktuelle runde.")
 
     return redirect(reverse('market:monitor', args=(market.market_id,)))
 
 
+@query_budget(10)
+@replica_reads
 @require_GET
 def monitor(request, market_id):
     market = get_object_or_404(Market, market_id=market_id)
@@ -341,8 +389,12 @@ def monitor(request, market_id):
         'show_stats_fields': ['balance_before', 'unit_price', 'profit', 'unit_amount', 'demand', 'units_sold'],
     }
 
-    # Add context for graphs
-    context = add_graph_context_for_monitor_page(context)
+    # Add context for graphs and the trader table
+    if market.archived:
+        context = archive.add_archived_monitor_context(context)
+    else:
+        context = add_graph_context_for_monitor_page(context)
+        context = add_context_for_trader_table(context)
 
     return render(request, 'market/monitor.html', context)
 
@@ -350,32 +402,41 @@ def monitor(request, market_id):
 @require_POST
 def declare_bankruptcy(request, trader_id):
     trader = get_object_or_404(Trader, id=trader_id)
+    token = playertoken.get_token(request)
 
     # Only trader himself can declare himself bankrupt
-    if not request.session['trader_id'] == int(trader_id):
+    if token is None or not token.is_valid_for(trader):
         return HttpResponseRedirect(reverse('market:home'))
 
     trader.bankrupt = True
+    trader.round_bankrupt = trader.market.round
     trader.save()
+    # The ranking shows who is bankrupt
+    trader.market.update_balance_totals()
 
     return redirect(reverse('market:play', args=(trader.market.market_id,)))
 
 
+@query_budget(6)
+@replica_reads
 def play(request, market_id):
     # The market_id is not used in the function. But we need is as a parameter because we want it in the url on the player page.
+    token = playertoken.get_token(request)
     try:
-        trader = Trader.objects.get(id=request.session['trader_id'])
+        trader = Trader.objects.select_related('market').get(id=token.trader_id)
     except:
-        # if not trader in session return to home:
+        # if the client has no player token (or the trader has been deleted) return to home:
         return redirect(reverse('market:home'))
     else:
-        if trader.removed_from_market:
+        if trader.removed_from_market or not token.is_valid_for(trader):
             return HttpResponse(
                 f"<br>You have been permanently removed from the market {market_id} by the market host. <br><br>You can rejoin the market with a new name.<br><br>Please contact the market host if you have any questions.")
 
         market = trader.market
-        round_stats = RoundStat.objects.filter(market=market)
-        trades = Trade.objects.filter(trader=trader)
+        round_stats = list(market.round_stats().order_by('round'))
+        last_round_stat = round_stats[-1] if round_stats else None
+        trades = list(market.trades().filter(trader=trader).order_by('round'))
+        last_trade = trades[-1] if trades else None
 
         if request.method == 'POST':
             form = TradeForm(data=request.POST)
@@ -385,6 +446,7 @@ def play(request, market_id):
                 new_trade.round = market.round
                 new_trade.balance_before = trader.balance
                 new_trade.prod_cost = trader.prod_cost
+                new_trade.decision_seconds = market.seconds_since_round_start()
                 new_trade.save()
 
                 auto_play = form.cleaned_data['auto_play']
@@ -395,8 +457,8 @@ def play(request, market_id):
 
         elif request.method == 'GET':
 
-            if market.round > 0 and round_stats.last() is not None:
-                market_average = round_stats.last().avg_price
+            if market.round > 0 and last_round_stat is not None:
+                market_average = last_round_stat.avg_price
                 form = TradeForm(trader, market_average)
             else:
                 form = TradeForm(trader)
@@ -407,12 +469,17 @@ def play(request, market_id):
         else:
             round_labels = list(range(1, market.max_rounds + 1))
 
+        # A trader is waiting if he has traded in the current round (see Trader.should_be_waiting)
+        wait = last_trade is not None and last_trade.round == market.round
+
         context = {
             'market': market,
             'trader': trader,
             'form': form,
             'round_stats': round_stats,
+            'last_round_stat': last_round_stat,
             'trades': trades,
+            'last_trade': last_trade,
             'max_amount': floor(trader.balance/trader.prod_cost),
             'max_price': 4 * market.max_cost,
 
@@ -426,29 +493,69 @@ def play(request, market_id):
 
             # data for price graph
             'data_price_json': json.dumps([float(trade.unit_price) if (trade.unit_price != None) else None for trade in trades]),
-            'data_prod_cost_json': json.dumps(generate_prod_cost_list(market, trades, trader)),
+            'data_prod_cost_json': json.dumps(generate_prod_cost_list(market, trades, trader, wait)),
             'data_market_avg_price_json': json.dumps([float(round_stat.avg_price) for round_stat in round_stats]),
 
             # add data for balance graph
             'trader_balance_json': json.dumps(
-                generate_balance_list(trader)),
+                generate_balance_list(trader, [trade for trade in trades if trade.round < market.round])),
             'avg_balance_json': json.dumps([float(market.initial_balance)] +
                                            [float(round_stat.avg_balance_after) for round_stat in round_stats])
         }
 
-        context['wait'] = trader.should_be_waiting()
-
-        return render(request, 'market/play/play.html', context)
+        context['wait'] = wait
+        context['ranking'] = market.ranking()
+
+        response = render(request, 'market/play/play.html', context)
+        if token.from_session:
+            # Replace the session of a player who joined before the player tokens
+            playertoken.set_player_cookie(response, trader)
+        return response
+
+
+@query_budget(1)
+@replica_reads
+async def current_round(request, market_id):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    state = (await sync_to_async(market_states)([market_id])).get(market_id)
+    if state is None:
+        raise Http404
+    return JsonResponse(market_state_json(state))
+
+
+# No query budget: the watcher makes a query pr. second while the request waits
+@replica_reads
+async def wait_for_round(request, market_id):
+    """
+    Long polling: answers when the round, game_over or the number of ready or active traders differ
+    from the state given in the query string (as returned by the last request), or after push.WAIT_TIMEOUT seconds
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    shown = {
+        'round': _int_or_none(request.GET.get('round')),
+        'game_over': request.GET.get('game_over') == 'true',
+        'num_ready': _int_or_none(request.GET.get('num_ready_traders')),
+        'num_active': _int_or_none(request.GET.get('num_active_traders')),
+    }
+    state = await get_watcher().wait(market_id, shown)
+    if state is None:
+        raise Http404
+    return JsonResponse(market_state_json(state))
+
+
+def market_state_json(state):
+    return {
+        'round': state['round'],
+        'num_active_traders': state['num_active'],
+        'num_ready_traders': state['num_ready'],
+        'game_over': state['game_over'],
+    }
 
 
-@require_GET
-def current_round(request, market_id):
-    market = get_object_or_404(Market, market_id=market_id)
-    return JsonResponse(
-        {
-            'round': market.round,
-            'num_active_traders': market.num_active_traders(),
-            'num_ready_traders': market.num_ready_traders(),
-            'game_over': market.game_over
-        }
-    )
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None